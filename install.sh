@@ -12,7 +12,7 @@ hash npm 2>/dev/null || ({
 (cd spectrum/ui && ng build --base-href=.)
 
 # build Python egg (includes javascript built above)
-sudo apt-get install -y python-pip
+sudo apt-get install -y python-pip python-numpy
 sudo -H pip install -e .
 
 # copy default config to /etc/psm.yml
@@ -74,7 +74,7 @@ setup(
     # your project is installed. For an analysis of "install_requires" vs pip's
     # requirements files see:
     # https://packaging.python.org/en/latest/requirements.html
-    install_requires=['pyyaml', 'requests', 'pydub', 'flask', 'flask-login', 'python-slugify', 'pyzmq', 'gpiozero'],
+    install_requires=['pyyaml', 'requests', 'pydub', 'flask', 'flask-login', 'python-slugify', 'pyzmq', 'gpiozero', 'numpy'],
 
     # List additional groups of dependencies here (e.g. development
     # dependencies). You can install these using the following syntax,
@@ -2,7 +2,8 @@
 """
 import sys
 from spectrum.process import Process
-from spectrum.common import log, parse_config, now
+from spectrum.common import log, now
+from spectrum.peaks import sweep_peaks, peak_status
 from pyams import Sensor
 
 class Worker(Process):
@@ -21,7 +22,7 @@ class Worker(Process):
         """ Scan the spectrum, storing data through the config object, and yield status.
         """
         #FIXME the 'ams' parameter cold be replace by self.worker (or whatever) - do it automatically in the parent?
-        frange = parse_config(config.values, 'ams')[0] #FIXME assumes only a range
+        frange = config.scan_plan('ams').scan_config[0] #FIXME assumes only a range
 
         self.status.clear()
         yield
@@ -52,7 +53,6 @@ class Worker(Process):
                 time_0 = now()
                 self.status['sweep'] = {'timestamp': time_0}
                 self.status['sweep']['sweep_n'] = initial_count + sweep_idx #FIXME this sweep_n mechanism must go into process.py
-                freq_n = max(xrange(len(c_amps)), key=c_amps.__getitem__)
-                self.status['sweep']['peaks'] = [{'freq_n': freq_n, 'strength': c_amps[freq_n]}]
+                self.status['sweep']['peaks'] = peak_status(c_amps, sweep_peaks(c_amps))
                 config.write_spectrum(self.prefix, time_0, c_amps)
-                yield
+                yield True
@@ -0,0 +1,507 @@
+""" Benchmarks for the data store and server. Run with:
+
+        python -m spectrum.benchmark [name ...]
+
+    If no names are given, all benchmarks are run. Each benchmark prints a small table
+    of timings to stdout.
+"""
+import os
+import sys
+import json
+import shutil
+import zlib
+import resource
+import tempfile
+import itertools
+import multiprocessing
+from collections import OrderedDict
+from time import time, sleep
+import numpy
+from spectrum.binary_datastore import BinaryDataStore
+from spectrum.common import iter_json, ScanPlan
+from spectrum.peaks import find_peaks, sweep_peaks
+from spectrum.process import Process, StatusRegion
+from spectrum.rig_reader import RigReader
+from spectrum.schedule import AdaptiveSchedule
+from spectrum.verify import VerifyPolicy, VERIFY_MODES
+
+BENCHMARKS = OrderedDict()
+
+N_FREQ = 200
+WORKER = 'hamlib'
+
+
+def benchmark(fn):
+    """ Decorator registering a benchmark function by name.
+    """
+    BENCHMARKS[fn.__name__] = fn
+    return fn
+
+
+def _timeit(fn, repeat=10):
+    """ Return the mean time in ms for calling fn.
+    """
+    time_0 = time()
+    for _ in xrange(repeat):
+        fn()
+    return 1000.0 * (time() - time_0) / repeat
+
+
+def _data_store(n_sweeps, n_freq=N_FREQ, **kwargs):
+    """ Return a temporary data store path and a config with n_sweeps of spectrum data
+        (timestamps from 1 to n_sweeps), in a data store created with the given kwargs.
+    """
+    path = tempfile.mkdtemp()
+    config = BinaryDataStore(path, **kwargs).config().write(0, {'workers': [WORKER]})
+    sweep = [-50] * n_freq
+    with config.writer():
+        for timestamp in xrange(1, n_sweeps + 1):
+            config.write_spectrum(WORKER, timestamp, sweep)
+    return path, config
+
+
+@benchmark
+def range_query(sizes=(1000, 10000, 100000)):
+    """ Time for an incremental poll (the last 10 sweeps) against total sweeps stored.
+    """
+    print "{0:>10} {1:>10}".format('sweeps', 'poll (ms)')
+    for n_sweeps in sizes:
+        path, config = _data_store(n_sweeps)
+        try:
+            poll = lambda: list(config.iter_spectrum(WORKER, start=n_sweeps - 10))
+            print "{0:>10} {1:>10.3f}".format(n_sweeps, _timeit(poll))
+        finally:
+            shutil.rmtree(path)
+
+
+@benchmark
+def waterfall(sizes=(1000, 10000, 100000), max_sweeps=500, formats=('raw', 'block')):
+    """ Time and JSON payload size for loading a whole run, downsampled for the waterfall,
+        in each spectrum store format.
+    """
+    print "{0:>10} {1:>10} {2:>10} {3:>10}".format('format', 'sweeps', 'load (ms)', 'bytes')
+    for spectrum_format in formats:
+        for n_sweeps in sizes:
+            path, config = _data_store(n_sweeps, spectrum_format=spectrum_format)
+            try:
+                load = lambda: json.dumps(config.get_json(max_sweeps=max_sweeps))
+                print "{0:>10} {1:>10} {2:>10.3f} {3:>10}".format(spectrum_format, n_sweeps, _timeit(load), len(load()))
+            finally:
+                shutil.rmtree(path)
+
+
+@benchmark
+def write(n_freq=N_FREQ):
+    """ Time per Hamlib worker sweep written (spectrum and temperatures), buffered or not.
+    """
+    def _sweep(config):
+        for _ in xrange(n_freq):
+            config.write_temperature(WORKER, 0, '40.0')
+        config.write_spectrum(WORKER, 0, [-50] * n_freq)
+
+    print "{0:>10} {1:>10}".format('writer', 'sweep (ms)')
+    for buffered in (False, True):
+        path, config = _data_store(0)
+        try:
+            if buffered:
+                with config.writer():
+                    print "{0:>10} {1:>10.3f}".format('buffered', _timeit(lambda: _sweep(config)))
+            else:
+                print "{0:>10} {1:>10.3f}".format('none', _timeit(lambda: _sweep(config)))
+        finally:
+            shutil.rmtree(path)
+
+
+def _peak_rss(fn):
+    """ Return the growth in peak RSS (in KB) of a child process while calling fn.
+    """
+    def _child(queue):
+        rss_0 = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        fn()
+        queue.put(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - rss_0)
+
+    queue = multiprocessing.Queue()
+    process = multiprocessing.Process(target=_child, args=(queue,))
+    process.start()
+    rss = queue.get()
+    process.join()
+    return rss
+
+
+def _sweeps(n_sweeps, n_freq, noise):
+    """ Return n_sweeps random sweeps - a fixed profile plus uniform noise on every
+        frequency, or (if noise is False) a profile drifting by 1 on a tenth of them.
+    """
+    numpy.random.seed(0)
+    profile = numpy.random.randint(-80, -20, n_freq)
+    sweeps = []
+    for _ in xrange(n_sweeps):
+        if noise:
+            sweeps.append((profile + numpy.random.randint(-3, 4, n_freq)).tolist())
+        else:
+            drift = numpy.random.rand(n_freq) < 0.1
+            profile[drift] = numpy.clip(profile[drift] + numpy.random.randint(-1, 2, drift.sum()), -100, 0)
+            sweeps.append(profile.tolist())
+    return sweeps
+
+
+@benchmark
+def data_memory(sizes=(10000, 20000, 40000)):
+    """ Peak RSS growth (KB) for encoding a whole run as JSON (as for /data), with all the
+        data in memory (get_json) or streamed (iter_json of iter_data), and for streaming it
+        in the binary format (iter_binary).
+    """
+    print "{0:>10} {1:>10} {2:>10} {3:>10}".format('sweeps', 'get (KB)', 'iter (KB)', 'bin (KB)')
+    for n_sweeps in sizes:
+        path, config = _data_store(n_sweeps)
+        try:
+            get = lambda: len(json.dumps(config.get_json()))
+            stream = lambda: sum(len(chunk) for chunk in iter_json(config.iter_data()))
+            binary = lambda: sum(len(chunk) for chunk in config.iter_binary())
+            print "{0:>10} {1:>10} {2:>10} {3:>10}".format(n_sweeps, _peak_rss(get), _peak_rss(stream), _peak_rss(binary))
+        finally:
+            shutil.rmtree(path)
+
+
+@benchmark
+def wire_format(sizes=(1000, 10000), max_sweeps=None):
+    """ Time and payload size for the spectrum of a whole run (as for /data), encoded as
+        JSON or in the binary format.
+    """
+    print "{0:>10} {1:>10} {2:>10} {3:>10} {4:>10}".format('sweeps', 'json (ms)', 'json bytes', 'bin (ms)', 'bin bytes')
+    for n_sweeps in sizes:
+        path = tempfile.mkdtemp()
+        try:
+            config = BinaryDataStore(path).config().write(0, {'workers': [WORKER]})
+            with config.writer():
+                for timestamp, sweep in enumerate(_sweeps(n_sweeps, N_FREQ, True)):
+                    config.write_spectrum(WORKER, timestamp, sweep)
+            to_json = lambda: ''.join(iter_json(config.iter_data(max_sweeps=max_sweeps)))
+            to_binary = lambda: ''.join(config.iter_binary(max_sweeps=max_sweeps))
+            print "{0:>10} {1:>10.3f} {2:>10} {3:>10.3f} {4:>10}".format(
+                n_sweeps, _timeit(to_json, 3), len(to_json()), _timeit(to_binary, 3), len(to_binary()))
+        finally:
+            shutil.rmtree(path)
+
+
+@benchmark
+def compression(n_sweeps=2000, levels=(0, 1, 3, 6, 9)):
+    """ Compressed size and time to gzip /data JSON and binary payloads for noisy sweeps,
+        by zlib level (0 is uncompressed).
+    """
+    path = tempfile.mkdtemp()
+    try:
+        config = BinaryDataStore(path).config().write(0, {'workers': [WORKER]})
+        with config.writer():
+            for timestamp, sweep in enumerate(_sweeps(n_sweeps, N_FREQ, True)):
+                config.write_spectrum(WORKER, timestamp, sweep)
+        payloads = (('json', list(iter_json(config.iter_data()))), ('binary', list(config.iter_binary())))
+    finally:
+        shutil.rmtree(path)
+
+    def _gzip(chunks, level):
+        compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        return sum(len(compressor.compress(chunk)) for chunk in chunks) + len(compressor.flush())
+
+    print "{0:>10} {1:>10} {2:>10} {3:>10}".format('payload', 'level', 'bytes', 'gzip (ms)')
+    for name, chunks in payloads:
+        for level in levels:
+            print "{0:>10} {1:>10} {2:>10} {3:>10.3f}".format(
+                name, level, _gzip(chunks, level), _timeit(lambda: _gzip(chunks, level), 3))
+
+
+@benchmark
+def status_write(repeat=1000):
+    """ Time to write and read a worker status, through a JSON file (replaced on each
+        write) or a status region.
+    """
+    status = json.dumps({'sweep': {'timestamp': 1500000000000, 'sweep_n': 123, 'freq_n': 45, 'peaks': []}})
+    path = tempfile.mkdtemp()
+    try:
+        def _write_file():
+            tmp = os.path.join(path, 'status_tmp')
+            with open(tmp, 'w') as f:
+                f.write(status)
+            os.rename(tmp, os.path.join(path, 'status'))
+
+        def _read_file():
+            with open(os.path.join(path, 'status')) as f:
+                return json.loads(f.read())
+
+        region = StatusRegion(os.path.join(path, 'status_region'))
+        reader = StatusRegion(region.path)
+        print "{0:>10} {1:>10} {2:>10}".format('status', 'write (us)', 'read (us)')
+        for name, write, read in (('file', _write_file, _read_file),
+                                  ('region', lambda: region.write(status, 0), lambda: json.loads(reader.read()[2]))):
+            write_us = 1000 * _timeit(write, repeat)
+            print "{0:>10} {1:>10.1f} {2:>10.1f}".format(name, write_us, 1000 * _timeit(read, repeat))
+    finally:
+        shutil.rmtree(path)
+
+
+@benchmark
+def status_publish(n_freq=N_FREQ, freq_ms=1.0, n_sweeps=5):
+    """ Time per sweep for a simulated Hamlib worker (3 status changes per frequency, each
+        frequency taking freq_ms), publishing every change or coalescing them, through a
+        JSON file or a status region, and the number of status writes per sweep.
+    """
+    path = tempfile.mkdtemp()
+    try:
+        process = Process(None, 'benchmark', run_path=path, config_file=os.path.join(path, 'config'))
+
+        def _sweep():
+            process.status['sweep'] = {'timestamp': 0, 'peaks': []}
+            process._publish_status(True) # pylint: disable=protected-access
+            for freq_n in xrange(n_freq):
+                process.status['sweep']['current'] = {'freq_n': freq_n}
+                process._publish_status() # pylint: disable=protected-access
+                time_0 = time()
+                while time() < time_0 + freq_ms / 1000.0:
+                    pass # the rig
+                process.status['sweep']['current']['strength'] = -50
+                process._publish_status() # pylint: disable=protected-access
+                process.status['temp'] = '40.0'
+                process._publish_status() # pylint: disable=protected-access
+
+        print "{0:>10} {1:>10} {2:>10} {3:>10}".format('status', 'publish', 'sweep (ms)', 'writes')
+        for status_json in (True, False):
+            for publish_ms in (0, 250):
+                process.status_json = status_json
+                process.publish_ms = publish_ms
+                process.status_counts = {'published': 0, 'coalesced': 0}
+                sweep_ms = _timeit(_sweep, n_sweeps)
+                print "{0:>10} {1:>10} {2:>10.3f} {3:>10}".format(
+                    'file' if status_json else 'region', publish_ms, sweep_ms, process.status_counts['published'] // n_sweeps)
+    finally:
+        shutil.rmtree(path)
+
+
+@benchmark
+def storage(n_sweeps=10000, n_freq=N_FREQ):
+    """ Spectrum bytes stored (excluding downsampled levels), and time to read all sweeps
+        as tuples (iter) or arrays (get), for the raw and block formats.
+    """
+    print "{0:>10} {1:>10} {2:>10} {3:>10} {4:>10}".format('sweeps', 'format', 'bytes', 'iter (ms)', 'get (ms)')
+    for noise in (False, True):
+        sweeps = _sweeps(n_sweeps, n_freq, noise)
+        for spectrum_format in ('raw', 'block'):
+            path = tempfile.mkdtemp()
+            try:
+                config = BinaryDataStore(path, spectrum_format=spectrum_format).config().write(0, {'workers': [WORKER]})
+                with config.writer():
+                    for timestamp, sweep in enumerate(sweeps):
+                        config.write_spectrum(WORKER, timestamp, sweep)
+                s_path = os.path.join(path, 'data', '0', 'worker_' + WORKER, 'spectrum')
+                size = sum(os.path.getsize(os.path.join(root, name)) for root, _, names in os.walk(s_path)
+                           for name in names if '_' not in os.path.basename(root)) # not levels ([mode]_[factor])
+                read = lambda: list(config.iter_spectrum(WORKER))
+                get = lambda: numpy.asarray(config.get_spectrum(WORKER)[1]).sum()
+                print "{0:>10} {1:>10} {2:>10} {3:>10.3f} {4:>10.3f}".format(
+                    'noisy' if noise else 'drifting', spectrum_format, size, _timeit(read, 3), _timeit(get, 3))
+            finally:
+                shutil.rmtree(path)
+
+
+@benchmark
+def rds_query(sizes=(10000, 100000), n_freqs=100):
+    """ Time for RDS text queries against the number of records stored (over n_freqs
+        frequencies) - the last 10 records, all records for one frequency, and the same
+        for a stream without posting lists (scanned).
+    """
+    print "{0:>10} {1:>10} {2:>10} {3:>10}".format('records', 'last (ms)', 'freq (ms)', 'scan (ms)')
+    for n_records in sizes:
+        path = tempfile.mkdtemp()
+        try:
+            config = BinaryDataStore(path, segment_secs=0).config().write(0, {'workers': [WORKER]})
+            with config.writer():
+                for timestamp in xrange(n_records):
+                    config.write_rds_text(WORKER, timestamp, timestamp % n_freqs, 'Radio text')
+            last = lambda: list(config.iter_rds_text(WORKER, start=n_records - 11))
+            freq = lambda: list(config.iter_rds_text(WORKER, freq_n=n_freqs // 2))
+            times = _timeit(last), _timeit(freq)
+            shutil.rmtree(os.path.join(path, 'data', '0', 'worker_' + WORKER, 'rds', 'text', 'freqs'))
+            print "{0:>10} {1:>10.3f} {2:>10.3f} {3:>10.3f}".format(n_records, times[0], times[1], _timeit(freq, 3))
+        finally:
+            shutil.rmtree(path)
+
+
+@benchmark
+def config_list(sizes=(10, 100, 300)):
+    """ Time for listing all configs (as for GET /config) against the number of configs.
+    """
+    print "{0:>10} {1:>10}".format('configs', 'list (ms)')
+    for n_configs in sizes:
+        path = tempfile.mkdtemp()
+        try:
+            data_store = BinaryDataStore(path)
+            for timestamp in xrange(n_configs):
+                config = data_store.config().write(timestamp, {'workers': [WORKER]})
+                config.write_spectrum(WORKER, timestamp, [-50] * N_FREQ)
+            print "{0:>10} {1:>10.3f}".format(n_configs, _timeit(lambda: list(data_store.iter_config())))
+        finally:
+            shutil.rmtree(path)
+
+
+@benchmark
+def config_read(sizes=(1, 10, 50), repeat=100):
+    """ Time for reading a config and its scan plan (as for each /data or /export request)
+        against the number of frequency ranges in its values - uncached and cached.
+    """
+    print "{0:>10} {1:>10} {2:>10}".format('ranges', 'read (ms)', 'cached (ms)')
+    for n_ranges in sizes:
+        path = tempfile.mkdtemp()
+        try:
+            freqs = [{'range': [88 + i, 89 + i, 0.025], 'exp': 6, 'enabled': True} for i in xrange(n_ranges)]
+            values = {'workers': [WORKER], WORKER: {'freqs': freqs, 'audio': {'enabled': False, 'threshold': -20}},
+                      'rig': {'model': 1, 'radio_on': 2, 'retries': 3}, 'ident': {'name': 'Box', 'description': 'Test'}}
+            config_id = BinaryDataStore(path).config().write(0, values).id
+            times = []
+            for cache_size in (0, 16):
+                data_store = BinaryDataStore(path, config_cache_size=cache_size)
+                read = lambda: data_store.config(config_id).read().scan_plan(WORKER)
+                times.append(_timeit(read, repeat))
+            print "{0:>10} {1:>10.3f} {2:>10.3f}".format(n_ranges, *times)
+        finally:
+            shutil.rmtree(path)
+
+
+@benchmark
+def scan_lookup(sizes=(100, 1000, 10000), n_rows=1000):
+    """ Time for n_rows freq_n to frequency lookups (as for RDS export) against the number
+        of channels - generating the scan each time, and using a (cached) ScanPlan.
+    """
+    print "{0:>10} {1:>10} {2:>10}".format('channels', 'scan (ms)', 'plan (ms)')
+    for n_freq in sizes:
+        scan_config = [[88000000, 88000000 + n_freq * 1000, 1000]]
+        rows = [i * 7919 % n_freq for i in xrange(n_rows)]
+        def _generate(): # as common.scan() used to
+            idx = 0
+            for freq in itertools.chain(*[xrange(*x) for x in scan_config]):
+                yield idx, freq
+                idx += 1
+        def _scan():
+            for freq_n in rows:
+                next(itertools.islice(_generate(), freq_n, None))
+        def _plan():
+            plan = ScanPlan.get(scan_config)
+            for freq_n in rows:
+                plan[freq_n] # pylint: disable=pointless-statement
+        print "{0:>10} {1:>10.3f} {2:>10.3f}".format(n_freq, _timeit(_scan, 3), _timeit(_plan, 3))
+
+
+@benchmark
+def peaks(sizes=(1000, 10000, 100000), threshold=-40):
+    """ Time for finding the peaks in a noisy sweep against the number of channels - with
+        a three sample window in Python (as the Hamlib worker used to), with find_peaks
+        (threshold only), and with the configured prominence, separation and limit.
+    """
+    print "{0:>10} {1:>10} {2:>10} {3:>10}".format('channels', 'window (ms)', 'find (ms)', 'sweep (ms)')
+    for n_freq in sizes:
+        sweep = _sweeps(1, n_freq, True)[0]
+        def _window():
+            found = []
+            w = [(None,) * 2] * 3
+            for idx, strength in enumerate(sweep):
+                w = [w[1], w[2], (strength, idx)]
+                if w[0][0] < w[1][0] and w[1][0] >= threshold and w[1][0] >= w[2][0]:
+                    found.append(w[1][1])
+            if w[1][0] < w[2][0] and w[2][0] >= threshold:
+                found.append(w[2][1])
+            return found
+        find = lambda: find_peaks(sweep, threshold=threshold, prominence=None, separation=None)
+        assert find().tolist() == _window()
+        print "{0:>10} {1:>10.3f} {2:>10.3f} {3:>10.3f}".format(
+            n_freq, _timeit(_window), _timeit(find), _timeit(lambda: sweep_peaks(sweep, threshold)))
+
+
+@benchmark
+def adaptive_scan(sizes=(200, 1000, 10000), busy=0.02, n_sweeps=50, threshold=-30):
+    """ Channels measured per sweep (each a rig round trip) with a fraction of busy channels,
+        after a warm up, scanning every channel and with an adaptive schedule - and so how
+        much more often busy channels are revisited, and the time for scheduling a sweep.
+    """
+    print "{0:>10} {1:>10} {2:>10} {3:>10} {4:>10}".format('channels', 'full', 'adaptive', 'revisit', 'time (ms)')
+    numpy.random.seed(0)
+    for n_freq in sizes:
+        profile = numpy.random.randint(-80, -60, n_freq)
+        profile[numpy.random.rand(n_freq) < busy] = -20
+        schedule = AdaptiveSchedule(n_freq, threshold=threshold)
+        measured = []
+        time_0 = time()
+        for _ in xrange(n_sweeps):
+            due = schedule.due()
+            levels = profile + numpy.random.randint(-3, 4, n_freq)
+            schedule.update(due, numpy.where(due, levels, -128))
+            measured.append(due.sum())
+        ms = (time() - time_0) * 1000 / n_sweeps
+        mean = numpy.mean(measured[n_sweeps // 2:])
+        print "{0:>10} {1:>10} {2:>10.1f} {3:>9.1f}x {4:>10.3f}".format(n_freq, n_freq, mean, n_freq / mean, ms)
+
+
+@benchmark
+def rig_pipeline(rig_ms=(2, 10, 40), bookkeeping_ms=2, n_freq=50):
+    """ Sweeps per minute against the time for each rig read (simulated, as a sleep during
+        which the GIL is released) with bookkeeping_ms of other work per channel - reading
+        serially, and with a RigReader thread.
+    """
+    print "{0:>10} {1:>10} {2:>10} {3:>10}".format('rig (ms)', 'serial', 'pipelined', 'gain')
+    freqs = [(idx, idx) for idx in xrange(n_freq)]
+    for read_ms in rig_ms:
+        read = lambda _, read_ms=read_ms: sleep(read_ms / 1000.0)
+        def _serial():
+            for _, freq in freqs:
+                read(freq)
+                sleep(bookkeeping_ms / 1000.0)
+        reader = RigReader(read)
+        reader.start()
+        def _pipelined():
+            for _ in reader.sweep(freqs):
+                sleep(bookkeeping_ms / 1000.0)
+        times = _timeit(_serial, 3), _timeit(_pipelined, 3)
+        reader.close()
+        print "{0:>10} {1:>10.1f} {2:>10.1f} {3:>9.2f}x".format(read_ms, 60000 / times[0], 60000 / times[1], times[0] / times[1])
+
+
+@benchmark
+def verify_modes(fail_rates=(0.0, 0.01), n_freq=200, n_sweeps=20, set_check=2):
+    """ Rig round trips (set and get frequency) per sweep for each verify mode, against the
+        fraction of sets the (simulated) rig fails to act on - and the number of channels
+        per sweep read at the wrong frequency (undetected mismatches).
+    """
+    print "{0:>10} {1:>10} {2:>10} {3:>10}".format('fail rate', 'mode', 'trips', 'wrong')
+    for fail_rate in fail_rates:
+        for mode in VERIFY_MODES:
+            numpy.random.seed(0)
+            policy = VerifyPolicy(mode)
+            rig = {'freq': None, 'trips': 0}
+            def _set(freq):
+                rig['trips'] += 1
+                if numpy.random.rand() >= fail_rate:
+                    rig['freq'] = freq
+            def _get():
+                rig['trips'] += 1
+                return rig['freq']
+            wrong = 0
+            for _ in xrange(n_sweeps):
+                for freq in xrange(n_freq):
+                    policy.set(freq, _set, _get, set_check)
+                    wrong += rig['freq'] != freq
+            print "{0:>10} {1:>10} {2:>10.1f} {3:>10.2f}".format(fail_rate, mode, float(rig['trips']) / n_sweeps,
+                                                                float(wrong) / n_sweeps)
+
+
+def main():
+    """ Run the named benchmarks (or all of them).
+    """
+    names = sys.argv[1:] or BENCHMARKS.keys()
+    for name in names:
+        if name not in BENCHMARKS:
+            print >>sys.stderr, "No such benchmark: {0}".format(name)
+            sys.exit(1)
+        print "{0}: {1}".format(name, BENCHMARKS[name].__doc__.strip())
+        BENCHMARKS[name]()
+        print
+
+
+if __name__ == '__main__':
+    main()
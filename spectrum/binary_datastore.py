@@ -8,10 +8,17 @@
       |       +----- config                    JSON format config file
       |       +----- worker_[worker]           Worker data is stored independantly
                           |
+                          +----- summary        Binary (struct) format generation, then first/latest/count for each stream
                           +----- spectrum
                           |          |
                           |          +----- format         Binary (struct) format n_freq and timestamps file
                           |          +----- data           Binary (struct) format spectrum data
+                          |          +----- blocks         Block format compressed blocks of spectrum data
+                          |          +----- index          Block format first timestamp/offset/size of blocks
+                          |          +----- [mode]_[factor]
+                          |                         |
+                          |                         +----- timestamps   Downsampled (max or mean) spectrum
+                          |                         +----- data         over each [factor] sweeps
                           +----- audio
                           |          |
                           |          +----- timestamps     Binary (struct) format timestamps file
@@ -32,13 +39,37 @@
                           |         +----- data            Binary (struct) format error data
 
     The format file contains the timestamp of config creation.
+
+    Spectrum data is stored raw (n_freq bytes per sweep) or, if an index file is present,
+    in block format: blocks of sweeps, each sweep delta encoded against the previous one
+    and the block compressed with zlib. In block format, the data file holds only sweeps
+    not yet in a block, after the index of its first sweep.
+
+    Each stream directory (spectrum, audio, rds name and text, temperature and error) may
+    instead be split into time segments, with a binary format segments file listing the
+    start timestamp of each, and a [start] subdirectory for each, laid out as the stream
+    directory would be. A stream's records at timestamps from the start of one segment up
+    to the start of the next are found in that segment, and all segments but the latest
+    are sealed (complete, and not written again).
+
+    Downsampled spectrum levels are maintained as spectrum data is written, for
+    serving long runs at a limited number of sweeps.
 """
+import hashlib
 import json
 import os
 import shutil
 import struct
+import zlib
+from contextlib import contextmanager
+from itertools import chain
+from time import time
+import numpy
 from spectrum.common import mkdirs
-from spectrum.datastore import DataStore, ConfigBase, Settings, StoreError
+from spectrum.cache import LRUCache
+from spectrum.datastore import DataStore, ConfigBase, Settings, StoreError, downsample
+from spectrum.config import WRITE_BUFFER_SIZE, WRITE_BUFFER_SECS, SPECTRUM_STORE_FORMAT, SPECTRUM_STORE_BLOCK_SWEEPS, \
+                            DATA_SEGMENT_SECS, CONFIG_CACHE_SIZE
 
 
 class _Struct(struct.Struct):
@@ -62,11 +93,225 @@ class _Struct(struct.Struct):
     def fwrite(self, f, value):
         """ Pack and write bytes to the given file object for the given value.
         """
-        raw = self.pack(*value) if self.array else self.pack(value)
-        f.write(raw)
+        f.write(self.pack_value(value))
+
+    def pack_value(self, value):
+        """ Return packed bytes for the given value.
+        """
+        return self.pack(*value) if self.array else self.pack(value)
 
 _T_STRUCT = _Struct('Q')
 _N_STRUCT = _Struct('I')
+_S_STRUCT = _Struct('QQQ', True) # summary first, latest and count
+_G_STRUCT = _Struct('Q') # summary generation
+_B_STRUCT = _Struct('QQI', True) # block index first timestamp, offset and size
+_P_STRUCT = _Struct('QI', True) # posting list timestamp and record index
+_T_DTYPE = numpy.dtype('=u8') # numpy equivalent of _T_STRUCT
+
+
+def _bisect(f, header, size, lo, hi, timestamp):
+    """ Return the index of the first record, between lo and hi, with a timestamp later
+        than the one given. Records are fixed width (size bytes), start with a timestamp,
+        and follow a header of the given number of bytes. Timestamps are assumed to be
+        monotonic (as they are append only).
+    """
+    while lo < hi:
+        mid = (lo + hi) // 2
+        f.seek(header + mid * size)
+        if _T_STRUCT.fread(f) <= timestamp:
+            lo = mid + 1
+        else:
+            hi = mid
+    return lo
+
+
+def _find_range(f, header, size, start, end):
+    """ Return the range of record indices (i0, i1) in the given file with timestamps
+        later than start and no later than end (either may be None, for unbounded).
+    """
+    f.seek(0, os.SEEK_END)
+    n = (f.tell() - header) // size
+    i0 = 0 if start is None else _bisect(f, header, size, 0, n, start)
+    i1 = n if end is None else _bisect(f, header, size, i0, n, end)
+    return i0, i1
+
+
+class _Writer(object):
+    """ Buffered writer for appending to data store files. File handles are kept open
+        until the writer is closed, and writes are buffered until flush_size bytes are
+        pending or flush_secs have elapsed since the last flush.
+
+        Files written with index=True (timestamps files) are flushed after other files,
+        so that readers never find a timestamp for data not yet written.
+    """
+    def __init__(self, flush_size=0, flush_secs=0):
+        self.flush_size = flush_size
+        self.flush_secs = flush_secs
+        self._files = {}
+        self._sizes = {}
+        self._buffers = {}
+        self._index = set()
+        self._pending = 0
+        self._flush_time = time()
+
+    def size(self, path):
+        """ Return the size of the file at path, including any buffered bytes.
+        """
+        if path not in self._sizes:
+            self._sizes[path] = os.path.getsize(path) if os.path.exists(path) else 0
+        return self._sizes[path]
+
+    def write(self, path, raw, index=False):
+        """ Buffer bytes for appending to the file at path.
+        """
+        if path not in self._buffers:
+            self._buffers[path] = []
+            if index:
+                self._index.add(path)
+        self._buffers[path].append(raw)
+        self._sizes[path] = self.size(path) + len(raw)
+        self._pending += len(raw)
+
+    def check(self):
+        """ Flush buffered writes if the flush policy requires it, returning whether
+            a flush took place.
+        """
+        if self._pending >= self.flush_size or time() - self._flush_time >= self.flush_secs:
+            self.flush()
+            return True
+        return False
+
+    def flush(self):
+        """ Write all buffered bytes to their files.
+        """
+        for path in sorted(self._buffers, key=lambda p: p in self._index):
+            buf = self._buffers[path]
+            if len(buf) == 0:
+                continue
+            if path not in self._files:
+                mkdirs(path)
+                self._files[path] = open(path, 'a')
+            f = self._files[path]
+            f.write(''.join(buf))
+            f.flush()
+            del buf[:]
+        self._pending = 0
+        self._flush_time = time()
+
+    def replace(self, path, raw):
+        """ Flush buffered writes, then replace the file at path with the given bytes.
+        """
+        self.flush()
+        if path in self._files:
+            self._files.pop(path).close()
+        mkdirs(path)
+        tmp = '{0}_tmp'.format(path)
+        with open(tmp, 'w') as f:
+            f.write(raw)
+        os.rename(tmp, path)
+        self._sizes[path] = len(raw)
+
+    def release(self, path):
+        """ Flush buffered writes, then close any files under the given directory.
+        """
+        self.flush()
+        prefix = os.path.join(path, '')
+        for f_path in [f_path for f_path in self._files if f_path.startswith(prefix)]:
+            self._files.pop(f_path).close()
+            self._buffers.pop(f_path, None)
+            self._sizes.pop(f_path, None)
+
+    def close(self):
+        """ Flush buffered writes and close all files.
+        """
+        try:
+            self.flush()
+        finally:
+            for f in self._files.itervalues():
+                f.close()
+            self._files.clear()
+
+
+class _Level(object):
+    """ Accumulates spectrum sweeps for one downsampled level, combining each group of
+        factor sweeps (see downsample()).
+    """
+    def __init__(self, factor):
+        self.factor = factor
+        self.count = 0
+        self.timestamp = None
+        self.max = None
+        self.sum = None
+        self.valid = None
+
+    def add(self, timestamp, strengths):
+        """ Add a sweep (int8 array), returning (timestamp, max, mean) if it completes a group.
+        """
+        valid = strengths > -128
+        if self.count == 0:
+            self.timestamp = timestamp
+            self.max = strengths.copy()
+            self.sum = numpy.where(valid, strengths, 0).astype(numpy.int32)
+            self.valid = valid.astype(numpy.int32)
+        else:
+            numpy.maximum(self.max, strengths, out=self.max)
+            self.sum += numpy.where(valid, strengths, 0)
+            self.valid += valid
+        self.count += 1
+        return self._group() if self.count == self.factor else None
+
+    def close(self):
+        """ Return (timestamp, max, mean) for the sweeps of an incomplete group, if any.
+        """
+        return self._group() if self.count > 0 else None
+
+    def _group(self):
+        self.count = 0
+        mean = numpy.where(self.valid > 0, numpy.round(self.sum / numpy.maximum(self.valid, 1.0)), -128)
+        return self.timestamp, self.max, mean.astype(numpy.int8)
+
+
+class _Blocks(object):
+    """ Sweeps of a block format spectrum not yet sealed in a block.
+    """
+    def __init__(self, sweeps, n_blocks=0):
+        self.sweeps = sweeps
+        self.n_blocks = n_blocks
+        self.pending = []
+        self.timestamp = None
+
+
+def _encode_block(strengths):
+    """ Return compressed bytes for a block of sweeps (2-D int8 array), each sweep delta
+        encoded against the previous one (int8 arithmetic wraps, so this is lossless).
+    """
+    deltas = numpy.concatenate((strengths[:1], numpy.diff(strengths, axis=0)))
+    return zlib.compress(deltas.tostring())
+
+
+def _decode_block(raw, n_freq):
+    """ Return the sweeps (2-D int8 array) for compressed block bytes.
+    """
+    deltas = numpy.frombuffer(zlib.decompress(raw), dtype=numpy.int8).reshape(-1, n_freq)
+    return numpy.cumsum(deltas, axis=0, dtype=numpy.int8)
+
+
+def _empty_spectrum(n_freq=0):
+    """ Return empty (timestamps, strengths) arrays as returned by Config.get_spectrum().
+    """
+    return numpy.empty((0,), dtype=_T_DTYPE), numpy.empty((0, n_freq), dtype=numpy.int8)
+
+
+def _concatenate(parts):
+    """ Concatenate a list of (timestamps, strengths) arrays, without copying if only one
+        of them is not empty.
+    """
+    non_empty = [part for part in parts if len(part[0]) > 0]
+    if len(non_empty) == 0:
+        return parts[0] if len(parts) > 0 else _empty_spectrum()
+    if len(non_empty) == 1:
+        return non_empty[0]
+    return tuple(numpy.concatenate(arrays) for arrays in zip(*non_empty))
 
 
 class BinaryDataStore(DataStore):
@@ -74,9 +319,14 @@ class BinaryDataStore(DataStore):
     """
     INDEX = 'index'
 
-    def __init__(self, data_path):
+    def __init__(self, data_path, spectrum_format=SPECTRUM_STORE_FORMAT, block_sweeps=SPECTRUM_STORE_BLOCK_SWEEPS,
+                 segment_secs=DATA_SEGMENT_SECS, config_cache_size=CONFIG_CACHE_SIZE):
         super(BinaryDataStore, self).__init__(data_path)
+        self.config_cache = LRUCache(config_cache_size)
         self.index_path = os.path.join(data_path, self.INDEX)
+        self.spectrum_format = spectrum_format
+        self.block_sweeps = block_sweeps
+        self.segment_secs = segment_secs
 
         # initialise index directory
         if not os.path.exists(self.index_path):
@@ -115,6 +365,10 @@ class Config(ConfigBase):
     CONFIG = 'config'
     TIMESTAMPS = 'timestamps'
     DATA = 'data'
+    INDEX = 'index'
+    BLOCKS = 'blocks'
+    SEGMENTS = 'segments'
+    FREQS = 'freqs'
 
     SPECTRUM = 'spectrum'
     SPECTRUM_TIMES = os.path.join(SPECTRUM, TIMESTAMPS)
@@ -140,50 +394,241 @@ class Config(ConfigBase):
     ERROR_TIMES = os.path.join(ERROR, TIMESTAMPS)
     ERROR_DATA = os.path.join(ERROR, DATA)
 
+    SUMMARY = 'summary'
+
+    # summarised streams, in summary file order: (timestamps file, name, header size, record size)
+    SUMMARY_STREAMS = (
+        (SPECTRUM_TIMES, 'spectrum', _N_STRUCT.size, _T_STRUCT.size),
+        (AUDIO_TIMES, 'audio', 0, _T_STRUCT.size),
+        (RDS_NAME_TIMES, 'rds_name', 0, _T_STRUCT.size + _N_STRUCT.size),
+        (RDS_TEXT_TIMES, 'rds_text', 0, _T_STRUCT.size + _N_STRUCT.size),
+        (TEMPERATURE_TIMES, 'temperature', 0, _T_STRUCT.size + _N_STRUCT.size),
+        (ERROR_TIMES, 'error', 0, _T_STRUCT.size + _N_STRUCT.size)
+    )
+    SUMMARY_NAMES = dict([(stream[0], stream[1]) for stream in SUMMARY_STREAMS])
+
+    # streams with a posting list (timestamps and record indices) for each freq_n
+    FREQ_INDEXED = (RDS_NAME_TIMES, RDS_TEXT_TIMES)
+
+    # downsampling factors and modes for stored spectrum levels
+    LEVEL_FACTORS = (4, 16, 64, 256)
+    LEVEL_MODES = ('max', 'mean')
+
+    # number of sweeps unpacked at a time by iter_spectrum
+    ITER_SWEEPS = 1024
+
+    # streams contributing to the first and latest times of the config
+    RANGE_STREAMS = ('spectrum', 'audio', 'rds_name', 'rds_text')
+
+    _writer = None
+
+    def __init__(self, data_store, **kwargs):
+        super(Config, self).__init__(data_store, **kwargs)
+        self._summaries = {}
+        self._generations = {}
+        self._dirty = set()
+        self._levels = {}
+        self._blocks = {}
+        self._segments = {}
+
     def read(self):
-        """ Read config attributes from the data store.
+        """ Read config attributes from the data store. The config values (and scan plans)
+            are cached by the data store while the config files are unchanged, and so are
+            shared between Config objects (and should not be modified). Worker summaries
+            are cached separately, while their generations are unchanged.
         """
+        cache = self._data_store.config_cache
+        cached = cache.get(self.id)
+        stat = self._stat([self.CONFIG, self.FORMAT])
+        if cached is None or cached['stat'] != stat:
+            cached = self._read_config()
+            cached['stat'] = stat
+            cache.put(self.id, cached)
+        self.values = cached['values']
+        self.timestamp = cached['timestamp']
+        self.n_freq = cached['n_freq']
+        self._plans = cached['plans']
+
+        workers = self._workers()
+        # summaries are written in place, so their stat may not change - compare generations
+        generations = (workers, [self._read_summary_raw(worker)[0] for worker in workers])
+        if cached['summaries'][0] != generations:
+            summaries = dict((worker, self._read_summary(worker)) for worker in workers)
+            generations = (workers, [self._generations.get(worker) for worker in workers])
+            cached['summaries'] = (generations, summaries)
+        for worker, summary in cached['summaries'][1].iteritems():
+            self._summaries[worker] = dict((name, dict(stream)) for name, stream in summary.iteritems())
+        self._read_range(workers)
+        return self
+
+    # return the config's workers (those with stored data, if the values do not list them)
+    def _workers(self):
+        workers = self.values.get('workers')
+        if workers is None:
+            prefix = self.WORKER_PREFIX
+            c_path = os.path.join(self._data_store.data_path, self.id)
+            names = os.listdir(c_path) if os.path.isdir(c_path) else []
+            workers = [name[len(prefix):] for name in names if name.startswith(prefix)]
+        return workers
+
+    # read the config values, timestamp and number of frequencies
+    def _read_config(self):
         c_path = os.path.join(self._data_store.data_path, self.id)
         try:
             with open(os.path.join(c_path, self.CONFIG)) as f:
-                self.values = json.loads(f.read())
+                values = json.loads(f.read())
             with open(os.path.join(c_path, self.FORMAT)) as f:
-                self.timestamp = _T_STRUCT.fread(f)
-                self.n_freq = _N_STRUCT.fread(f)
+                timestamp = _T_STRUCT.fread(f)
+                n_freq = _N_STRUCT.fread(f)
         except IOError as e:
             raise StoreError(str(e))
+        return {'values': values, 'timestamp': timestamp, 'n_freq': n_freq, 'plans': {}, 'summaries': (None, {})}
+
+    # return the modification time, size and inode of the given files in the config
+    # directory, or None for those missing
+    def _stat(self, names):
+        c_path = os.path.join(self._data_store.data_path, self.id)
+        stat = []
+        for path in [os.path.join(c_path, name) for name in names]:
+            try:
+                s = os.stat(path)
+                stat.append((s.st_mtime, s.st_size, s.st_ino))
+            except OSError:
+                stat.append(None)
+        return stat
+
+    # set the counts, first and latest times from the worker summaries
+    def _read_range(self, workers):
         firsts = []
         latests = []
         self.counts = {}
-        for filename in os.listdir(c_path):
-            if not filename.startswith(self.WORKER_PREFIX):
-                continue
-            worker = filename[len(self.WORKER_PREFIX):]
-            w_path = os.path.join(c_path, filename)
-            self.counts[worker] = 0
-
-            for name, offset, get_n in (
-                    (self.SPECTRUM_TIMES, _T_STRUCT.size, True),
-                    (self.AUDIO_TIMES, _T_STRUCT.size, False),
-                    (self.RDS_NAME_TIMES, _T_STRUCT.size + _N_STRUCT.size, False),
-                    (self.RDS_TEXT_TIMES, _T_STRUCT.size + _N_STRUCT.size, False)
-            ):
-                path = os.path.join(w_path, name)
-                if not os.path.exists(path):
-                    continue
-                with open(path) as f:
-                    n_freqs = _N_STRUCT.fread(f) if get_n else None
-                    firsts.append(_T_STRUCT.fread(f))
-                    f.seek(-offset, os.SEEK_END)
-                    latests.append(_T_STRUCT.fread(f))
-                    if name == self.SPECTRUM_TIMES: #FIXME while every worker stores one spectrum per iteration, this is ok...
-                        f.seek(0, os.SEEK_END)
-                        pos = f.tell()
-                        if get_n: pos -= _N_STRUCT.size
-                        self.counts[worker] = pos / _T_STRUCT.size #FIXME this isn't working because strength is stored by hamlib worker every second during audio recording, not once per sweep
+        for worker in workers:
+            summary = self._summaries[worker]
+            self.counts[worker] = summary['spectrum']['count'] if 'spectrum' in summary else 0
+            for name in self.RANGE_STREAMS:
+                if name in summary:
+                    firsts.append(summary[name]['first'])
+                    latests.append(summary[name]['latest'])
         self.first = min(firsts) if len(firsts) > 0 else None
         self.latest = max(latests) if len(latests) > 0 else None
-        return self
+
+    # return the generation and stream records of the summary file for a worker, or
+    # (None, None) if it is missing or not complete
+    def _read_summary_raw(self, worker):
+        try:
+            with open(os.path.join(self._worker_path(worker), self.SUMMARY)) as f:
+                raw = f.read()
+        except IOError:
+            return None, None
+        if len(raw) != _G_STRUCT.size + _S_STRUCT.size * len(self.SUMMARY_STREAMS):
+            return None, None
+        return _G_STRUCT.unpack_from(raw)[0], raw[_G_STRUCT.size:]
+
+    # read the summary for a worker, building it from the stored data if it is missing (only
+    # writers store summaries - readers may not have permission, and would race the writer)
+    def _read_summary(self, worker):
+        generation, raw = self._read_summary_raw(worker)
+        if raw is not None:
+            self._generations[worker] = generation
+            summary = {}
+            for i, (_, name, _, _) in enumerate(self.SUMMARY_STREAMS):
+                first, latest, count = _S_STRUCT.unpack_from(raw, i * _S_STRUCT.size)
+                if count > 0:
+                    summary[name] = {'first': first, 'latest': latest, 'count': count}
+            return summary
+        return self._build_summary(worker)
+
+    # build the summary for a worker from the first and last records in each timestamps file
+    def _build_summary(self, worker):
+        summary = {}
+        path = self._worker_path(worker)
+        for times_file, name, header, size in self.SUMMARY_STREAMS:
+            data_file = os.path.join(os.path.dirname(times_file), self.DATA)
+            for segment_file, _ in self._iter_segments(worker, times_file, data_file):
+                t_path = os.path.join(path, segment_file)
+                if not os.path.exists(t_path):
+                    continue
+                with open(t_path) as f:
+                    f.seek(0, os.SEEK_END)
+                    count = (f.tell() - header) // size
+                    if count <= 0:
+                        continue
+                    f.seek(header)
+                    first = _T_STRUCT.fread(f)
+                    f.seek(header + (count - 1) * size)
+                    latest = _T_STRUCT.fread(f)
+                if name in summary:
+                    summary[name]['latest'] = latest
+                    summary[name]['count'] += count
+                else:
+                    summary[name] = {'first': first, 'latest': latest, 'count': count}
+        return summary
+
+    # write the summary in place (it is fixed size), as replacing or truncating files is slow on
+    # ext4 - the generation is incremented on each write, so readers can tell it has changed
+    def _write_summary(self, worker, summary):
+        generation = self._generations.get(worker, 0) + 1
+        self._generations[worker] = generation
+        raw = [_G_STRUCT.pack_value(generation)]
+        for _, name, _, _ in self.SUMMARY_STREAMS:
+            stream = summary.get(name, {'first': 0, 'latest': 0, 'count': 0})
+            raw.append(_S_STRUCT.pack(stream['first'], stream['latest'], stream['count']))
+        fd = os.open(os.path.join(self._worker_path(worker), self.SUMMARY), os.O_WRONLY | os.O_CREAT, 0644)
+        try:
+            os.write(fd, ''.join(raw))
+        finally:
+            os.close(fd)
+
+    # return the summary for a worker being written, which must be loaded before any of the
+    # worker's records are written (or buffered, as they may be flushed before they are counted)
+    # - in a writer session, it is rebuilt in case an earlier one did not finish (carrying on
+    # from the stored generation)
+    def _writer_summary(self, worker):
+        summary = self._summaries.get(worker)
+        if summary is None:
+            if self._writer is not None:
+                self._generations[worker] = self._read_summary_raw(worker)[0] or 0
+                summary = self._build_summary(worker)
+            else:
+                summary = self._read_summary(worker)
+            self._summaries[worker] = summary
+        return summary
+
+    # update the summary for a record written to the given timestamps file
+    def _update_summary(self, worker, times_file, timestamp):
+        if times_file not in self.SUMMARY_NAMES:
+            return
+        summary = self._writer_summary(worker)
+        name = self.SUMMARY_NAMES[times_file]
+        if name in summary:
+            summary[name]['latest'] = timestamp
+            summary[name]['count'] += 1
+        else:
+            summary[name] = {'first': timestamp, 'latest': timestamp, 'count': 1}
+        self._dirty.add(worker)
+
+    # write summaries updated since they were last written (after the data has been flushed)
+    def _flush_summaries(self):
+        for worker in self._dirty:
+            self._write_summary(worker, self._summaries[worker])
+        self._dirty.clear()
+
+    def version(self):
+        """ Return a hash of the config timestamp and the worker summaries (the first and
+            latest timestamps and count of each stream) as at the last read, and of the
+            modification time of the audio samples directory (updated by wav2mp3).
+        """
+        parts = [self.id, str(self.timestamp)]
+        for worker in sorted(self._summaries):
+            summary = self._summaries[worker]
+            parts.append(worker)
+            for _, name, _, _ in self.SUMMARY_STREAMS:
+                if name in summary:
+                    parts.append('{0}:{first}:{latest}:{count}'.format(name, **summary[name]))
+        samples_path = os.path.join(self._data_store.samples_path, self.id)
+        if os.path.isdir(samples_path):
+            parts.append(repr(os.path.getmtime(samples_path)))
+        return hashlib.sha1('\n'.join(parts)).hexdigest()
 
     def write(self, timestamp=None, values=None):
         """ Write config attributes to the data store.
@@ -191,6 +636,7 @@ class Config(ConfigBase):
         if values is not None:
             self.values = values
         self.id = str(timestamp)
+        self._data_store.config_cache.pop(self.id)
         path = os.path.join(self._data_store.data_path, self.id)
         try:
             os.mkdir(path)
@@ -219,118 +665,572 @@ class Config(ConfigBase):
         os.rename(_tmp, self._data_store.index_path)
         shutil.rmtree(os.path.join(self._data_store.data_path, self.id))
         self._delete_audio()
+        self._data_store.config_cache.pop(self.id)
         self.id = None # render config object useless (id no longer valid)
 
-    def _worker_path(self, worker, mkdir=True):
-        path = os.path.join(self._data_store.data_path, self.id, 'worker_' + worker)
-        if mkdir:
-            try:
-                os.mkdir(path)
-            except OSError:
-                pass
-        return path
+    def _worker_path(self, worker):
+        return os.path.join(self._data_store.data_path, self.id, self.WORKER_PREFIX + worker)
 
-    def _iter_data(self, worker, format_file, data_file, start, end, store_n=False):
-        seek = False
-        path = self._worker_path(worker, False)
-        f_path = os.path.join(path, format_file)
-        d_path = os.path.join(path, data_file)
-        if not os.path.exists(f_path) or not os.path.exists(d_path):
-            return
-        with open(f_path, 'r') as f_f, open(d_path, 'r') as f_d:
+    # return segment start timestamps for a stream, or None if the stream is not segmented
+    def _read_segments(self, worker, times_file):
+        path = os.path.join(self._worker_path(worker), os.path.dirname(times_file), self.SEGMENTS)
+        if not os.path.exists(path):
+            return None
+        with open(path) as f:
+            raw = f.read()
+        n = len(raw) // _T_STRUCT.size
+        return list(struct.unpack('{0}Q'.format(n), raw[:n * _T_STRUCT.size]))
+
+    def _segment_files(self, times_file, data_file, segment):
+        path = os.path.join(os.path.dirname(times_file), str(segment))
+        return os.path.join(path, os.path.basename(times_file)), os.path.join(path, os.path.basename(data_file))
+
+    # return (times_file, data_file) for each segment of a stream that may hold records in the
+    # range (or all), or just the files given if the stream is not segmented
+    def _iter_segments(self, worker, times_file, data_file, start=None, end=None):
+        segments = self._read_segments(worker, times_file)
+        if segments is None:
+            return [(times_file, data_file)]
+        files = []
+        for k, segment in enumerate(segments):
+            if end is not None and segment > end:
+                break
+            if start is not None and k + 1 < len(segments) and segments[k + 1] <= start:
+                continue
+            files.append(self._segment_files(times_file, data_file, segment))
+        return files
+
+    # return (times_file, data_file) to write a record at the given timestamp, starting a new
+    # segment if the timestamp is beyond the current one (after calling seal with the files of
+    # the current segment, which is not written again)
+    def _write_segment(self, worker, times_file, data_file, timestamp, seal=None):
+        key = (worker, times_file)
+        if key not in self._segments:
+            segments = self._read_segments(worker, times_file)
+            if segments is None:
+                # existing streams (and levels) are not segmented, new ones are if so configured
+                path = os.path.join(self._worker_path(worker), times_file)
+                if times_file in self.SUMMARY_NAMES and self._data_store.segment_secs > 0 and not os.path.exists(path):
+                    segments = []
+            self._segments[key] = segments
+        segments = self._segments[key]
+        if segments is None:
+            return times_file, data_file
+        size = self._data_store.segment_secs * 1000
+        if len(segments) == 0 or timestamp >= segments[-1] + size:
+            if len(segments) > 0:
+                if seal is not None:
+                    seal(worker, *self._segment_files(times_file, data_file, segments[-1]))
+                if self._writer is not None:
+                    self._writer.release(os.path.join(self._worker_path(worker), os.path.dirname(times_file), str(segments[-1])))
+            segments.append(timestamp - timestamp % size)
+            path = os.path.join(self._worker_path(worker), os.path.dirname(times_file), self.SEGMENTS)
+            mkdirs(path)
+            with open(path, 'a') as f:
+                _T_STRUCT.fwrite(f, segments[-1])
+        return self._segment_files(times_file, data_file, segments[-1])
+
+    def _iter_data(self, worker, format_file, data_file, start, end):
+        path = self._worker_path(worker)
+        for segment_file, segment_data in self._iter_segments(worker, format_file, data_file, start, end):
+            f_path = os.path.join(path, segment_file)
+            d_path = os.path.join(path, segment_data)
+            if not os.path.exists(f_path) or not os.path.exists(d_path):
+                continue
+            with open(f_path, 'r') as f_f, open(d_path, 'r') as f_d:
+                i0, i1 = _find_range(f_f, 0, _T_STRUCT.size, start, end)
+                f_f.seek(i0 * _T_STRUCT.size)
+                f_d.seek(i0 * _N_STRUCT.size)
+                for _ in xrange(i1 - i0):
+                    timestamp = _T_STRUCT.fread(f_f)
+                    value = _N_STRUCT.fread(f_d)
+                    if timestamp is None or value is None:
+                        return # data not (yet) written for the timestamp
+                    yield timestamp, value
+
+    def _write_data(self, worker, times_file, data_file, timestamp, data, store_n=False):
+        if times_file in self.SUMMARY_NAMES:
+            self._writer_summary(worker)
+        path = self._worker_path(worker)
+        segment_file, segment_data = self._write_segment(worker, times_file, data_file, timestamp)
+        t_path = os.path.join(path, segment_file)
+        with self._writing() as writer:
             if store_n:
-                n_freq = _N_STRUCT.fread(f_f)
-                _struct = _Struct('{0}b'.format(n_freq), True)
+                _struct = _Struct('{0}b'.format(len(data)), True)
+                if writer.size(t_path) == 0:
+                    writer.write(t_path, _N_STRUCT.pack(len(data)), True)
             else:
                 _struct = _N_STRUCT
-            while True:
-                timestamp = _T_STRUCT.fread(f_f)
-                if timestamp is None or (end is not None and timestamp > end):
+            writer.write(os.path.join(path, segment_data), _struct.pack_value(data))
+            writer.write(t_path, _T_STRUCT.pack(timestamp), True)
+            self._update_summary(worker, times_file, timestamp)
+
+    def _iter_freq_data(self, worker, times_file, data_file, start=None, end=None, offset=0, limit=None, freq_n=None):
+        path = self._worker_path(worker)
+        size = _T_STRUCT.size + _N_STRUCT.size
+        for segment_file, segment_data in self._iter_segments(worker, times_file, data_file, start, end):
+            t_path = os.path.join(path, segment_file)
+            d_path = os.path.join(path, segment_data)
+            if not os.path.exists(t_path) or not os.path.exists(d_path):
+                continue
+            with open(t_path, 'r') as f_t, open(d_path, 'r') as f_d:
+                if freq_n is None:
+                    i0, i1 = _find_range(f_t, 0, size, start, end)
+                    indices = None
+                else:
+                    indices = self._freq_indices(os.path.dirname(t_path), f_t, f_d, freq_n, start, end)
+                    i0, i1 = 0, len(indices)
+                if i0 + offset >= i1:
+                    offset -= max(0, i1 - i0) # skip the whole segment
+                    continue
+                i0, offset = i0 + offset, 0
+                if limit is not None:
+                    i1 = min(i1, i0 + limit)
+                    limit -= i1 - i0
+                if indices is None:
+                    records = self._read_freq_records(f_t, f_d, i0, i1)
+                else:
+                    records = chain.from_iterable(self._read_freq_records(f_t, f_d, i, i + 1) for i in indices[i0:i1])
+                for record in records:
+                    yield record
+                if limit == 0:
                     return
-                if not seek:
-                    if start is not None and timestamp <= start:
-                        continue
-                    pos = f_f.tell()
-                    if store_n:
-                        pos -= _N_STRUCT.size
-                    f_d.seek(_struct.size * (pos / _T_STRUCT.size - 1))
-                    seek = True
-                yield timestamp, _struct.fread(f_d)
-
-    def _write_data(self, worker, format_file, data_file, timestamp, data, store_n=False):
+
+    # return indices of records for freq_n in the range, from the posting list for freq_n in
+    # the given stream (segment) directory, or by reading every record in the range if the
+    # stream was written without posting lists
+    def _freq_indices(self, path, f_t, f_d, freq_n, start, end):
+        size = _T_STRUCT.size + _N_STRUCT.size
+        if os.path.isdir(os.path.join(path, self.FREQS)):
+            p_path = os.path.join(path, self.FREQS, str(freq_n))
+            if not os.path.exists(p_path):
+                return []
+            with open(p_path, 'r') as f_p:
+                j0, j1 = _find_range(f_p, 0, _P_STRUCT.size, start, end)
+                f_p.seek(j0 * _P_STRUCT.size)
+                raw = f_p.read((j1 - j0) * _P_STRUCT.size)
+            return [_P_STRUCT.unpack_from(raw, j * _P_STRUCT.size)[1] for j in xrange(len(raw) // _P_STRUCT.size)]
+        i0, i1 = _find_range(f_t, 0, size, start, end)
+        indices = []
+        for i in xrange(i0, i1):
+            f_t.seek(i * size + _T_STRUCT.size)
+            f_d.seek(_N_STRUCT.fread(f_t))
+            if _N_STRUCT.fread(f_d) == freq_n:
+                indices.append(i)
+        return indices
+
+    # yield (timestamp, freq_n, data) for records i0 to i1
+    def _read_freq_records(self, f_t, f_d, i0, i1): # pylint: disable=no-self-use
+        if i0 >= i1:
+            return
+        f_t.seek(i0 * (_T_STRUCT.size + _N_STRUCT.size))
+        timestamp, offset = _T_STRUCT.fread(f_t), _N_STRUCT.fread(f_t)
+        if offset is None:
+            return
+        f_d.seek(offset)
+        for _ in xrange(i0, i1):
+            timestamp1, offset1 = _T_STRUCT.fread(f_t), _N_STRUCT.fread(f_t)
+            size = offset1 - offset - _N_STRUCT.size if offset1 is not None else -1 # last record is the rest of the file
+            yield timestamp, _N_STRUCT.fread(f_d), f_d.read(size)
+            if offset1 is None:
+                return
+            timestamp, offset = timestamp1, offset1
+
+    def _write_freq_data(self, worker, times_file, data_file, timestamp, freq_n, data):
+        self._writer_summary(worker)
         path = self._worker_path(worker)
-        if store_n:
-            n_freq = len(data)
-            _struct = _Struct('{0}b'.format(n_freq), True)
+        segment_file, segment_data = self._write_segment(worker, times_file, data_file, timestamp)
+        t_path = os.path.join(path, segment_file)
+        d_path = os.path.join(path, segment_data)
+        with self._writing() as writer:
+            offset = writer.size(d_path)
+            index = writer.size(t_path) // (_T_STRUCT.size + _N_STRUCT.size)
+            writer.write(d_path, _N_STRUCT.pack(freq_n) + data)
+            writer.write(t_path, _T_STRUCT.pack(timestamp) + _N_STRUCT.pack(offset), True)
+            if times_file in self.FREQ_INDEXED:
+                # posting lists are kept for new streams only (so are complete if present)
+                p_path = os.path.join(os.path.dirname(t_path), self.FREQS, str(freq_n))
+                if index == 0:
+                    mkdirs(p_path)
+                if os.path.isdir(os.path.dirname(p_path)):
+                    writer.write(p_path, _P_STRUCT.pack(timestamp, index), True)
+            self._update_summary(worker, times_file, timestamp)
+    # yield the open writer, if any, otherwise a writer that writes through
+    @contextmanager
+    def _writing(self):
+        if self._writer is not None:
+            yield self._writer
+            if self._writer.check():
+                self._flush_summaries()
         else:
-            n_freq = None
-            _struct = _N_STRUCT
-        format_path = os.path.join(path, format_file)
-        if os.path.exists(format_path):
-            n_freq = None # if we already wrote n_freq, don't do it again
-        else:
-            mkdirs(format_path)
-        with open(format_path, 'a') as f:
-            if n_freq is not None:
-                _N_STRUCT.fwrite(f, n_freq)
-            _T_STRUCT.fwrite(f, timestamp)
-        with open(os.path.join(path, data_file), 'a') as f:
-            _struct.fwrite(f, data)
+            writer = _Writer()
+            try:
+                yield writer
+            finally:
+                writer.close()
+                self._flush_summaries()
+
+    @contextmanager
+    def writer(self, flush_size=WRITE_BUFFER_SIZE, flush_secs=WRITE_BUFFER_SECS):
+        """ Context manager within which writes are buffered, using append handles kept
+            open until exit. Buffered writes are flushed when flush_size bytes are pending,
+            when flush_secs have elapsed since the last flush, and on exit.
+        """
+        self._writer = _Writer(flush_size, flush_secs)
+        self._summaries.clear()
+        self._levels.clear()
+        self._blocks.clear()
+        if self.values is not None:
+            for worker in self._workers():
+                self._writer_summary(worker)
+        try:
+            yield self
+        finally:
+            writer, self._writer = self._writer, None
+            writer.close()
+            self._flush_summaries()
+
+    def flush(self, force=True):
+        """ Flush buffered writes (if force is False, only if due by the flush policy).
+        """
+        if self._writer is not None:
+            if force:
+                self._writer.flush()
+                self._flush_summaries()
+            elif self._writer.check():
+                self._flush_summaries()
 
-    def _iter_freq_data(self, worker, times_file, data_file, start=None, end=None):
-        timestamp0, offset0 = None, None
-        path = self._worker_path(worker, False)
+    def iter_spectrum(self, worker, start=None, end=None):
+        """ Yield (timestamp, strengths) for each spectrum sweep in the range (or all).
+        """
+        if self.values is None:
+            raise StoreError("Uninitialised config (call read or write)")
+        for times_file, data_file in self._iter_segments(worker, self.SPECTRUM_TIMES, self.SPECTRUM_DATA, start, end):
+            i0, i1 = self._find_sweeps(worker, times_file, start, end)
+            # map a chunk at a time, so memory use does not depend on the size of the range
+            for i in xrange(i0, i1, self.ITER_SWEEPS):
+                timestamps, strengths = self._map_sweeps(worker, times_file, data_file, i, min(i1, i + self.ITER_SWEEPS))
+                _struct = struct.Struct('{0}b'.format(strengths.shape[1]))
+                raw = strengths.tostring()
+                for j, timestamp in enumerate(timestamps.tolist()):
+                    yield timestamp, _struct.unpack_from(raw, j * _struct.size)
+                if len(timestamps) < self.ITER_SWEEPS:
+                    break # data lags timestamps
+
+    # map a segment and ITER_SWEEPS chunk at a time, unless downsampling (when no more than
+    # max_sweeps are returned), so that memory use does not depend on the size of the range
+    def _binary_spectrum(self, worker, start, end, max_sweeps, mode):
+        if self.values is None:
+            raise StoreError("Uninitialised config (call read or write)")
+        chunks, n_freq = [], 0
+        for times_file, data_file, i0, i1 in self._find_segments(worker, start, end):
+            # count only sweeps with data written, for the header
+            segment_n_freq, i1 = self._count_data(worker, times_file, data_file, i0, i1)
+            n_freq = n_freq or segment_n_freq
+            chunks.extend((times_file, data_file, i, min(i1, i + self.ITER_SWEEPS))
+                          for i in xrange(i0, i1, self.ITER_SWEEPS))
+        n_sweeps = sum(i1 - i0 for _, _, i0, i1 in chunks)
+        if max_sweeps is not None and n_sweeps > max_sweeps:
+            return super(Config, self)._binary_spectrum(worker, start, end, max_sweeps, mode)
+        path = self._worker_path(worker)
+        times_parts = (numpy.memmap(os.path.join(path, times_file), dtype=_T_DTYPE, mode='r',
+                                    offset=_N_STRUCT.size + i0 * _T_STRUCT.size, shape=(i1 - i0,))
+                       for times_file, _, i0, i1 in chunks)
+        strengths_parts = (self._map_sweeps(worker, *chunk)[1] for chunk in chunks)
+        return n_sweeps, n_freq if n_sweeps > 0 else 0, times_parts, strengths_parts
+
+    # return (n_freq, i1) for a spectrum segment, where i1 is reduced to the number of sweeps
+    # with data written (data may lag timestamps), found without reading any sweeps
+    def _count_data(self, worker, times_file, data_file, i0, i1):
+        path = self._worker_path(worker)
         t_path = os.path.join(path, times_file)
         d_path = os.path.join(path, data_file)
         if not os.path.exists(t_path) or not os.path.exists(d_path):
-            return
-        with open(t_path, 'r') as f_t, open(d_path, 'r') as f_d:
-            while True:
-                timestamp = _T_STRUCT.fread(f_t)
-                offset = _N_STRUCT.fread(f_t)
-                if timestamp is None or (end is not None and timestamp > end):
-                    break
-                if start is not None and timestamp <= start:
-                    continue
-                if offset0 is None:
-                    f_d.seek(offset)
-                    timestamp0 = timestamp
-                    offset0 = offset
-                    continue
-                size = offset - offset0 - _N_STRUCT.size
-                yield timestamp0, _N_STRUCT.fread(f_d), f_d.read(size)
-                timestamp0 = timestamp
-                offset0 = offset
-            if offset0 is not None:
-                size = offset - offset0 - _N_STRUCT.size if offset else -1
-                yield timestamp0, _N_STRUCT.fread(f_d), f_d.read(size)
+            return 0, i0
+        with open(t_path, 'r') as f:
+            n_freq = _N_STRUCT.fread(f)
+            if n_freq is None:
+                return 0, i0
+        i_path = os.path.join(path, os.path.dirname(data_file), self.INDEX)
+        if os.path.exists(i_path):
+            with open(i_path) as f_i:
+                block_sweeps = _N_STRUCT.fread(f_i)
+                n_sweeps = (os.path.getsize(i_path) - _N_STRUCT.size) // _B_STRUCT.size * block_sweeps
+            # as for _read_blocks, unsealed sweeps count only if the data file follows the blocks
+            with open(d_path) as f_d:
+                if _T_STRUCT.fread(f_d) == n_sweeps:
+                    n_sweeps += (os.path.getsize(d_path) - _T_STRUCT.size) // n_freq
+        else:
+            n_sweeps = os.path.getsize(d_path) // n_freq
+        return n_freq, max(i0, min(i1, n_sweeps))
 
-    def _write_freq_data(self, worker, times_file, data_file, timestamp, freq_n, data):
+    # return (times_file, data_file, i0, i1) for each spectrum segment with sweeps in the range,
+    # found from the timestamps only (so no sweeps are read, or decoded in block format)
+    def _find_segments(self, worker, start, end):
+        segments = []
+        for times_file, data_file in self._iter_segments(worker, self.SPECTRUM_TIMES, self.SPECTRUM_DATA, start, end):
+            segments.append((times_file, data_file) + self._find_sweeps(worker, times_file, start, end))
+        return segments
+
+    # return (i0, timestamps, strengths), where i0 is the index of the first sweep in the range
+    def _map_spectrum(self, worker, times_file, data_file, start, end):
+        i0, i1 = self._find_sweeps(worker, times_file, start, end)
+        return (i0,) + self._map_sweeps(worker, times_file, data_file, i0, i1)
+
+    # return the range of indices (i0, i1) of sweeps in a spectrum (or level) timestamps file
+    def _find_sweeps(self, worker, times_file, start, end):
+        t_path = os.path.join(self._worker_path(worker), times_file)
+        if not os.path.exists(t_path):
+            return 0, 0
+        with open(t_path, 'r') as f:
+            if _N_STRUCT.fread(f) is None:
+                return 0, 0
+            return _find_range(f, _N_STRUCT.size, _T_STRUCT.size, start, end)
+
+    # return (timestamps, strengths) for sweeps i0 to i1 (fewer, if data lags timestamps)
+    def _map_sweeps(self, worker, times_file, data_file, i0, i1):
         path = self._worker_path(worker)
         t_path = os.path.join(path, times_file)
-        mkdirs(t_path)
         d_path = os.path.join(path, data_file)
-        mkdirs(d_path)
-        with open(t_path, 'a') as f_t, open(d_path, 'a') as f_d:
-            _T_STRUCT.fwrite(f_t, timestamp)
-            _N_STRUCT.fwrite(f_t, f_d.tell())
-            _N_STRUCT.fwrite(f_d, freq_n)
-            f_d.write(data)
+        if not os.path.exists(t_path) or not os.path.exists(d_path):
+            return _empty_spectrum()
+        with open(t_path, 'r') as f:
+            n_freq = _N_STRUCT.fread(f)
+            if n_freq is None:
+                return _empty_spectrum()
+        if os.path.exists(os.path.join(path, os.path.dirname(data_file), self.INDEX)):
+            strengths = self._read_blocks(worker, data_file, n_freq, i0, i1)
+            i1 = i0 + len(strengths) # data may lag timestamps
+        else:
+            i1 = min(i1, os.path.getsize(d_path) // n_freq) # data may lag timestamps
+            strengths = None
+        if i1 <= i0:
+            return _empty_spectrum(n_freq)
+        offset = _N_STRUCT.size + i0 * _T_STRUCT.size
+        timestamps = numpy.memmap(t_path, dtype=_T_DTYPE, mode='r', offset=offset, shape=(i1 - i0,))
+        if strengths is None:
+            strengths = numpy.memmap(d_path, dtype=numpy.int8, mode='r', offset=i0 * n_freq, shape=(i1 - i0, n_freq))
+        return timestamps, strengths
 
-    def iter_spectrum(self, worker, start=None, end=None):
-        """ Yield (timestamp, strengths) for each spectrum sweep in the range (or all).
+    # return sweeps i0 to i1 of a block format spectrum (fewer, if not all are written yet)
+    # decoded from the blocks containing them, and from the unsealed sweeps in the data file
+    def _read_blocks(self, worker, data_file, n_freq, i0, i1):
+        path = os.path.join(self._worker_path(worker), os.path.dirname(data_file))
+        parts = []
+        with open(os.path.join(path, self.INDEX)) as f_i:
+            block_sweeps = _N_STRUCT.fread(f_i)
+            f_i.seek(0, os.SEEK_END)
+            n_blocks = (f_i.tell() - _N_STRUCT.size) // _B_STRUCT.size
+            b0, b1 = i0 // block_sweeps, min(n_blocks, -(-i1 // block_sweeps))
+            if b0 < b1:
+                f_i.seek(_N_STRUCT.size + b0 * _B_STRUCT.size)
+                records = [_B_STRUCT.fread(f_i) for _ in xrange(b1 - b0)]
+                with open(os.path.join(path, self.BLOCKS)) as f_b:
+                    f_b.seek(records[0][1])
+                    for _, _, size in records:
+                        parts.append(_decode_block(f_b.read(size), n_freq))
+        sealed = n_blocks * block_sweeps
+        if i1 > sealed:
+            # the data file starts with the index of its first sweep, so that a data file
+            # not yet replaced after sealing a block is ignored
+            with open(os.path.join(path, os.path.basename(data_file))) as f_d:
+                if _T_STRUCT.fread(f_d) == sealed:
+                    j0 = max(i0, sealed) - sealed
+                    f_d.seek(_T_STRUCT.size + j0 * n_freq)
+                    raw = f_d.read((i1 - sealed - j0) * n_freq)
+                    raw = raw[:len(raw) // n_freq * n_freq]
+                    parts.append(numpy.frombuffer(raw, dtype=numpy.int8).reshape(-1, n_freq))
+        if len(parts) == 0:
+            return _empty_spectrum(n_freq)[1]
+        offset = i0 - b0 * block_sweeps if b0 < b1 else 0
+        return numpy.concatenate(parts)[offset:offset + i1 - i0]
+
+    # return the number of sweeps stored in a spectrum (or level) timestamps file
+    def _count_sweeps(self, worker, times_file):
+        t_path = os.path.join(self._worker_path(worker), times_file)
+        if not os.path.exists(t_path):
+            return 0
+        return max(0, os.path.getsize(t_path) - _N_STRUCT.size) // _T_STRUCT.size
+
+    # return level files for the spectrum (segment) with the given timestamps file
+    def _level_files(self, times_file, mode, factor):
+        path = os.path.join(os.path.dirname(times_file), '{0}_{1}'.format(mode, factor))
+        return os.path.join(path, self.TIMESTAMPS), os.path.join(path, self.DATA)
+
+    def get_spectrum(self, worker, start=None, end=None, max_sweeps=None, mode='max'):
+        """ Return (timestamps, strengths) for spectrum sweeps in the range (or all), where
+            timestamps is a 1-D array and strengths a 2-D int8 array (sweeps x frequencies).
+            Where possible, these are read-only memory-mapped views on the stored data, so
+            no copies are made.
+
+            If max_sweeps is given, and there are more sweeps in the range, the largest
+            stored downsampled level (with the given mode, 'max' or 'mean') providing at
+            least max_sweeps is used instead (or the sweeps themselves, if there is none),
+            further downsampled to no more than max_sweeps.
         """
         if self.values is None:
             raise StoreError("Uninitialised config (call read or write)")
-        for _ in self._iter_data(worker, self.SPECTRUM_TIMES, self.SPECTRUM_DATA, start, end, True):
-            yield _
+        segments = self._find_segments(worker, start, end)
+        n_sweeps = sum(i1 - i0 for _, _, i0, i1 in segments)
+        if max_sweeps is None or n_sweeps <= max_sweeps:
+            return _concatenate([self._map_sweeps(worker, *segment) for segment in segments])
+        # a level with fewer than max_sweeps could only be reduced further, losing detail
+        factors = [f for f in self.LEVEL_FACTORS if -(-n_sweeps // f) >= max_sweeps]
+        if len(factors) == 0:
+            timestamps, strengths = _concatenate([self._map_sweeps(worker, *segment) for segment in segments])
+        else:
+            timestamps, strengths = _concatenate([self._get_level(worker, factors[-1], mode, start, end, *segment)
+                                                  for segment in segments])
+        return downsample(timestamps, strengths, -(-len(timestamps) // max_sweeps), mode)
+
+    # return the downsampled level of a spectrum segment for the range, given the indices of
+    # its sweeps in the range
+    def _get_level(self, worker, factor, mode, start, end, times_file, data_file, i0, i1):
+        level_file, level_data = self._level_files(times_file, mode, factor)
+        _, level_times, level_strengths = self._map_spectrum(worker, level_file, level_data, start, end)
+
+        # only sweeps after the last stored group (including all of them, if the level was
+        # never written) are read, and downsampled here
+        j = max(i0, self._count_sweeps(worker, level_file) * factor)
+        if j < i1:
+            timestamps, strengths = self._map_sweeps(worker, times_file, data_file, j, i1)
+            if len(timestamps) > 0:
+                tail = downsample(timestamps, strengths, factor, mode)
+                return _concatenate([(level_times, level_strengths), tail])
+        return level_times, level_strengths
 
     def write_spectrum(self, worker, timestamp, strengths):
         """ Write spectrum strengths found at the given timestamp by the specified worker.
         """
         if self.values is None:
             raise StoreError("Uninitialised config (call read or write)")
-        self._write_data(worker, self.SPECTRUM_TIMES, self.SPECTRUM_DATA, timestamp, strengths, True)
+        self._writer_summary(worker)
+        times_file, data_file = self._write_segment(worker, self.SPECTRUM_TIMES, self.SPECTRUM_DATA, timestamp,
+                                                    self._seal_spectrum)
+        if worker not in self._levels:
+            self._init_spectrum(worker, times_file, data_file)
+        sweep = numpy.array(strengths, dtype=numpy.int8)
+        for level in self._levels[worker]:
+            group = level.add(timestamp, sweep)
+            if group is not None:
+                self._write_level(worker, times_file, level.factor, *group)
+        if self._blocks[worker] is not None:
+            with self._writing() as writer:
+                self._write_block_sweep(writer, worker, times_file, data_file, timestamp, sweep)
+        else:
+            self._write_data(worker, self.SPECTRUM_TIMES, self.SPECTRUM_DATA, timestamp, strengths, True)
+
+    # initialise level and block state for writing to a spectrum (segment)
+    def _init_spectrum(self, worker, times_file, data_file):
+        self._levels[worker] = self._init_levels(worker, times_file, data_file)
+        self._blocks[worker] = self._init_blocks(worker, times_file, data_file)
+
+    # seal a spectrum segment before starting the next, writing its incomplete block and level groups
+    def _seal_spectrum(self, worker, times_file, data_file):
+        if worker not in self._levels:
+            self._init_spectrum(worker, times_file, data_file)
+        for level in self._levels.pop(worker):
+            group = level.close()
+            if group is not None:
+                self._write_level(worker, times_file, level.factor, *group)
+        blocks = self._blocks.pop(worker)
+        if blocks is not None and len(blocks.pending) > 0:
+            with self._writing() as writer:
+                self._write_block(writer, worker, data_file, blocks)
+
+    # return the unsealed block state for a block format spectrum (None for raw format)
+    def _init_blocks(self, worker, times_file, data_file):
+        path = self._worker_path(worker)
+        i_path = os.path.join(path, os.path.dirname(data_file), self.INDEX)
+        if not os.path.exists(i_path):
+            if self._data_store.spectrum_format != 'block' or os.path.exists(os.path.join(path, times_file)):
+                return None
+            # the index is created first, so readers always know the format of the data file
+            mkdirs(i_path)
+            with open(i_path, 'w') as f_i:
+                _N_STRUCT.fwrite(f_i, self._data_store.block_sweeps)
+            return _Blocks(self._data_store.block_sweeps)
+        with open(i_path) as f_i:
+            block_sweeps = _N_STRUCT.fread(f_i)
+            f_i.seek(0, os.SEEK_END)
+            blocks = _Blocks(block_sweeps, (f_i.tell() - _N_STRUCT.size) // _B_STRUCT.size)
+        sealed = blocks.n_blocks * block_sweeps
+        n_sweeps = self._count_sweeps(worker, times_file)
+        timestamps, strengths = self._map_sweeps(worker, times_file, data_file, sealed, n_sweeps)
+        if len(timestamps) > 0:
+            blocks.timestamp = int(timestamps[0])
+            blocks.pending = list(strengths)
+        return blocks
+
+    # write a sweep of a block format spectrum, writing a block when it is complete
+    def _write_block_sweep(self, writer, worker, times_file, data_file, timestamp, sweep):
+        path = self._worker_path(worker)
+        t_path = os.path.join(path, times_file)
+        d_path = os.path.join(path, data_file)
+        blocks = self._blocks[worker]
+        if writer.size(t_path) == 0:
+            writer.write(t_path, _N_STRUCT.pack(len(sweep)), True)
+        if writer.size(d_path) == 0:
+            writer.write(d_path, _T_STRUCT.pack(blocks.n_blocks * blocks.sweeps))
+        if len(blocks.pending) == 0:
+            blocks.timestamp = timestamp
+        blocks.pending.append(sweep)
+        if len(blocks.pending) < blocks.sweeps:
+            writer.write(d_path, sweep.tostring())
+        writer.write(t_path, _T_STRUCT.pack(timestamp), True)
+        if len(blocks.pending) == blocks.sweeps:
+            self._write_block(writer, worker, data_file, blocks)
+        self._update_summary(worker, self.SPECTRUM_TIMES, timestamp)
+
+    # write the pending sweeps of a block format spectrum as a block, and replace the data file
+    def _write_block(self, writer, worker, data_file, blocks):
+        path = os.path.join(self._worker_path(worker), os.path.dirname(data_file))
+        b_path = os.path.join(path, self.BLOCKS)
+        raw = _encode_block(numpy.array(blocks.pending))
+        offset = writer.size(b_path)
+        writer.write(b_path, raw)
+        writer.write(os.path.join(path, self.INDEX), _B_STRUCT.pack(blocks.timestamp, offset, len(raw)), True)
+        blocks.n_blocks += 1
+        blocks.pending = []
+        writer.replace(os.path.join(path, os.path.basename(data_file)), _T_STRUCT.pack(blocks.n_blocks * blocks.sweeps))
+
+    def _write_level(self, worker, times_file, factor, timestamp, max_strengths, mean_strengths):
+        for mode, strengths in zip(self.LEVEL_MODES, (max_strengths, mean_strengths)):
+            level_file, level_data = self._level_files(times_file, mode, factor)
+            self._write_data(worker, level_file, level_data, timestamp, strengths.tolist(), True)
+
+    # initialise downsampled levels from the stored spectrum, writing any missing groups
+    def _init_levels(self, worker, times_file, data_file):
+        # data may lag timestamps
+        _, n_sweeps = self._count_data(worker, times_file, data_file, 0, self._count_sweeps(worker, times_file))
+        ends = [n_sweeps // factor * factor for factor in self.LEVEL_FACTORS]
+        starts = [min(self._count_sweeps(worker, self._level_files(times_file, self.LEVEL_MODES[0], factor)[0]) * factor, i1)
+                  for factor, i1 in zip(self.LEVEL_FACTORS, ends)]
+        base = min(starts) # only sweeps not yet in every level are needed
+
+        # write missing groups a chunk of sweeps (a multiple of every factor) at a time, so
+        # memory use does not depend on the number of sweeps
+        chunk = -(-self.ITER_SWEEPS // self.LEVEL_FACTORS[-1]) * self.LEVEL_FACTORS[-1]
+        for c0 in xrange(base // chunk * chunk, max(ends), chunk):
+            j0, j1 = max(base, c0), min(max(ends), c0 + chunk)
+            timestamps, strengths = self._map_sweeps(worker, times_file, data_file, j0, j1)
+            for factor, i0, i1 in zip(self.LEVEL_FACTORS, starts, ends):
+                groups = slice(max(i0, c0) - j0, min(i1, c0 + chunk) - j0)
+                if groups.start < groups.stop:
+                    group_times, max_strengths = downsample(timestamps[groups], strengths[groups], factor, 'max')
+                    _, mean_strengths = downsample(timestamps[groups], strengths[groups], factor, 'mean')
+                    for group in zip(group_times.tolist(), max_strengths, mean_strengths):
+                        self._write_level(worker, times_file, factor, *group)
+
+        # the incomplete group of each level
+        levels = []
+        for factor, i1 in zip(self.LEVEL_FACTORS, ends):
+            level = _Level(factor)
+            timestamps, strengths = self._map_sweeps(worker, times_file, data_file, i1, n_sweeps)
+            for i in xrange(len(timestamps)):
+                level.add(int(timestamps[i]), strengths[i])
+            levels.append(level)
+        return levels
 
     def iter_audio(self, worker, start=None, end=None):
         """ Yield (timestamp, freq_n) for stored audio samples in the range (or all).
@@ -350,12 +1250,13 @@ class Config(ConfigBase):
         mkdirs(path)
         return path
 
-    def iter_rds_name(self, worker, start=None, end=None):
-        """ Yield (timestamp, freq_n, name) for RDS names in the range (or all).
+    def iter_rds_name(self, worker, start=None, end=None, freq_n=None):
+        """ Yield (timestamp, freq_n, name) for RDS names in the range (or all), only for
+            the given freq_n (if specified).
         """
         if self.values is None:
             raise StoreError("Uninitialised config (call read or write)")
-        for _ in self._iter_freq_data(worker, self.RDS_NAME_TIMES, self.RDS_NAME_DATA, start, end):
+        for _ in self._iter_freq_data(worker, self.RDS_NAME_TIMES, self.RDS_NAME_DATA, start, end, freq_n=freq_n):
             yield _
 
     def write_rds_name(self, worker, timestamp, freq_n, name):
@@ -365,12 +1266,13 @@ class Config(ConfigBase):
             raise StoreError("Uninitialised config (call read or write)")
         self._write_freq_data(worker, self.RDS_NAME_TIMES, self.RDS_NAME_DATA, timestamp, freq_n, name)
 
-    def iter_rds_text(self, worker, start=None, end=None):
-        """ Yield (timestamp, freq_n, text) for RDS text in the range (or all).
+    def iter_rds_text(self, worker, start=None, end=None, freq_n=None):
+        """ Yield (timestamp, freq_n, text) for RDS text in the range (or all), only for
+            the given freq_n (if specified).
         """
         if self.values is None:
             raise StoreError("Uninitialised config (call read or write)")
-        for _ in self._iter_freq_data(worker, self.RDS_TEXT_TIMES, self.RDS_TEXT_DATA, start, end):
+        for _ in self._iter_freq_data(worker, self.RDS_TEXT_TIMES, self.RDS_TEXT_DATA, start, end, freq_n=freq_n):
             yield _
 
     def write_rds_text(self, worker, timestamp, freq_n, text):
@@ -395,14 +1297,25 @@ class Config(ConfigBase):
             raise StoreError("Uninitialised config (call read or write)")
         self._write_freq_data(worker, self.TEMPERATURE_TIMES, self.TEMPERATURE_DATA, timestamp, 0, temperature)
 
-    def iter_error(self, worker, start=None, end=None):
-        """ Yield (timestamp, error) for all errors.
+    def iter_error(self, worker, start=None, end=None, offset=0, limit=None):
+        """ Yield (timestamp, error) for errors in the range (or all), skipping the first
+            offset errors and yielding at most limit errors (if specified).
         """
         if self.values is None:
             raise StoreError("Uninitialised config (call read or write)")
-        for timestamp, _, error in self._iter_freq_data(worker, self.ERROR_TIMES, self.ERROR_DATA, start, end):
+        for timestamp, _, error in self._iter_freq_data(worker, self.ERROR_TIMES, self.ERROR_DATA, start, end, offset, limit):
             yield timestamp, error
 
+    def error_summary(self, worker):
+        """ Return (count, latest timestamp) for errors stored by the worker, from the summary.
+        """
+        if self.values is None:
+            raise StoreError("Uninitialised config (call read or write)")
+        if worker not in self._summaries:
+            self._summaries[worker] = self._read_summary(worker)
+        summary = self._summaries[worker].get('error')
+        return (summary['count'], summary['latest']) if summary is not None else (0, None)
+
     def write_error(self, worker, timestamp, error):
         """ Write an error at the given timestamp.
         """
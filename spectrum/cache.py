@@ -0,0 +1,74 @@
+""" Bounded least recently used cache.
+"""
+from collections import OrderedDict
+from threading import Lock
+
+
+class LRUCache(object):
+    """ Cache of values by key, discarding the least recently used values when their total
+        size exceeds max_size. The size of each value is given by the sizeof function (by
+        default, each value has size 1, so max_size is the maximum number of values).
+    """
+    def __init__(self, max_size, sizeof=None):
+        self.max_size = max_size
+        self.size = 0
+        self._sizeof = sizeof or (lambda _: 1)
+        self._values = OrderedDict()
+        self._lock = Lock()
+
+    def __len__(self):
+        return len(self._values)
+
+    def get(self, key, default=None):
+        """ Return the value for the given key (marking it most recently used), or default
+            if there is none.
+        """
+        with self._lock:
+            if key not in self._values:
+                return default
+            value, size = self._values.pop(key)
+            self._values[key] = (value, size)
+            return value
+
+    def put(self, key, value):
+        """ Store the value for the given key, discarding least recently used values as
+            necessary. A value larger than max_size is not stored.
+        """
+        size = self._sizeof(value)
+        with self._lock:
+            self._discard(key)
+            if size > self.max_size:
+                return
+            while self.size + size > self.max_size:
+                self._discard(next(iter(self._values)))
+            self._values[key] = (value, size)
+            self.size += size
+
+    def pop(self, key):
+        """ Discard any value for the given key.
+        """
+        with self._lock:
+            self._discard(key)
+
+    def iter_put(self, key, chunks, max_value_size=None):
+        """ Yield the given string chunks, storing them (joined) for the given key once all
+            have been consumed, unless they total more than max_value_size.
+        """
+        value = []
+        size = 0
+        for chunk in chunks:
+            if value is not None:
+                size += len(chunk)
+                if max_value_size is not None and size > max_value_size:
+                    value = None
+                else:
+                    value.append(chunk)
+            yield chunk
+        if value is not None:
+            self.put(key, ''.join(value))
+
+    # discard the value for the given key, if any (called with the lock held)
+    def _discard(self, key):
+        if key in self._values:
+            _, size = self._values.pop(key)
+            self.size -= size
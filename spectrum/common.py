@@ -2,10 +2,14 @@
 """
 import sys
 import os
+import copy
+import json
 import itertools
 import time
 import logging, logging.handlers
+import numpy
 from spectrum.config import LOG_PATH, LOG_SIZE, LOG_LEVEL
+from spectrum.cache import LRUCache
 
 
 def get_logger():
@@ -62,10 +66,9 @@ def now():
 
 
 def freq(freq_n, scan_config): # pylint: disable=redefined-builtin
-    """ Return the frequency for the given freq_n.  Use of this is fairly inefficient
-        because the whole range of frequencies is generated each time.
+    """ Return the frequency for the given freq_n (prefer using a ScanPlan directly).
     """
-    return next(itertools.islice(scan(scan_config), freq_n, None))[1]
+    return ScanPlan.get(scan_config)[freq_n]
 
 
 def _convert(dic):
@@ -99,10 +102,19 @@ def _convert(dic):
             pass
 
 
+def convert_config(config):
+    """ Return a copy of the given config, converted using _convert (leaving the config
+        itself unchanged).
+    """
+    config = copy.deepcopy(config)
+    _convert(config)
+    return config
+
+
 #FIXME prefer to do the interpretation of freq specs, to produce a generator, in one step
 def parse_config(config, worker):
     """ Convert the given config using _convert, and return parsed scan settings.
-        The return value may be fed into scan().
+        The return value may be fed into ScanPlan.get().
     """
     _convert(config)
     scan_cfg = []
@@ -116,14 +128,66 @@ def parse_config(config, worker):
                 scan_cfg.append(int(10 ** int(x['exp']) * float(x['freq'])))
     return scan_cfg
 
-#FIXME prefer to do the interpretation of freq specs, to produce a generator, in one step
 def scan(scan_config): # pylint: disable=redefined-builtin
     """ Iterate frequency indices and frequency values in the specified scan config.
     """
-    idx = 0
-    for freq in itertools.chain(*[xrange(*x) if isinstance(x, list) else [x] for x in scan_config]):
-        yield idx, freq
-        idx += 1
+    return iter(ScanPlan.get(scan_config))
+
+
+class ScanPlan(object):
+    """ The sequence of frequencies for a scan config (as returned by parse_config),
+        generated once and held in a numpy array. Index with a freq_n (or a slice) to
+        get the frequency (or an array of frequencies), or use index() for the freq_n
+        of a given frequency.
+    """
+    _cache = LRUCache(16)
+
+    def __init__(self, scan_config):
+        self.scan_config = scan_config
+        parts = [numpy.arange(*x, dtype=numpy.int64) if isinstance(x, list) else [x] for x in scan_config]
+        self.freqs = numpy.concatenate(parts).astype(numpy.int64) if parts else numpy.zeros(0, numpy.int64)
+        self._order = numpy.argsort(self.freqs, kind='mergesort')
+        self._sorted = self.freqs[self._order]
+
+    @classmethod
+    def get(cls, scan_config):
+        """ Return a (cached) ScanPlan for the given scan config.
+        """
+        key = tuple(tuple(x) if isinstance(x, list) else x for x in scan_config)
+        plan = cls._cache.get(key)
+        if plan is None:
+            plan = cls(scan_config)
+            cls._cache.put(key, plan)
+        return plan
+
+    def __len__(self):
+        return len(self.freqs)
+
+    def __getitem__(self, freq_n):
+        if isinstance(freq_n, slice):
+            return self.freqs[freq_n]
+        return int(self.freqs[freq_n])
+
+    def __iter__(self):
+        """ Iterate frequency indices and frequency values.
+        """
+        return enumerate(self.freqs.tolist())
+
+    def index(self, freq): # pylint: disable=redefined-outer-name
+        """ Return the (first) freq_n for the given frequency, or raise ValueError if it is
+            not in the scan.
+        """
+        i = numpy.searchsorted(self._sorted, freq)
+        if i == len(self._sorted) or self._sorted[i] != freq:
+            raise ValueError("Frequency not in scan: {0}".format(freq))
+        return int(self._order[i])
+
+
+def scan_plan(config, worker):
+    """ Return the (cached) ScanPlan for the given worker in the given config values
+        (which are not changed, as they may be shared).
+    """
+    return ScanPlan.get(parse_config(convert_config(config), worker))
 
 
 def fs_size(path):
@@ -163,3 +227,40 @@ def mkdirs(file_path):
     path = os.path.dirname(file_path)
     if not os.path.exists(path):
         os.makedirs(path)
+
+def iter_json(value, chunk_size=65536, batch=256):
+    """ Yield JSON text for the given value, in chunks of at least chunk_size bytes (except
+        the last). Dictionary values may be iterators, which are encoded as lists (batch
+        items at a time) as they are consumed, so large values need not be held in memory.
+    """
+    def _iter(value):
+        if isinstance(value, dict):
+            yield '{'
+            for i, (key, item) in enumerate(value.iteritems()):
+                yield '{0}{1}:'.format(',' if i > 0 else '', json.dumps(key))
+                for text in _iter(item):
+                    yield text
+            yield '}'
+        elif isinstance(value, (list, tuple, basestring)) or not hasattr(value, '__iter__'):
+            yield json.dumps(value)
+        else:
+            yield '['
+            items = iter(value)
+            sep = ''
+            while True:
+                items_batch = list(itertools.islice(items, batch))
+                if len(items_batch) == 0:
+                    break
+                yield sep + json.dumps(items_batch)[1:-1]
+                sep = ','
+            yield ']'
+
+    chunk, size = [], 0
+    for text in _iter(value):
+        chunk.append(text)
+        size += len(text)
+        if size >= chunk_size:
+            yield ''.join(chunk)
+            chunk, size = [], 0
+    if size > 0:
+        yield ''.join(chunk)
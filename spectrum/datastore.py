@@ -3,7 +3,16 @@
 import os
 import shutil
 import json
-from spectrum.common import log, fs_size, fs_free
+import struct
+from collections import OrderedDict
+from contextlib import contextmanager
+from itertools import izip
+import numpy
+from spectrum.common import log, fs_size, fs_free, scan_plan
+
+
+# header of each worker's spectrum in the binary format (see ConfigBase.iter_binary)
+BINARY_HEADER = struct.Struct('<BII')
 
 
 class StoreError(Exception):
@@ -15,6 +24,24 @@ class StoreError(Exception):
         self.message = message
 
 
+def downsample(timestamps, strengths, factor, mode='max'):
+    """ Downsample spectrum sweeps by the given factor, combining each group of factor
+        consecutive sweeps (the last group may be smaller) into one. If mode is 'max', the
+        maximum level is taken, if 'mean', the mean of measured levels (ignoring -128). The
+        timestamp of each group is that of its first sweep.
+    """
+    if len(timestamps) == 0 or factor <= 1:
+        return timestamps, strengths
+    idx = numpy.arange(0, len(timestamps), factor)
+    if mode == 'max':
+        return timestamps[idx], numpy.maximum.reduceat(strengths, idx, axis=0)
+    valid = strengths > -128
+    sums = numpy.add.reduceat(numpy.where(valid, strengths, 0).astype(numpy.int32), idx, axis=0)
+    counts = numpy.add.reduceat(valid.astype(numpy.int32), idx, axis=0)
+    means = numpy.where(counts > 0, numpy.round(sums / numpy.maximum(counts, 1.0)), -128)
+    return timestamps[idx], means.astype(numpy.int8)
+
+
 class DataStore(object):
     def __init__(self, data_path):
         self.data_path = os.path.join(data_path, 'data')
@@ -64,6 +91,7 @@ class ConfigBase(object):
         self.first = first
         self.latest = latest
         self.count = count
+        self._plans = {}
 
     def rel_audio_path(self, worker, timestamp, freq_n):
         """ Return a (base) path at which an audio sample is stored, relative
@@ -91,18 +119,121 @@ class ConfigBase(object):
                 return path
         return None
 
-    def get_json(self, start=None, end=None):
+    def scan_plan(self, worker):
+        """ Return the ScanPlan for the given worker (parsed once per config values).
+        """
+        plan = self._plans.get(worker)
+        if plan is None:
+            plan = self._plans[worker] = scan_plan(self.values, worker)
+        return plan
+
+    def version(self): # pylint: disable=no-self-use
+        """ Return a string that changes whenever the stored data for the config changes
+            (as at the last read), for use as a cache validator, or None if the data store
+            cannot provide one cheaply.
+        """
+        return None
+
+    @contextmanager
+    def writer(self, **_):
+        """ Context manager within which the data store may buffer writes, which are
+            flushed on exit. The default implementation writes straight through.
+        """
+        yield self
+
+    def flush(self, force=True):
+        """ Flush any buffered writes (if force is False, only if they are due).
+        """
+        pass
+
+    def error_summary(self, worker):
+        """ Return (count, latest timestamp) for errors stored by the worker. Sub-classes
+            should override this to avoid reading every error.
+        """
+        count, latest = 0, None
+        for latest, _ in self.iter_error(worker):
+            count += 1
+        return count, latest
+
+    def get_spectrum(self, worker, start=None, end=None, max_sweeps=None, mode='max'):
+        """ Return (timestamps, strengths) NumPy arrays for spectrum sweeps in the range (or
+            all), where strengths has one row per sweep. If max_sweeps is given, sweeps are
+            downsampled (see downsample()) so that no more than max_sweeps are returned.
+
+            Sub-classes should override this where the underlying storage allows something
+            more efficient than iter_spectrum.
+        """
+        sweeps = list(self.iter_spectrum(worker, start=start, end=end))
+        if len(sweeps) == 0:
+            return numpy.empty((0,), dtype=numpy.uint64), numpy.empty((0, 0), dtype=numpy.int8)
+        timestamps = numpy.array([timestamp for timestamp, _ in sweeps], dtype=numpy.uint64)
+        strengths = numpy.array([levels for _, levels in sweeps], dtype=numpy.int8)
+        if max_sweeps is not None:
+            factor = -(-len(sweeps) // max_sweeps)
+            return downsample(timestamps, strengths, factor, mode)
+        return timestamps, strengths
+
+    def iter_data(self, start=None, end=None, max_sweeps=None, mode='max'):
+        """ Return data in the range (or all) for each worker, as for get_json(), but with
+            an iterator for each kind of data, so that it can be streamed (see iter_json()).
+        """
         data = {}
         for worker in self.values['workers']:
-            w = data[worker] = {}
-            w['errors'] = list(self.iter_error(worker, start=start, end=end))
-            w['spectrum'] = list(self.iter_spectrum(worker, start=start, end=end))
-            w['rds_name'] = list(self.iter_rds_name(worker, start=start, end=end))
-            w['rds_text'] = list(self.iter_rds_text(worker, start=start, end=end))
-            w['temperature'] = list(self.iter_temperature(worker, start=start, end=end))
-            w['audio'] = list(self.iter_audio(worker, start=start, end=end))
+            data[worker] = OrderedDict([
+                ('errors', self.iter_error(worker, start=start, end=end)),
+                ('spectrum', self._iter_spectrum_data(worker, start, end, max_sweeps, mode)),
+                ('rds_name', self.iter_rds_name(worker, start=start, end=end)),
+                ('rds_text', self.iter_rds_text(worker, start=start, end=end)),
+                ('temperature', self.iter_temperature(worker, start=start, end=end)),
+                ('audio', self.iter_audio(worker, start=start, end=end))
+            ])
         return data
 
+    # yield (timestamp, strengths) for sweeps in the range, downsampled if max_sweeps is given
+    def _iter_spectrum_data(self, worker, start, end, max_sweeps, mode):
+        if max_sweeps is None:
+            for sweep in self.iter_spectrum(worker, start=start, end=end):
+                yield sweep
+        else:
+            timestamps, strengths = self.get_spectrum(worker, start, end, max_sweeps, mode)
+            for sweep in izip(timestamps.tolist(), strengths.tolist()):
+                yield sweep
+
+    def iter_binary(self, start=None, end=None, max_sweeps=None, mode='max', chunk_size=65536):
+        """ Yield spectrum data in the range (or all), downsampled as for get_spectrum(), in
+            a compact binary format, in chunks of about chunk_size bytes. For each worker in
+            turn, this is:
+
+                - a BINARY_HEADER: worker name length, number of sweeps, number of frequencies
+                - the worker name (ASCII)
+                - a timestamp for each sweep (little-endian unsigned 64-bit)
+                - the strengths for each sweep in turn (signed 8-bit)
+        """
+        for worker in self.values['workers']:
+            n_sweeps, n_freq, times_parts, strengths_parts = self._binary_spectrum(worker, start, end, max_sweeps, mode)
+            yield BINARY_HEADER.pack(len(worker), n_sweeps, n_freq) + str(worker)
+            for timestamps in times_parts:
+                yield numpy.asarray(timestamps, dtype='<u8').tostring()
+            step = max(1, chunk_size // max(1, n_freq))
+            for strengths in strengths_parts:
+                for i in xrange(0, len(strengths), step):
+                    yield strengths[i:i + step].tostring()
+
+    # return (number of sweeps, number of frequencies, timestamps parts, strengths parts) for
+    # iter_binary(), where the parts are iterables of arrays - sub-classes may override this to
+    # read the parts lazily
+    def _binary_spectrum(self, worker, start, end, max_sweeps, mode):
+        timestamps, strengths = self.get_spectrum(worker, start, end, max_sweeps, mode)
+        n_freq = strengths.shape[1] if len(timestamps) > 0 else 0
+        return len(timestamps), n_freq, [timestamps], [strengths]
+
+    def get_json(self, start=None, end=None, max_sweeps=None, mode='max'):
+        """ Return a dictionary of data in the range (or all) for each worker, with a list
+            of errors, spectrum sweeps, RDS names and text, temperatures and audio samples.
+        """
+        data = self.iter_data(start, end, max_sweeps, mode)
+        return dict((worker, dict((name, list(items)) for name, items in data[worker].iteritems())) for worker in data)
+
 
 class Settings(object): # pylint: disable=too-few-public-methods
     """ Class for managing settings id and value.
@@ -5,9 +5,12 @@ import Hamlib
 from time import sleep
 from gpiozero import CPUTemperature
 from spectrum.process import Process
-from spectrum.common import log, parse_config, now, scan
+from spectrum.common import log, now
 from spectrum.monitor import Monitor, TimeoutError, get_capabilities
 from spectrum.audio import AudioClient
+from spectrum.peaks import sweep_peaks, peak_status
+from spectrum.schedule import AdaptiveSchedule
+from spectrum.rig_reader import RigReader
 from spectrum.power import power_on
 from spectrum.config import PICO_PATH, RIG_DEVICE, RIG_LOG_LEVEL, RADIO_ON_SLEEP_SECS
 
@@ -51,12 +54,16 @@ class Worker(Process):
     def iterator(self, config, initial_count):
         """ Scan the spectrum, storing data through the config object, and yield status.
         """
-        scan_config = parse_config(config.values, 'hamlib')
+        plan = config.scan_plan('hamlib')
         values = config.values['hamlib']
         audio_t = 0 if values['audio']['enabled'] else None
         attempts = config.values['rig']['radio_on']
         threshold = values['audio']['threshold']
         period = values['audio']['period']
+        adaptive = values.get('adaptive') or {}
+        schedule = None
+        if adaptive.get('enabled', False):
+            schedule = AdaptiveSchedule(len(plan), adaptive['quiet_sweeps'], adaptive['max_interval'], threshold)
 
         self.status.clear()
         yield
@@ -68,63 +75,71 @@ class Worker(Process):
             return monitor
 
         monitor = None
+        reader = None
         try:
             monitor = self._timeout_try(attempts, _monitor_open, config)
             self._timeout_try(attempts, monitor.set_mode, config.values['hamlib']['mode'])
+            reader = RigReader(lambda freq: self._timeout_try(attempts, monitor.get_strength, freq))
+            reader.start()
             sweep_n = 0
+            peaks = []
             while True:
-                log.debug("Config: %s %s", values, scan_config)
+                log.debug("Config: %s %s", values, plan.scan_config)
 
                 time_0 = now()
-                strengths = []
-                peaks = []
-                w = [(None,) * 3] * 3
+                strengths = [-128] * len(plan) # -128 for channels not measured in this sweep
+                due = schedule.due() if schedule is not None else None
+                freqs = [(idx, freq) for idx, freq in plan if due is None or due[idx]]
+                results = reader.sweep(freqs) # the rig reads while status etc. is updated below
 
-                self.status['sweep'] = {'timestamp': time_0, 'peaks': []}
+                # peaks are those of the previous sweep until this one is complete
+                self.status['sweep'] = {'timestamp': time_0, 'peaks': peaks}
                 self.status['sweep']['sweep_n'] = initial_count + sweep_n
-                yield
-
-                for idx, freq in scan(scan_config):
-                    log.debug("Scanning frequency %s (%s)", freq, idx)
-
-                    if 'current' in self.status['sweep']:
-                        self.status['sweep']['previous'] = self.status['sweep']['current']
-                    self.status['sweep']['current'] = {'freq_n': idx}
-                    yield
-
-                    strength = self._timeout_try(attempts, monitor.get_strength, freq)
-                    self.status['sweep']['current']['strength'] = strength
+                if len(freqs) > 0:
+                    self.status['sweep']['current'] = {'freq_n': freqs[0][0]}
+                yield True
+
+                for k, (idx, freq, strength, timestamp) in enumerate(results):
+                    log.debug("Strength at frequency %s (%s): %s", freq, idx, strength)
+                    self.status['sweep']['previous'] = {'freq_n': idx, 'strength': strength}
+                    if k + 1 < len(freqs):
+                        self.status['sweep']['current'] = {'freq_n': freqs[k + 1][0]}
+                    else:
+                        self.status['sweep'].pop('current', None)
                     yield
 
-                    w = [w[1], w[2], (freq, strength, idx)]
-                    strengths.append(strength if strength is not None else -128)
-                    # ..[1] gets you the strength:
-                    if w[0][1] < w[1][1] and w[1][1] >= threshold and w[1][1] >= w[2][1]:
-                        peaks.append((w[1][2], w[1][0]))
-
-                        peak = {'freq_n': w[1][2], 'strength': w[1][1]}
-                        self.status['sweep']['peaks'].append(peak)
-                        yield
+                    if strength is not None:
+                        strengths[idx] = strength
 
                     temp = self._read_temp(config)
-                    config.write_temperature(self.prefix, now(), temp)
+                    config.write_temperature(self.prefix, timestamp, temp)
 
-                if w[1][1] < w[2][1] and w[2][1] >= threshold:
-                    peaks.append((w[2][2], w[2][0]))
+                sweep_ms = now() - time_0
+                log.info("Sweep %d: %d channels in %d ms (rig %d ms, bookkeeping %d ms), %.1f sweeps/min",
+                         initial_count + sweep_n, len(freqs), sweep_ms, reader.rig_secs * 1000,
+                         sweep_ms - reader.wait_secs * 1000, 60000.0 / max(sweep_ms, 1))
 
+                if schedule is not None:
+                    peaks = peak_status(*schedule.update(due, strengths))
+                else:
+                    peaks = peak_status(strengths, sweep_peaks(strengths, threshold))
+                self.status['sweep']['peaks'] = peaks
                 for key in ('previous', 'current', 'record'):
                     self.status['sweep'].pop(key, None)
-                yield
+                yield True
 
                 config.write_spectrum(self.prefix, time_0, strengths)
 
                 if audio_t is not None and now() - audio_t > period * 1000:
                     audio_t = now()
-                    for _ in self._record(config, monitor, peaks):
+                    freqs = [(peak['freq_n'], plan[peak['freq_n']]) for peak in peaks]
+                    for _ in self._record(config, monitor, freqs):
                         yield
 
                 sweep_n += 1
         finally:
+            if reader is not None:
+                reader.close() # before closing the rig, which it may be using
             if monitor is not None:
                 monitor.close()
 
@@ -133,7 +148,7 @@ class Worker(Process):
         log.debug("Recording audio from %d frequencies", len(freqs))
         for idx, freq in freqs:
             self.status['sweep']['record'] = {'freq_n': idx}
-            yield
+            yield True
 
             log.info("Recording audio at %sHz", freq)
 
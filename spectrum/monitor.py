@@ -1,17 +1,63 @@
 """ Module for monitoring the RF spectrum using the rig.
 """
+import os
+import sys
+import json
 import math
 import inspect
 from time import sleep
 import Hamlib
-from spectrum.common import check_device
+from spectrum.common import log, check_device, mkdirs
+from spectrum.config import HAMLIB_CAPS_FILE
+from spectrum.verify import VerifyPolicy
 
 Hamlib.rig_set_debug(Hamlib.RIG_DEBUG_NONE)
 
 
-def get_capabilities():
-    """ Return a dictionary of rig capabilities.
+def get_capabilities(path=HAMLIB_CAPS_FILE):
+    """ Return a dictionary of rig capabilities, from the cache file at the given path if it
+        was written for the installed Hamlib (the same version and library files), or else
+        by building them (which means instantiating every rig model, so takes a while) and
+        writing the cache file.
     """
+    key = _hamlib_key()
+    try:
+        with open(path) as f:
+            cached = json.loads(f.read())
+        if cached.get('key') == key:
+            return cached['caps']
+    except (IOError, ValueError, KeyError):
+        pass
+    log.info("Building Hamlib capabilities (for %s)", key)
+    caps = _build_capabilities()
+    try:
+        mkdirs(path)
+        tmp = path + '_tmp'
+        with open(tmp, 'w') as f:
+            f.write(json.dumps({'key': key, 'caps': caps}))
+        os.rename(tmp, path)
+    except (IOError, OSError) as e:
+        log.error("Could not cache Hamlib capabilities: %s", e)
+    return caps
+
+
+# return the Hamlib version and the modification times of its Python and library files
+def _hamlib_key():
+    version = getattr(getattr(Hamlib, 'cvar', None), 'hamlib_version', None)
+    files = [Hamlib.__file__]
+    if '_Hamlib' in sys.modules:
+        files.append(sys.modules['_Hamlib'].__file__)
+    mtimes = []
+    for path in files:
+        try:
+            mtimes.append([path, os.path.getmtime(path)])
+        except OSError:
+            mtimes.append([path, None])
+    return [version, mtimes]
+
+
+# build the dictionary of rig capabilities
+def _build_capabilities():
     caps = {'models': [], 'rates': [], 'parities': [], 'modes': []}
 
     is_int = lambda n: isinstance(n, int)
@@ -79,7 +125,7 @@ class Monitor(object):
 
     def __init__(self, model=1, data_bits=None, stop_bits=None, rate=None, parity=None,  # pylint: disable=too-many-arguments
                  write_delay=None, rig_device=None, set_check=0, retries=0, interval=0,
-                 attenuation=None, **_):
+                 attenuation=None, verify='always', verify_every=8, **_):
         """ Arguments:
 
             model - hamlib model number, defaults to dummy implementation
@@ -93,7 +139,12 @@ class Monitor(object):
             retries - retry after error or timeout this many times
             interval - if > 0, pause this many ms before retrying (doubles each retry)
             attenuation - if not None, set attenuation for the rig
+            verify - when to check a frequency set: 'always', 'sampled' (every verify_every
+                     sets, and after errors) or 'tracked' (always, but frequencies the rig
+                     is known to be on are not set again)
+            verify_every - how often frequencies are checked when verify is 'sampled'
         """
+        self.model = model
         self.rig = Hamlib.Rig(model)
         if self.rig.this is None:
             raise RigError()
@@ -113,6 +164,7 @@ class Monitor(object):
         self.set_check = set_check
         self.retries = retries
         self.interval = interval
+        self.verify = VerifyPolicy(verify, verify_every)
 
     def open(self):
         """ Open communication with the rig.
@@ -130,6 +182,8 @@ class Monitor(object):
     def close(self):
         """ Close communication with the rig.
         """
+        log.info("Rig model %s frequency verification (%s): %s, mismatch rate %s",
+                 self.model, self.verify.mode, self.verify.stats, self.verify.mismatch_rate())
         self.rig.close()
 
     # handle errors and retries for hamlib calls
@@ -141,25 +195,20 @@ class Monitor(object):
                 return v
             sleep(self.interval * 2 ** tries / 1000.0)
             tries += 1
+        self.verify.error()
         if -self.rig.error_status == Hamlib.RIG_ETIMEOUT:
             raise TimeoutError(self.rig, fn.__name__, tries)
         raise RigError(self.rig, fn.__name__, tries)
 
     def set_frequency(self, freq):
-        """ Set the rig frequency.
+        """ Set the rig frequency, checking it according to the verify policy. Return
+            whether it was set.
         """
-        if self.set_check == 0:
-            self._check(self.rig.set_freq, Hamlib.RIG_VFO_CURR, freq)
-            return True
-        else:
-            checks = 0
-            while checks < self.set_check:
-                self._check(self.rig.set_freq, Hamlib.RIG_VFO_CURR, freq)
-                if freq == self._check(self.rig.get_freq, Hamlib.RIG_VFO_CURR):
-                    return True
-                sleep(self.interval * 2 ** checks / 1000.0)
-                checks += 1
-            return False
+        return self.verify.set(freq,
+                               lambda f: self._check(self.rig.set_freq, Hamlib.RIG_VFO_CURR, f),
+                               lambda: self._check(self.rig.get_freq, Hamlib.RIG_VFO_CURR),
+                               self.set_check,
+                               lambda checks: sleep(self.interval * 2 ** checks / 1000.0))
 
     def get_strength(self, freq=None):
         """ Return signal strength at the current frequency, or if 'freq' is specified,
@@ -0,0 +1,127 @@
+""" Peak detection in sweeps of strengths.
+"""
+import numpy
+from spectrum.config import PEAKS_PROMINENCE, PEAKS_SEPARATION, PEAKS_FLOOR, PEAKS_LIMIT
+
+# strength stored for a frequency with no reading
+MISSING = -128
+
+
+def find_peaks(strengths, threshold=None, prominence=PEAKS_PROMINENCE, separation=PEAKS_SEPARATION,
+               floor=None, limit=None):
+    """ Return the indices (in order) of peaks in the given sweep of strengths - samples
+        higher than the previous sample and at least as high as the next (samples outside
+        the sweep count as lower than any in it). MISSING samples are skipped over, as if
+        not in the sweep, so they are never peaks or the valleys beside them. Peaks must
+        also be:
+
+        - at least threshold, if given
+        - at least floor above the noise floor (the median strength of the sweep), if given
+        - at least prominence above the higher of their bases, if given (the base on each
+          side is the lowest sample between the peak and the nearest higher sample, or the
+          end of the sweep, on that side - a side with no samples is ignored)
+        - at least separation samples from any higher peak (for equal heights, from any
+          earlier peak), if given
+
+        If limit is given, only the highest limit peaks are returned.
+    """
+    s = numpy.asarray(strengths, dtype=numpy.float64)
+    present = numpy.flatnonzero(s != MISSING)
+    if len(present) == 0:
+        return numpy.zeros(0, dtype=numpy.intp)
+    p = s[present]
+
+    # local maxima (of the samples present)
+    left = numpy.empty_like(p)
+    left[0] = -numpy.inf
+    left[1:] = p[:-1]
+    right = numpy.empty_like(p)
+    right[-1] = -numpy.inf
+    right[:-1] = p[1:]
+    candidate = (p > left) & (p >= right)
+
+    if floor is not None:
+        floor = numpy.median(p) + floor
+        threshold = floor if threshold is None else max(threshold, floor)
+    if threshold is not None:
+        candidate &= p >= threshold
+    peaks = numpy.flatnonzero(candidate)
+
+    if prominence and len(peaks) > 0:
+        peaks = peaks[_prominences(p, peaks) >= prominence]
+    peaks = present[peaks]
+    if separation is not None and separation > 1 and len(peaks) > 1:
+        peaks = _separate(s, peaks, separation)
+    if limit is not None and len(peaks) > limit:
+        peaks = numpy.sort(peaks[numpy.argsort(-s[peaks], kind='mergesort')[:limit]])
+    return peaks
+
+
+def sweep_peaks(strengths, threshold=None):
+    """ Return the peaks in a completed sweep, using the configured prominence, separation
+        and limit, and either the given threshold or (if None) the configured floor.
+    """
+    floor = PEAKS_FLOOR if threshold is None else None
+    return find_peaks(strengths, threshold=threshold, floor=floor, limit=PEAKS_LIMIT)
+
+
+def peak_status(strengths, peaks):
+    """ Return a list of peaks as reported in worker status.
+    """
+    values = numpy.asarray(strengths)[peaks].tolist()
+    return [{'freq_n': freq_n, 'strength': value} for freq_n, value in zip(peaks.tolist(), values)]
+
+
+# return the prominence of each of the given peaks (which include any higher peaks, as do
+# the local maxima over any threshold) - the lowest sample between consecutive peaks is
+# found by numpy, and the nearest higher peak on each side with a stack, so the Python
+# work is proportional to the number of peaks, not samples
+def _prominences(s, peaks):
+    # valleys[i] is the lowest sample between peaks i - 1 and i (valleys[0] before the first
+    # peak and valleys[-1] after the last)
+    valleys = numpy.minimum.reduceat(s, numpy.concatenate(([0], peaks)))
+    heights = s[peaks]
+    left = _bases(heights, valleys[:-1])
+    right = _bases(heights[::-1], valleys[:0:-1])[::-1]
+    # ignore the base beyond a peak at either end of the sweep
+    if peaks[0] == 0:
+        left[0] = -numpy.inf
+    if peaks[-1] == len(s) - 1:
+        right[-1] = -numpy.inf
+    return heights - numpy.maximum(left, right)
+
+
+# return the base on one side of each peak, given the valley on that side of each
+def _bases(heights, valleys):
+    bases = []
+    stack = [] # (height, base) of peaks not (yet) lower than a later peak
+    for height, base in zip(heights.tolist(), valleys.tolist()):
+        while len(stack) > 0 and stack[-1][0] <= height:
+            base = min(base, stack.pop()[1])
+        stack.append((height, base))
+        bases.append(base)
+    return numpy.array(bases)
+
+
+# drop peaks within separation samples of a higher (or equal and earlier) peak - only peaks
+# with another within separation need be considered, highest first
+def _separate(s, peaks, separation):
+    near = numpy.diff(peaks) < separation
+    if not near.any():
+        return peaks
+    keep = numpy.ones(len(peaks), dtype=bool)
+    keep[:-1] &= ~near
+    keep[1:] &= ~near
+    conflicts = numpy.flatnonzero(~keep)
+    alive = (~keep).tolist()
+    positions = peaks.tolist()
+    for i in conflicts[numpy.argsort(-s[peaks[conflicts]], kind='mergesort')].tolist():
+        if not alive[i]:
+            continue
+        keep[i] = True
+        for step in (-1, 1):
+            j = i + step
+            while 0 <= j < len(positions) and abs(positions[j] - positions[i]) < separation:
+                alive[j] = False
+                j += step
+    return peaks[keep]
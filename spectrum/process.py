@@ -3,13 +3,23 @@
 """
 import json
 import os
+import mmap
+import fcntl
+import select
 import signal
+import socket
+import struct
 import errno
 import sys
 import traceback
-from spectrum.common import log, now
+from Queue import Queue
+from threading import Thread, Lock, RLock, Condition, current_thread
+from contextlib import contextmanager
+from time import time, sleep
+from spectrum.common import log, now, convert_config
 from spectrum.datastore import StoreError
-from spectrum.config import PID_KILL_PATH, RUN_PATH, CONFIG_PATH
+from spectrum.config import PID_KILL_PATH, RUN_PATH, CONFIG_PATH, STATUS_EVENTS_WATCH_SECS, STATUS_EVENTS_CHECK_SECS, \
+                            STATUS_SIZE, STATUS_JSON, STATUS_PUBLISH_MS, CONTROL_TIMEOUT_SECS, LIVENESS_TTL_SECS
 
 def kill(pid, signum):
     cmd = "{0} {1} {2}".format(PID_KILL_PATH, signum, pid)
@@ -21,6 +31,130 @@ def kill(pid, signum):
         e.errno = r
         raise e
 
+# header of a status region: sequence number, timestamp and length of the JSON status
+_REGION_HEADER = struct.Struct('=QQI')
+_REGION_SEQ = struct.Struct('=Q')
+
+# times to retry reading a status region while it is being written
+_REGION_RETRIES = 100
+
+
+class StatusRegion(object):
+    """ Memory-mapped file holding a JSON status, written in place by one process and read
+        by others without locking. The writer makes the sequence number odd while it writes,
+        and readers retry if it is odd, or has changed by the time they have read the status
+        (a seqlock). The file is grown if a status does not fit, but never shrunk. A region
+        object must not be used by more than one thread at a time.
+    """
+    def __init__(self, path, size=STATUS_SIZE):
+        self.path = path
+        self.size = size
+        self._map = None
+        self._inode = None
+        self._seq = 0
+
+    def write(self, raw, timestamp):
+        """ Write the given JSON status (or '' for none) and timestamp.
+        """
+        if self._map is None or _REGION_HEADER.size + len(raw) > len(self._map):
+            self._open(max(self.size, _REGION_HEADER.size + len(raw)))
+        self._seq += 1
+        self._map[:_REGION_SEQ.size] = _REGION_SEQ.pack(self._seq)
+        self._map[_REGION_SEQ.size:_REGION_HEADER.size] = _REGION_HEADER.pack(0, timestamp, len(raw))[_REGION_SEQ.size:]
+        self._map[_REGION_HEADER.size:_REGION_HEADER.size + len(raw)] = raw
+        self._seq += 1
+        self._map[:_REGION_SEQ.size] = _REGION_SEQ.pack(self._seq)
+
+    # map the region for writing, with at least the given size, continuing its sequence
+    def _open(self, size):
+        self.close()
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0644)
+        try:
+            if os.fstat(fd).st_size < size:
+                os.ftruncate(fd, size)
+            self._map = mmap.mmap(fd, os.fstat(fd).st_size)
+        finally:
+            os.close(fd)
+        self._seq = _REGION_SEQ.unpack_from(self._map)[0]
+        self._seq += self._seq % 2
+
+    def read(self):
+        """ Return (sequence number, timestamp, JSON status) from the region, or None if
+            there is no region (or it cannot be read consistently).
+        """
+        for _ in xrange(_REGION_RETRIES):
+            if not self._map_read():
+                return None
+            seq, timestamp, n = _REGION_HEADER.unpack_from(self._map)
+            if seq % 2 == 1:
+                sleep(0)
+                continue
+            if _REGION_HEADER.size + n > len(self._map):
+                self.close() # grown since mapped
+                continue
+            raw = self._map[_REGION_HEADER.size:_REGION_HEADER.size + n]
+            if _REGION_SEQ.unpack_from(self._map)[0] == seq:
+                return seq, timestamp, raw
+        log.warn("Could not read status region %s", self.path)
+        return None
+
+    def seq(self):
+        """ Return the current sequence number of the region, or None if there is no region.
+        """
+        if not self._map_read():
+            return None
+        return _REGION_SEQ.unpack_from(self._map)[0]
+
+    # map the region for reading, if not already mapped (or if the file has been replaced or
+    # grown), returning whether there is a region
+    def _map_read(self):
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            self.close()
+            return False
+        if self._map is None or self._inode != stat.st_ino or len(self._map) != stat.st_size:
+            self.close()
+            if stat.st_size < _REGION_HEADER.size:
+                return False
+            try:
+                with open(self.path, 'rb') as f:
+                    self._map = mmap.mmap(f.fileno(), stat.st_size, access=mmap.ACCESS_READ)
+            except (EnvironmentError, ValueError):
+                return False # removed or replaced since the stat
+            self._inode = stat.st_ino
+        return True
+
+    def close(self):
+        """ Unmap the region.
+        """
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+            self._inode = None
+
+    def remove(self):
+        """ Unmap and delete the region.
+        """
+        self.close()
+        if os.path.isfile(self.path):
+            os.remove(self.path)
+
+
+# check that a process with the given PID exists, raising OSError (with errno ESRCH) if not - this
+# needs no permission to signal the process, so is done here rather than with pid_kill
+def _check_pid(pid):
+    if os.path.isdir('/proc'):
+        if not os.path.exists('/proc/{0}'.format(pid)):
+            raise OSError(errno.ESRCH, os.strerror(errno.ESRCH))
+        return
+    try:
+        os.kill(pid, 0)
+    except OSError as e:
+        if e.errno != errno.EPERM: # exists, but owned by another user
+            raise
+
+
 class Process(object):
     """ Start the process with start(), after supplying the data store, pid file,
         config file and status file names.
@@ -29,6 +163,14 @@ class Process(object):
         the name of the worker used in the data store and UI.
 
         Sub-classes may need to override get_capabilities().
+
+        The status yielded by the iterator is published at most every STATUS_PUBLISH_MS,
+        unless the iterator yields True for a significant change (e.g. a new sweep), which
+        is published immediately. Other changes in between are coalesced.
+
+        Clients control the process through a Unix domain socket in the run path, on which
+        each connection sends one JSON command and receives one JSON reply (see Client),
+        falling back to the config file and signals if there is no socket.
     """
     def __init__(self, data_store, prefix=None, run_path=None, config_file=None):
         self.data_store = data_store
@@ -41,7 +183,9 @@ class Process(object):
             pass
         self.pid_file = os.path.join(run_path, 'pid')
         self.status_file = os.path.join(run_path, 'status')
+        self.status_region = StatusRegion(os.path.join(run_path, 'status_region'))
         self.caps_file = os.path.join(run_path, 'caps')
+        self.control_file = os.path.join(run_path, 'control')
         if config_file is None: # allow for config override, otherwise use pattern
             self.config_file = CONFIG_PATH.replace('$', prefix)
         else:
@@ -51,6 +195,15 @@ class Process(object):
         self._tidy = False
         self.config_id = None
         self.status = {}
+        self.status_json = STATUS_JSON
+        self.publish_ms = STATUS_PUBLISH_MS
+        self.status_counts = {'published': 0, 'coalesced': 0}
+        self._publish_time = None
+        self._status_raw = '{}'
+        self._wake = None
+        self._control = None
+        self._running = False
+        self._state = Condition()
 
     def get_capabilities(self):
         return {}
@@ -71,7 +224,7 @@ class Process(object):
             with open(self.pid_file) as f:
                 pid = f.read().strip()
             pid = int(pid)
-            kill(pid, 0)
+            _check_pid(pid)
             return pid
         except IOError:
             raise ProcessError("Can not open PID file: {0}".format(self.pid_file))
@@ -79,16 +232,39 @@ class Process(object):
             raise ProcessError("Bad PID: {0}".format(pid))
         except OSError as e:
             if e.errno not in errno.errorcode:
-                raise ProcessError("Bad PID ({0}): {1}".format(pid, e.message))
+                raise ProcessError("Bad PID ({0}): {1}".format(pid, e.strerror))
             raise ProcessError("Bad PID ({0}): {1}".format(pid, errno.errorcode[e.errno]))
 
-    # write status to the status file
+    # write status to the status region (and to the status file, if so configured)
     def _write_status(self):
-        log.debug("Writing status %s", json.dumps(self.status))
-        tmp = self.status_file + '_tmp'
-        with open(tmp, 'w') as f:
-            f.write(json.dumps(self.status))
-        os.rename(tmp, self.status_file)
+        raw = self._status_raw = json.dumps(self.status)
+        log.debug("Writing status %s", raw)
+        self.status_region.write(raw, now())
+        if self.status_json:
+            tmp = self.status_file + '_tmp'
+            with open(tmp, 'w') as f:
+                f.write(raw)
+            os.rename(tmp, self.status_file)
+
+    # publish the status if the change is significant, or if publish_ms have elapsed since
+    # it was last published, and otherwise count it as coalesced
+    def _publish_status(self, significant=False):
+        timestamp = now()
+        if significant or self._publish_time is None or timestamp >= self._publish_time + self.publish_ms:
+            self._write_status()
+            self._publish_time = timestamp
+            self.status_counts['published'] += 1
+        else:
+            self.status_counts['coalesced'] += 1
+
+    # clear the status (when not running a config), removing it altogether if exiting
+    def _clear_status(self, exiting=False):
+        if exiting:
+            self.status_region.remove()
+        else:
+            self.status_region.write('', now())
+        if os.path.isfile(self.status_file):
+            os.remove(self.status_file)
 
     # define signal handler for given signal in order to exit cleanly
     def _set_signal(self, signame, stop=True, exit=False, tidy=False): # pylint: disable=redefined-builtin
@@ -98,6 +274,113 @@ class Process(object):
             self._tidy = tidy
         signal.signal(getattr(signal, signame), _callback)
 
+    # create the wake pipe, written to by signals and control commands to wake the process
+    # when waiting for a config, and listen on the control socket
+    def _init_control(self):
+        self._wake = os.pipe()
+        for fd in self._wake:
+            fcntl.fcntl(fd, fcntl.F_SETFL, fcntl.fcntl(fd, fcntl.F_GETFL) | os.O_NONBLOCK)
+        signal.set_wakeup_fd(self._wake[1])
+        if os.path.exists(self.control_file):
+            os.remove(self.control_file)
+        self._control = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._control.bind(self.control_file)
+        os.chmod(self.control_file, 0666) # as with pid_kill, any local user may control workers
+        self._control.listen(4)
+        thread = Thread(target=self._serve_control)
+        thread.daemon = True
+        thread.start()
+
+    # serve control commands, one per connection
+    def _serve_control(self):
+        while True:
+            try:
+                conn, _ = self._control.accept()
+            except socket.error:
+                return # closed
+            try:
+                conn.settimeout(CONTROL_TIMEOUT_SECS)
+                try:
+                    reply = self._control_command(json.loads(conn.makefile().readline()))
+                except (ValueError, TypeError, KeyError) as e:
+                    reply = {'error': "Bad command: {0}".format(e)}
+                conn.sendall(json.dumps(reply) + '\n')
+            except socket.error as e:
+                log.warn("Control connection error: %s", e)
+            finally:
+                conn.close()
+
+    # return the reply to a control command - start and stop wait (for a while) for the
+    # process to start or stop running a config, and say whether it has
+    def _control_command(self, request):
+        command = request['command']
+        if command == 'ping':
+            return {'ok': True}
+        if command == 'status':
+            return {'ok': True, 'config_id': self.config_id if self._running else None, 'status': json.loads(self._status_raw)}
+        if command == 'start':
+            if self._running:
+                return {'error': "Already running config {0}".format(self.config_id)}
+            with open(self.config_file, 'w') as f:
+                f.write(request['config_id'])
+            self._stop, self._exit, self._tidy = True, False, True # as for SIGUSR1
+            self._wakeup()
+            return {'ok': True, 'started': self._wait_running(True)}
+        if command == 'stop':
+            self._stop, self._exit, self._tidy = True, False, True # as for SIGUSR1
+            self._wakeup()
+            return {'ok': True, 'stopped': self._wait_running(False)}
+        return {'error': "Unknown command: {0}".format(command)}
+
+    # wake the process if it is waiting for a config
+    def _wakeup(self):
+        try:
+            os.write(self._wake[1], '\0')
+        except OSError as e:
+            if e.errno != errno.EAGAIN:
+                raise
+
+    # wait for a signal or control command (on the wake pipe, if there is one, which avoids
+    # missing a signal received just before waiting)
+    def _wait(self):
+        if self._wake is None:
+            signal.pause()
+            return
+        try:
+            select.select([self._wake[0]], [], [])
+        except select.error as e:
+            if e.args[0] != errno.EINTR:
+                raise
+        try:
+            while len(os.read(self._wake[0], 4096)) > 0:
+                pass
+        except OSError as e:
+            if e.errno != errno.EAGAIN:
+                raise
+
+    # record whether the process is running a config
+    def _set_running(self, running):
+        with self._state:
+            self._running = running
+            self._state.notify_all()
+
+    # wait (for up to CONTROL_TIMEOUT_SECS) until the process is, or is not, running a config,
+    # returning whether it is as required
+    def _wait_running(self, running):
+        end = time() + CONTROL_TIMEOUT_SECS
+        with self._state:
+            while self._running != running and time() < end:
+                self._state.wait(end - time())
+            return self._running == running
+
+    # stop listening on the control socket
+    def _close_control(self):
+        if self._control is not None:
+            self._control.close()
+            self._control = None
+            if os.path.exists(self.control_file):
+                os.remove(self.control_file)
+
     # read the config file
     def _read_config(self):
         if not os.path.isfile(self.config_file):
@@ -115,6 +398,8 @@ class Process(object):
         """ Start the process, writing status yielded by iterator.
         """
         log.info("STARTING")
+        # before opening the rig, as the Hamlib bindings are not thread-safe (capabilities are
+        # cached on disk, so this is only slow when Hamlib has changed)
         self.write_caps()
         self.open()
         try:
@@ -128,30 +413,39 @@ class Process(object):
                         log.error("No config for id: %s", self.config_id)
                         os.remove(self.config_file)
                     else:
+                        # the worker's own converted values (those read may be shared by the data store)
+                        if config.values is not None:
+                            config.values = convert_config(config.values)
                         log.debug("Running with config: %s", json.dumps(config.values))
                         self._stop = False
                         self.status.clear()
+                        self._publish_time = None
+                        self.status_counts = {'published': 0, 'coalesced': 0}
                         count = config.counts[self.prefix] if self.prefix in config.counts else 0
-                        try:
-                            for _ in self.iterator(config, count):
-                                self._write_status()
-                                if self._stop:
-                                    break
-                        except BaseException as e: # pylint: disable=broad-except
-                            log.exception(e)
-                            config.write_error(self.prefix, now(), e)
-                if os.path.isfile(self.status_file):
-                    os.remove(self.status_file)
+                        self._set_running(True)
+                        with config.writer():
+                            try:
+                                for significant in self.iterator(config, count):
+                                    self._publish_status(significant)
+                                    config.flush(force=False)
+                                    if self._stop:
+                                        break
+                            except BaseException as e: # pylint: disable=broad-except
+                                log.exception(e)
+                                config.write_error(self.prefix, now(), e)
+                        log.info("Status updates: %(published)d published, %(coalesced)d coalesced", self.status_counts)
+                self._clear_status()
                 if self._tidy and os.path.isfile(self.config_file):
                     os.remove(self.config_file)
+                self._set_running(False)
                 if self._exit:
                     break
-                signal.pause()
+                self._wait()
         finally:
             log.info("STOPPING")
+            self._close_control()
             os.remove(self.pid_file)
-            if os.path.isfile(self.status_file):
-                os.remove(self.status_file)
+            self._clear_status(True)
             self.close()
 
     def stop(self):
@@ -177,6 +471,7 @@ class Process(object):
         self._set_signal('SIGINT', exit=True)
         self._set_signal('SIGHUP', exit=True)
         self._set_signal('SIGUSR1', tidy=True)
+        self._init_control()
 
     def client(self):
         """ Return a client for the process.
@@ -184,83 +479,266 @@ class Process(object):
         return Client(self)
 
     def iterator(self, _): # pylint: disable=no-self-use
-        """ Sub-classes should implement.
+        """ Sub-classes should implement, yielding whenever the status changes (True if
+            the change should be published immediately).
         """
         return
         yield # pylint: disable=unreachable
 
 
 class Client(object):
-    """ Client class used to read status and PID files from other processes.
+    """ Client class used to read status and PID files from other processes. A client may be
+        shared by several threads (e.g. server requests and the StatusWatcher).
     """
     def __init__(self, process):
         self.process = process
         self.prefix = process.prefix
         self.pid = None
         self.error = None
+        self._pid_time = None
+        self._region = StatusRegion(process.status_region.path)
+        self._region_status = {}
+        self._caps = None
+        self._caps_stat = None
+        self._lock = RLock() # guards the state above, and the status region mapping
 
-    def read_pid(self):
-        """ Read and return the process PID.
+    def read_pid(self, ttl=LIVENESS_TTL_SECS):
+        """ Read and return the process PID (None if the process is not running), unless it
+            was read less than ttl seconds ago, when the previous result is returned.
         """
-        try:
-            self.pid = self.process.read_pid()
-            self.error = None
-        except ProcessError as e:
-            self.error = e.message
-        if self.pid is None and self.error is None:
-            self.error = "No {0} process".format(self.process.__class__.__name__.lower())
-        return self.pid
+        with self._lock:
+            if self._pid_time is not None and time() < self._pid_time + ttl:
+                return self.pid
+            try:
+                self.pid = self.process.read_pid()
+                self.error = None
+            except ProcessError as e:
+                self.pid = None
+                self.error = e.message
+            if self.pid is None and self.error is None:
+                self.error = "No {0} process".format(self.process.__class__.__name__.lower())
+            self._pid_time = time()
+            return self.pid
 
     def get_capabilities(self):
-        """ Read the caps file to report capabilities.
+        """ Read the caps file to report capabilities (re-reading it only when it has
+            changed since the last call).
         """
-        if not os.path.isfile(self.process.caps_file):
-            return None
-        with open(self.process.caps_file) as f:
-            return json.loads(f.read())
+        with self._lock:
+            stat = _stat(self.process.caps_file)
+            if stat is None:
+                return None
+            if stat != self._caps_stat:
+                with open(self.process.caps_file) as f:
+                    self._caps = json.loads(f.read())
+                self._caps_stat = stat
+            return self._caps
 
     def status(self):
         """ Read and return the process status.
         """
-        self.read_pid()
+        with self._lock:
+            self.read_pid()
 
-        if not os.path.isfile(self.process.status_file):
-            status = {}
-        else:
-            stat = os.stat(self.process.status_file)
-            with open(self.process.status_file, 'r') as f:
-                status = json.loads(f.read())
-            status['timestamp'] = int(1000 * stat.st_mtime)
-        if self.error is not None:
-            status['error'] = self.error
-        return status
+            status = self._read_region()
+            if status is None and not os.path.isfile(self.process.status_file):
+                status = {}
+            elif status is None:
+                stat = os.stat(self.process.status_file)
+                with open(self.process.status_file, 'r') as f:
+                    status = json.loads(f.read())
+                status['timestamp'] = int(1000 * stat.st_mtime)
+            if self.error is not None:
+                status['error'] = self.error
+            return status
+
+    # return the status from the status region, or None if there is no region - the seqlock
+    # has no memory barriers, so on some CPUs (e.g. ARM) a torn status can pass its checks,
+    # and is read again (falling back to the last good status)
+    def _read_region(self):
+        for _ in xrange(_REGION_RETRIES):
+            region = self._region.read()
+            if region is None:
+                return None
+            _, timestamp, raw = region
+            try:
+                status = json.loads(raw) if len(raw) > 0 else {}
+            except ValueError:
+                sleep(0)
+                continue
+            if len(raw) > 0:
+                status['timestamp'] = timestamp
+            self._region_status = status
+            return dict(status)
+        log.warn("Could not parse status region %s", self._region.path)
+        return dict(self._region_status)
+
+    def status_version(self):
+        """ Return a value that changes whenever the process status is written (without
+            reading the status itself).
+        """
+        with self._lock:
+            seq = self._region.seq()
+        return seq if seq is not None else _stat(self.process.status_file)
 
     def config_id(self):
         """ Read and return the running config id, if any.
         """
         return self.process._read_config()
 
+    # send a command to the process control socket and return the reply, or None if there is
+    # no control socket (e.g. the process is not running)
+    def _command(self, command, **kwargs):
+        kwargs['command'] = command
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(2 * CONTROL_TIMEOUT_SECS)
+        try:
+            sock.connect(self.process.control_file)
+            sock.sendall(json.dumps(kwargs) + '\n')
+            reply = json.loads(sock.makefile().readline())
+        except (socket.error, ValueError):
+            return None
+        finally:
+            sock.close()
+        if 'error' in reply:
+            raise ProcessError(reply['error'])
+        return reply
+
+    def ping(self):
+        """ Return whether the process responds on its control socket.
+        """
+        try:
+            return self._command('ping') is not None
+        except ProcessError:
+            return False
+
     def start(self, config_id):
-        """ Tell the process to start processing the specified config id.
+        """ Tell the process to start processing the specified config id, returning whether
+            it has (or None, if not known as the process has no control socket).
         """
-        if self.read_pid() is not None:
+        reply = self._command('start', config_id=config_id)
+        if reply is not None:
+            return reply['started']
+        if self.read_pid(0) is not None:
             with open(self.process.config_file, 'w') as f:
                 f.write(config_id)
             kill(self.pid, signal.SIGUSR1)
+        return None
 
     def stop(self):
-        """ Tell the process to stop processing.
+        """ Tell the process to stop processing, returning whether it has (or None, if not
+            known as the process has no control socket).
         """
-        if self.read_pid() is not None:
+        reply = self._command('stop')
+        if reply is not None:
+            return reply['stopped']
+        if self.read_pid(0) is not None:
             kill(self.pid, signal.SIGUSR1)
+        return None
 
     def exit(self, tidy=True):
         """ Tell the process to exit.
         """
-        if self.read_pid() is not None:
+        if self.read_pid(0) is not None:
             kill(self.pid, signal.SIGINT if tidy else signal.SIGTERM)
 
 
+# return (inode, modification time, size) for a file, or None if there is no such file
+def _stat(path):
+    try:
+        stat = os.stat(path)
+        return stat.st_ino, stat.st_mtime, stat.st_size
+    except OSError:
+        return None
+
+
+class StatusWatcher(object):
+    """ Watch the status of processes, through their clients, and notify subscribers of
+        changes. A single thread (running while there are subscribers) checks the status
+        versions and config files of all the processes every STATUS_EVENTS_WATCH_SECS,
+        reading a status only if either has changed, or every STATUS_EVENTS_CHECK_SECS (to
+        check the PID).
+    """
+    def __init__(self, clients, watch_secs=STATUS_EVENTS_WATCH_SECS, check_secs=STATUS_EVENTS_CHECK_SECS):
+        self.clients = clients
+        self.watch_secs = watch_secs
+        self.check_secs = check_secs
+        self._queues = set()
+        self._lock = Lock()
+        self._thread = None
+        self._check_time = None
+        self._stats = {}
+        self._status = {}
+
+    @contextmanager
+    def subscribe(self):
+        """ Context manager returning a queue, on which the whole status (as for GET /process)
+            is put first, then a dictionary of changes to it whenever there are any: the new
+            status for each worker whose status has changed, and the config id (None if there
+            is no longer a config running) if that has changed.
+        """
+        queue = Queue()
+        with self._lock:
+            if self._thread is None:
+                self._changes(True)
+                self._thread = Thread(target=self._run)
+                self._thread.daemon = True
+                self._thread.start()
+            queue.put(dict((k, v) for k, v in self._status.iteritems() if v is not None))
+            self._queues.add(queue)
+        try:
+            yield queue
+        finally:
+            with self._lock:
+                self._queues.discard(queue)
+
+    def _run(self):
+        try:
+            while True:
+                sleep(self.watch_secs)
+                with self._lock:
+                    if len(self._queues) == 0:
+                        self._thread = None
+                        return
+                    try:
+                        changes = self._changes(time() >= self._check_time + self.check_secs)
+                    except Exception as e: # pylint: disable=broad-except
+                        log.exception(e)
+                        continue
+                    if len(changes) > 0:
+                        for queue in self._queues:
+                            queue.put(changes)
+        finally:
+            # if stopped by an unexpected error (e.g. in a queue), let the next subscriber
+            # start another
+            with self._lock:
+                if self._thread is current_thread():
+                    self._thread = None
+
+    # return changes to the status since last called (called with the lock held) - a client's
+    # status is read only if its files have changed, or if check is True
+    def _changes(self, check):
+        changes = {}
+        changed = check
+        if check:
+            self._check_time = time()
+        for client in self.clients:
+            stats = client.status_version(), _stat(client.process.config_file)
+            if not check and stats == self._stats.get(client.prefix):
+                continue
+            changed = True
+            self._stats[client.prefix] = stats
+            status = client.status()
+            if status != self._status.get(client.prefix):
+                changes[client.prefix] = self._status[client.prefix] = status
+        if changed:
+            config_ids = [client.config_id() for client in self.clients]
+            config_id = next((x for x in config_ids if x is not None), None)
+            if config_id != self._status.get('config_id'):
+                changes['config_id'] = self._status['config_id'] = config_id
+        return changes
+
+
 class ProcessError(Exception):
     """ Class for process specific exceptions.
     """
@@ -21,7 +21,8 @@
 """
 import os
 from time import sleep, time
-from spectrum.common import log, parse_config, scan, now
+from spectrum.common import log, now
+from spectrum.peaks import sweep_peaks, peak_status
 from spectrum.datastore import StoreError
 from spectrum.process import Process
 from spectrum.config import RDS_DEVICE, MONKEY_POLL
@@ -48,7 +49,7 @@ class Worker(Process):
     def iterator(self, config, initial_count):
         """ Decode RDS, store data via the config object, and yield status.
         """
-        scan_config = parse_config(config.values, 'rds')
+        plan = config.scan_plan('rds')
         self.config = config
         self.rds = config.values['rds']
         self.scan_enabled = self.rds['scan']['enabled']
@@ -57,20 +58,22 @@ class Worker(Process):
 
         with RdsApi(RDS_DEVICE) as self.api:
             sweep_n = 0
+            peaks = []
             while True:
                 time_0 = now()
-                self.status['sweep'] = {'timestamp': time_0}
+                self.status['sweep'] = {'timestamp': time_0, 'peaks': peaks}
                 self.status['sweep']['sweep_n'] = initial_count + sweep_n
-                yield
+                yield True
 
                 strengths = []
-                for idx, freq in scan(scan_config):
+                for idx, freq in plan:
                     s = []
                     for strength in self._decode_freq(idx, freq):
                         s.append(strength)
                         yield
                     strengths.append(max(s))
 
+                peaks = self.status['sweep']['peaks'] = peak_status(strengths, sweep_peaks(strengths))
                 config.write_spectrum(self.prefix, time_0, strengths) #FIXME TOTAL HACK
                 sweep_n += 1
 
@@ -0,0 +1,74 @@
+""" Reading strengths from the rig on a dedicated thread, so that the rig can be kept busy
+    while a worker does its bookkeeping (status, temperature, data store writes).
+"""
+import sys
+import threading
+from Queue import Queue
+from time import time
+from spectrum.common import now
+
+
+class RigReader(threading.Thread):
+    """ Thread reading strengths, using the given read function (of a frequency), for sweeps
+        of frequencies submitted by sweep(). Only one sweep may be in progress at a time, and
+        nothing else should use the rig until it is complete (or the reader is closed).
+    """
+    def __init__(self, read):
+        super(RigReader, self).__init__(name='rig_reader')
+        self.daemon = True
+        self._read = read
+        self._requests = Queue()
+        self._results = Queue()
+        self._stopping = threading.Event()
+        self.rig_secs = 0.0 # time spent reading in the current (or last) sweep
+        self.wait_secs = 0.0 # time spent waiting for results in the current (or last) sweep
+
+    def run(self):
+        while True:
+            freqs = self._requests.get()
+            if freqs is None:
+                return
+            for idx, freq in freqs:
+                if self._stopping.is_set():
+                    break
+                time_0 = time()
+                try:
+                    strength = self._read(freq)
+                except BaseException: # pylint: disable=broad-except
+                    self._results.put(sys.exc_info())
+                    break
+                finally:
+                    self.rig_secs += time() - time_0
+                self._results.put((idx, freq, strength, now()))
+            self._results.put(None)
+
+    def sweep(self, freqs):
+        """ Start reading the given (freq_n, frequency) pairs, and return an iterator of
+            (freq_n, frequency, strength, timestamp) results as they are read. An exception
+            raised by the read function is raised by the iterator.
+        """
+        self.rig_secs = 0.0
+        self.wait_secs = 0.0
+        self._requests.put(list(freqs))
+        return self._iter_results()
+
+    def _iter_results(self):
+        while True:
+            time_0 = time()
+            result = self._results.get()
+            self.wait_secs += time() - time_0
+            if result is None:
+                return
+            if len(result) == 3:
+                # drain the end of sweep marker, then raise the exception
+                self._results.get()
+                raise result[0], result[1], result[2]
+            yield result
+
+    def close(self):
+        """ Stop reading (after any read in progress) and wait for the thread to finish.
+        """
+        self._stopping.set()
+        self._requests.put(None)
+        if self.is_alive():
+            self.join()
@@ -0,0 +1,52 @@
+""" Adaptive scheduling of the channels measured in each sweep.
+"""
+import numpy
+from spectrum.peaks import sweep_peaks, MISSING
+
+
+class AdaptiveSchedule(object):
+    """ Decide which of n channels to measure in each sweep. Every channel is measured in
+        the first sweep. After that, a channel that has been quiet for quiet_sweeps of its
+        measurements is measured every other sweep, then every 4th after another
+        quiet_sweeps, and so on, up to every max_interval sweeps. Neighbouring quiet
+        channels are measured in different sweeps, so sweeps take a similar time. A channel
+        becomes active again (and is measured every sweep) when it is at a peak or next to
+        one, or is at least threshold (if given).
+    """
+    def __init__(self, n, quiet_sweeps=4, max_interval=8, threshold=None):
+        self.quiet_sweeps = quiet_sweeps
+        self.max_interval = max_interval
+        self.threshold = threshold
+        self.sweep_n = 0
+        self.levels = numpy.full(n, MISSING, dtype=numpy.int16) # latest measured strength of each channel
+        self._quiet = numpy.zeros(n, dtype=numpy.int32) # consecutive quiet measurements
+        # no more are counted once a channel is at max_interval (so the interval cannot overflow)
+        self._max_quiet = quiet_sweeps * int(numpy.ceil(numpy.log2(max(max_interval, 1))))
+        self._last = numpy.full(n, -max_interval, dtype=numpy.int64) # sweep each channel was last measured
+        self._phase = numpy.arange(n)
+
+    def due(self):
+        """ Return a boolean array of the channels to measure in the current sweep.
+        """
+        interval = numpy.minimum(self.max_interval, 2 ** (self._quiet // self.quiet_sweeps))
+        return ((self.sweep_n + self._phase) % interval == 0) | (self.sweep_n - self._last >= interval)
+
+    def update(self, due, strengths):
+        """ Record the strengths for a completed sweep (MISSING where a channel was not due),
+            and return the latest strengths of all channels and the peaks among them.
+        """
+        strengths = numpy.asarray(strengths)
+        self.levels[due] = strengths[due]
+        self._last[due] = self.sweep_n
+        peaks = sweep_peaks(self.levels, self.threshold)
+
+        active = numpy.zeros(len(self.levels), dtype=bool)
+        for offset in (-1, 0, 1):
+            active[numpy.clip(peaks + offset, 0, len(active) - 1)] = True
+        if self.threshold is not None:
+            active |= self.levels >= self.threshold
+        self._quiet[due & active] = 0
+        quiet = due & ~active
+        self._quiet[quiet] = numpy.minimum(self._quiet[quiet] + 1, self._max_quiet)
+        self.sweep_n += 1
+        return self.levels, peaks
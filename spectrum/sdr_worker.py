@@ -3,7 +3,8 @@
 import threading
 import sys
 from spectrum.process import Process
-from spectrum.common import log, parse_config, now
+from spectrum.common import log, now
+from spectrum.peaks import sweep_peaks, peak_status
 from sdrplay import SdrPlay, Callback_Continue, Callback_Reinit, Callback_Exit
 
 class Worker(Process):
@@ -25,7 +26,8 @@ class Worker(Process):
 
             if reinit: # True at start and when a requested frequency change has occurred
                 first_n = int((self.freq_0 - self.range[0]) / self.range[2])
-                self.status['sweep'] = {'freq_0': self.freq_0, 'freq_1': self.freq_0 + self.sdr.sdr_config.fsMHz, 'timestamp': self.time_0}
+                self.status['sweep'] = {'freq_0': self.freq_0, 'freq_1': self.freq_0 + self.sdr.sdr_config.fsMHz, 'timestamp': self.time_0,
+                                        'peaks': self.peaks}
                 self.status['debug']['first_n'] = first_n
                 self.freq_0 = self.sdr.freq_0() # min frequency collected at this rfMHz (tuner frequency)
 
@@ -53,6 +55,7 @@ class Worker(Process):
                     # sweep complete, start new one
                     if None not in self.sweep:
                         self.config.write_spectrum(self.prefix, self.time_0, self.sweep)
+                        self.peaks = peak_status(self.sweep, sweep_peaks(self.sweep))
                         self.sweep_n += 1
                     self.time_0 = now()
                     self.sweep = [None] * (int((self.range[1] - self.range[0]) / self.range[2]) + 1)
@@ -84,7 +87,7 @@ class Worker(Process):
         """
         values = config.values[self.prefix] #FIXME this should just be passed in, or something...
 
-        self.range = [f / 1e6 for f in parse_config(config.values, self.prefix)[0]]
+        self.range = [f / 1e6 for f in config.scan_plan(self.prefix).scan_config[0]]
         self.config = config
 
         self.status.clear()
@@ -99,6 +102,7 @@ class Worker(Process):
         self.freq_0 = self.sdr.freq_0()
         self.levels = None
         self.count = 0
+        self.peaks = []
         self.sweep = [None] * (int((self.range[1] - self.range[0]) / self.range[2]) + 1)
 
         sdr_thread = threading.Thread(target=self.sdr.main)
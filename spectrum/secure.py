@@ -2,6 +2,7 @@
 """
 import os
 import re
+import zlib
 import functools
 import mimetypes
 from time import time
@@ -9,7 +10,7 @@ from flask import Flask, current_app, redirect, request, Response, send_file
 from flask_login import LoginManager, login_required, current_user, login_user, logout_user
 from spectrum.common import log
 from spectrum.users import IncorrectPasswordError
-from spectrum.config import USER_TIMEOUT_SECS
+from spectrum.config import USER_TIMEOUT_SECS, COMPRESS_MIN_SIZE, COMPRESS_LEVEL
 
 
 class User(object):
@@ -37,8 +38,25 @@ class User(object):
         return event
 
 
+# content encodings supported for responses, with zlib window bits for each
+COMPRESS_ENCODINGS = (('gzip', 16 + zlib.MAX_WBITS), ('deflate', zlib.MAX_WBITS))
+
+# mimetypes of responses that are compressed
+COMPRESS_MIMETYPES = ('application/json', 'text/csv', 'text/plain', 'text/html')
+
+
+# yield the given chunks compressed with the given zlib compressor
+def _iter_compressed(chunks, compressor):
+    for chunk in chunks:
+        raw = compressor.compress(chunk)
+        if len(raw) > 0:
+            yield raw
+    yield compressor.flush()
+
+
 class SecureStaticFlask(Flask): # pylint: disable=too-many-instance-attributes
-    """ Sub-class Flask to secure static files, and add support for partial byte ranges.
+    """ Sub-class Flask to secure static files, and add support for partial byte ranges
+        and compressed responses.
 
         The curious looking two-step initialisation is so that the application instance can
         be created at import time for the decorators to work.
@@ -48,6 +66,7 @@ class SecureStaticFlask(Flask): # pylint: disable=too-many-instance-attributes
         super(SecureStaticFlask, self).__init__(name, **args)
         self._init_logging()
         self.after_request(lambda rsp: rsp.headers.add('Accept-Ranges', 'bytes') or rsp)
+        self.after_request(self.compress_response)
 
     def initialise(self, users):
         """ Initialise the application - need a second initialiser so that we can instantiate
@@ -118,6 +137,36 @@ class SecureStaticFlask(Flask): # pylint: disable=too-many-instance-attributes
         rsp.headers.add('Content-Range', bytes_range)
         return rsp
 
+    def compress_response(self, rsp): # pylint: disable=no-self-use
+        """ Compress a JSON, CSV or text response with gzip or deflate, if accepted by the
+            client. Streamed responses are compressed as they are streamed, other responses
+            only if at least COMPRESS_MIN_SIZE bytes.
+
+            The response ETag (if any) is made weak, as the compressed bytes depend on the
+            compression level, so that conditional requests still match.
+        """
+        if rsp.mimetype not in COMPRESS_MIMETYPES or rsp.direct_passthrough or 'Content-Encoding' in rsp.headers:
+            return rsp
+        encoding = request.accept_encodings.best_match([name for name, _ in COMPRESS_ENCODINGS])
+        if encoding is None:
+            return rsp
+        rsp.vary.add('Accept-Encoding')
+        etag, weak = rsp.get_etag()
+        if etag is not None and not weak:
+            rsp.set_etag(etag, weak=True)
+        if rsp.status_code != 200 or 'Range' in request.headers:
+            return rsp
+        if not rsp.is_streamed and rsp.calculate_content_length() < COMPRESS_MIN_SIZE:
+            return rsp
+        compressor = zlib.compressobj(COMPRESS_LEVEL, zlib.DEFLATED, dict(COMPRESS_ENCODINGS)[encoding])
+        if rsp.is_streamed:
+            rsp.response = _iter_compressed(rsp.iter_encoded(), compressor)
+            rsp.headers.pop('Content-Length', None)
+        else:
+            rsp.set_data(compressor.compress(rsp.get_data()) + compressor.flush())
+        rsp.headers['Content-Encoding'] = encoding
+        return rsp
+
     def load_user(self, username, password=None):
         """ User loader for flask-login.
         """
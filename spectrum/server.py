@@ -4,6 +4,10 @@ import json
 import os
 import subprocess
 import heapq
+import hashlib
+from Queue import Empty
+from threading import BoundedSemaphore
+from time import time
 from datetime import datetime
 from StringIO import StringIO
 from slugify import slugify
@@ -11,17 +15,51 @@ from flask import redirect, request, Response, send_file
 from flask_login import current_user
 from spectrum.tail import iter_tail
 from spectrum.datastore import StoreError
-from spectrum.common import log, now, parse_config, scan, freq
+from spectrum.process import ProcessError
+from spectrum.common import log, now, iter_json
+from spectrum.cache import LRUCache
 from spectrum.users import IncorrectPasswordError, UsersError
 from spectrum.webapp import WebApplication
 from spectrum.audio import AudioStream
 from spectrum.event import EVENT_IDENT, EVENT_LOGIN, EVENT_LOGOUT, EVENT_START, EVENT_STOP
-from spectrum.config import UI_CONFIG, EXPORT_DIRECTORY, PI_CONTROL_PATH, PICO_PATH
+from spectrum.config import UI_CONFIG, EXPORT_DIRECTORY, PI_CONTROL_PATH, PICO_PATH, RESPONSE_CACHE_SIZE, \
+                           RESPONSE_CACHE_ENTRY_SIZE, STATUS_EVENTS_CHECK_SECS, STATUS_EVENTS_MAX_STREAMS
 from spectrum.main import WORKER_MODULES
 
 
 application = WebApplication(__name__) # pylint: disable=invalid-name
 
+ERRORS_LIMIT = 100 # default page size for /errors
+
+# encoded responses for completed configs, by ETag
+response_cache = LRUCache(RESPONSE_CACHE_SIZE, len) # pylint: disable=invalid-name
+
+# open /events streams, each holding a server thread (so they are limited)
+event_streams = BoundedSemaphore(STATUS_EVENTS_MAX_STREAMS) # pylint: disable=invalid-name
+
+
+# return whether any worker is running with the given config id
+def _is_running(config_id):
+    return any(c.config_id() == config_id for c in application.clients)
+
+
+# return a response with the given mimetype for the body returned by make_body (an iterator
+# over strings) - for a completed config, this has an ETag, and is 304 if the client has the
+# current version, and otherwise is served from the cache if possible (there is no
+# Last-Modified time, as the version covers data with earlier timestamps, e.g. errors)
+def _config_response(config, make_body, mimetype, headers=None):
+    version = None if _is_running(config.id) else config.version()
+    if version is None:
+        return Response(make_body(), mimetype=mimetype, headers=headers)
+    etag = hashlib.sha1('\n'.join((version, mimetype, request.full_path))).hexdigest()
+    body = response_cache.get(etag)
+    if body is None:
+        # not consumed if the response turns out to be 304
+        body = response_cache.iter_put(etag, make_body(), RESPONSE_CACHE_ENTRY_SIZE)
+    response = Response(body, mimetype=mimetype, headers=headers)
+    response.set_etag(etag)
+    return response.make_conditional(request)
+
 
 @application.route('/', methods=['GET', 'POST'])
 def main_endpoint():
@@ -135,7 +173,10 @@ def process():
             return e.message, 500
 
         for c in clients:
-            c.start(config.id)
+            try:
+                c.start(config.id)
+            except ProcessError as e:
+                return e.message, 400
 
         application.event_client.write(EVENT_START, config.values)
 
@@ -148,6 +189,36 @@ def process():
         return json.dumps({})
 
 
+@application.route('/events')
+@application.role_required(['admin', 'freq', 'data'])
+def events_endpoint():
+    """ Server-sent events stream of process status. The first event is the whole status (as
+        for GET /process), subsequent events the changes to it (see StatusWatcher.subscribe).
+
+        An open stream keeps the user's session alive, and ends when the user is logged out.
+        Each open stream holds a server thread, so there are at most STATUS_EVENTS_MAX_STREAMS
+        (further requests get 503).
+    """
+    if not event_streams.acquire(False):
+        return "Too many status event streams", 503
+    name = current_user.name
+
+    def _iter_events():
+        with application.status_watcher.subscribe() as queue:
+            while name in application.logged_in_users:
+                application.request_times[name] = time()
+                try:
+                    status = queue.get(timeout=STATUS_EVENTS_CHECK_SECS)
+                except Empty:
+                    yield ':\n\n' # keep-alive (and detect a closed connection)
+                    continue
+                yield 'data: {0}\n\n'.format(json.dumps(status))
+
+    response = Response(_iter_events(), mimetype='text/event-stream', headers={'Cache-Control': 'no-cache'})
+    response.call_on_close(event_streams.release) # even if the stream was never started
+    return response
+
+
 @application.route('/config')
 @application.route('/config/<config_ids>', methods=['GET', 'DELETE'])
 @application.role_required(['admin', 'freq', 'data'])
@@ -155,19 +226,26 @@ def config_endpoint(config_ids=None):
     """ Endpoint for obtaining or deleting config objects by id (or all config objects
         if no config ids specified - only for GET).
     """
-    # turn a config object into a dictionary representation, including any errors
+    # turn a config object into a dictionary representation, including whether there are errors
     def _config_dict(config):
         c_dict = dict((k, v) for k, v in config.__dict__.iteritems() if k[0] != '_')
-        c_dict['errors'] = False
-        for worker in config.values['workers']:
-            if len(list(config.iter_error(worker))) > 0:
-                c_dict['errors'] = True
+        c_dict['errors'] = any(config.error_summary(worker)[0] > 0 for worker in config.values['workers'])
         return c_dict
     try:
         if request.method == 'GET':
             ids = config_ids.split(',') if config_ids is not None else None
-            data = [_config_dict(x) for x in application.data_store.iter_config(config_ids=ids)]
-            return json.dumps({'data': data})
+            configs = list(application.data_store.iter_config(config_ids=ids))
+            versions = [x.version() for x in configs]
+            if None in versions:
+                return json.dumps({'data': [_config_dict(x) for x in configs]})
+
+            # the listing depends only on the config versions, so is not encoded for a 304
+            def _iter_listing():
+                yield json.dumps({'data': [_config_dict(x) for x in configs]})
+
+            response = Response(_iter_listing())
+            response.set_etag(hashlib.sha1('\n'.join(versions)).hexdigest())
+            return response.make_conditional(request)
         else:
             if not application.user_has_role(['admin']):
                 return "Need 'admin' privilege to delete", 400
@@ -190,32 +268,93 @@ def config_endpoint(config_ids=None):
 def data_endpoint(config_id):
     """ Get spectrum, audio and RDS data for the specified config id. A range may be
         specified using 'start' and 'end' query string parameters.
+
+        If 'max_sweeps' is specified, spectrum sweeps are downsampled so that no more than
+        that many are returned, taking the maximum (or the mean, if 'mode' is 'mean') over
+        each group of sweeps combined.
+
+        The response is streamed as it is read from the data store, so its size is not
+        limited by the memory available. For a completed config, it has an ETag, so that
+        a conditional request is answered with 304 if the client has the data already.
+
+        If the request accepts 'application/octet-stream' in preference to JSON, only the
+        spectrum data is returned, in the compact binary format of ConfigBase.iter_binary().
     """
     # convert request argument to int
     def _int_arg(name):
         x = request.args.get(name)
         return None if x is None else int(x)
 
+    mode = request.args.get('mode', 'max')
+    if mode not in ('max', 'mean'):
+        return "Bad parameter", 400
+    try:
+        max_sweeps = _int_arg('max_sweeps')
+    except ValueError:
+        return "Bad parameter", 400
+    if max_sweeps is not None and max_sweeps < 1:
+        return "Bad parameter", 400
+
+    # transform audio data into something more useful for the UI, adding file details
+    def _iter_samples(config, worker, audio):
+        for timestamp, freq_n in audio:
+            sample = {'timestamp': timestamp, 'freq_n': freq_n}
+            path = config.find_audio_path(worker, timestamp, freq_n)
+            if path is not None:
+                sample['filetype'] = (os.path.splitext(path)[1] or '.')[1:]
+                sample['filesize'] = os.path.getsize(path)
+            yield sample
+
     try:
         config = application.data_store.config(config_id).read()
-        data = {}
         #FIXME ok, just take the max... abandon per-worker start/end times and have data store not take a timestamp parameter when storing data (it will always be 'now')
         start = max(_int_arg('start_' + worker) for worker in config.values['workers'])
-        data = config.get_json(start=start, end=_int_arg('end'))
+        end = _int_arg('end')
+    except StoreError as e:
+        return e.message, 500
 
-        # transform audio data into something more useful for the UI, adding file details
+    def _iter_json():
+        data = config.iter_data(start=start, end=end, max_sweeps=max_sweeps, mode=mode)
         for worker in data:
-            samples = []
-            for timestamp, freq_n in data[worker]['audio']:
-                sample = {'timestamp': timestamp, 'freq_n': freq_n}
-                path = config.find_audio_path(worker, timestamp, freq_n)
-                if path is not None:
-                    sample['filetype'] = (os.path.splitext(path)[1] or '.')[1:]
-                    sample['filesize'] = os.path.getsize(path)
-                samples.append(sample)
-            data[worker]['audio'] = samples
-
-        return json.dumps(data)
+            data[worker]['audio'] = _iter_samples(config, worker, data[worker]['audio'])
+        return iter_json(data)
+
+    def _iter_binary():
+        return config.iter_binary(start=start, end=end, max_sweeps=max_sweeps, mode=mode)
+
+    if request.accept_mimetypes.best_match(['application/json', 'application/octet-stream']) == 'application/octet-stream':
+        return _config_response(config, _iter_binary, 'application/octet-stream', {'Vary': 'Accept'})
+    return _config_response(config, _iter_json, 'application/json', {'Vary': 'Accept'})
+
+
+@application.route('/errors/<config_id>')
+@application.role_required(['admin', 'freq', 'data'])
+def errors_endpoint(config_id):
+    """ Get a page of errors for the specified config id. Query string parameters 'worker'
+        (restrict to one of the config's workers), 'offset' (number of errors to skip) and
+        'limit' (maximum number of errors to return) may be specified. The total count and
+        latest error timestamp are included for each worker.
+    """
+    try:
+        offset = int(request.args.get('offset', 0))
+        limit = int(request.args.get('limit', ERRORS_LIMIT))
+    except ValueError:
+        return "Bad parameter", 400
+    if offset < 0 or limit < 0:
+        return "Bad parameter", 400
+    try:
+        config = application.data_store.config(config_id).read()
+        workers = config.values['workers']
+        if 'worker' in request.args:
+            if request.args['worker'] not in workers:
+                return "Bad parameter", 400
+            workers = [request.args['worker']]
+        data = {}
+        for worker in workers:
+            count, latest = config.error_summary(worker)
+            errors = list(config.iter_error(worker, offset=offset, limit=limit))
+            data[worker] = {'count': count, 'latest': latest, 'errors': errors}
+        return json.dumps({'data': data})
     except StoreError as e:
         return e.message, 500
 
@@ -385,18 +524,18 @@ def export_endpoint(config_id):
         raise "No data name specified", 400
 
     # yield export spectrum data
-    def _iter_spectrum_export(scan_config):
+    def _iter_spectrum_export(plan):
         yield '#TimeDate,'
-        yield ','.join([str(freq) for _, freq in scan(scan_config)])
+        yield ','.join(str(f) for f in plan[:].tolist())
         yield '\n'
-        for timestamp, strengths in config.iter_spectrum(key):
+        for timestamp, levels in config.iter_spectrum(key):
             yield str(datetime.fromtimestamp(timestamp / 1000))
             yield ','
-            yield ','.join([str(v) if v > -128 else '' for v in strengths])
+            yield ','.join([str(v) if v > -128 else '' for v in levels])
             yield '\n'
 
     # yield export RDS data
-    def _iter_rds_export(scan_config):
+    def _iter_rds_export(plan):
         def _name():
             for timestamp, freq_n, name in config.iter_rds_name(key):
                 yield timestamp, freq_n, name, ''
@@ -407,7 +546,7 @@ def export_endpoint(config_id):
         for timestamp, freq_n, name, text in heapq.merge(_name(), _text()): # luckily, natural sort order for tuples is what we want
             yield str(datetime.fromtimestamp(timestamp / 1000))
             yield ','
-            yield str(freq(freq_n, scan_config))
+            yield str(plan[freq_n])
             yield ',"'
             yield name.replace('"', r'\"')
             yield '","'
@@ -415,8 +554,8 @@ def export_endpoint(config_id):
             yield '"\n'
 
     ident = config.values['ident']
-    scan_config = parse_config(config.values, key)
-    export = _iter_spectrum_export(scan_config) if name != 'rds' else _iter_rds_export(scan_config)
+    plan = config.scan_plan(key)
+    export = _iter_spectrum_export(plan) if name != 'rds' else _iter_rds_export(plan)
 
     date = datetime.fromtimestamp(config.timestamp / 1000.0)
     date_s = date.strftime("%Y-%m-%d-%H-%M-%S")
@@ -424,9 +563,8 @@ def export_endpoint(config_id):
 
     filename = '{0}_{1}_{2}.csv'.format(key, name, identifier)
     if request.method == 'GET':
-        response = Response(export, mimetype='text/csv')
-        response.headers['Content-Disposition'] = 'attachment; filename={0}'.format(filename)
-        return response
+        headers = {'Content-Disposition': 'attachment; filename={0}'.format(filename)}
+        return _config_response(config, lambda: export, 'text/csv', headers)
     else:
         path = os.path.join(EXPORT_DIRECTORY, filename)
         with open(path, 'w') as f:
@@ -1,6 +1,12 @@
 """ Unit tests for the fs_datastore module.
 """
+import os
+import json
+import shutil
+import numpy
 from spectrum.binary_datastore import BinaryDataStore
+from spectrum.datastore import BINARY_HEADER
+from spectrum.common import iter_json
 
 def test(tmpdir):
     """ Test BinaryDataStore functionality.
@@ -43,11 +49,23 @@ def test(tmpdir):
                                                 (1200, (0, 0, 0)),
                                                 (1300, (10, 10, 12))]
     assert list(c.iter_spectrum('catlib', 1070, 1074)) == []
+    assert list(c.iter_spectrum('catlib', None, 1000)) == []
+    assert list(c.iter_spectrum('catlib', 1300)) == []
+    assert list(c.iter_spectrum('catlib', None, 1080)) == [(1066, (10, 20, -30)),
+                                                 (1080, (1, 2, 3))]
+
+    timestamps, strengths = c.get_spectrum('catlib', 1066, 1300)
+    assert timestamps.tolist() == [1080, 1200, 1300]
+    assert strengths.tolist() == [[1, 2, 3], [0, 0, 0], [10, 10, 12]]
+    timestamps, strengths = c.get_spectrum('catlib', 1300)
+    assert strengths.shape == (0, 3)
+    assert c.get_spectrum('dogsrule')[1].shape == (0, 0)
 
     c.write_audio('catlib', 1066, 4)
     c.write_audio('catlib', 1080, 6)
     assert list(c.iter_audio('catlib')) == [(1066, 4), (1080, 6)]
     assert list(c.iter_audio('catlib', 1050, 1070)) == [(1066, 4)]
+    assert list(c.iter_audio('catlib', 1066)) == [(1080, 6)]
 
     c.write_rds_name('catlib', 1066, 1, 'Radio 7')
     c.write_rds_name('catlib', 1080, 4, 'Bilbo')
@@ -72,3 +90,383 @@ def test(tmpdir):
 
     assert [c.id for c in data.iter_config()] == ['1060', '999']
     assert [c.id for c in data.iter_config(['999'])] == ['999']
+
+
+def test_writer(tmpdir):
+    """ Test buffered writes through Config.writer().
+    """
+    data = BinaryDataStore(str(tmpdir))
+    c = data.config().write(1000, {'workers': ['catlib']})
+
+    with c.writer(flush_size=1024, flush_secs=3600):
+        c.write_spectrum('catlib', 1066, [10, 20, -30])
+        c.write_rds_text('catlib', 1067, 3, 'Tolkien')
+        c.write_rds_text('catlib', 1068, 4, 'Ring')
+        assert list(c.iter_spectrum('catlib')) == []
+        c.flush(force=False)
+        assert list(c.iter_spectrum('catlib')) == []
+        c.flush()
+        assert list(c.iter_spectrum('catlib')) == [(1066, (10, 20, -30))]
+        c.write_spectrum('catlib', 1080, [1, 2, 3])
+        c.write_rds_text('catlib', 1081, 5, 'Hobbit')
+        c.write_error('catlib', 1082, 'Not found')
+    assert list(c.iter_spectrum('catlib')) == [(1066, (10, 20, -30)), (1080, (1, 2, 3))]
+    assert list(c.iter_rds_text('catlib')) == [(1067, 3, 'Tolkien'),
+                                               (1068, 4, 'Ring'),
+                                               (1081, 5, 'Hobbit')]
+    assert list(c.iter_error('catlib')) == [(1082, 'Not found')]
+
+    # writes after the writer is closed go straight through
+    c.write_rds_text('catlib', 1090, 6, 'Gandalf')
+    assert list(c.iter_rds_text('catlib', 1081)) == [(1090, 6, 'Gandalf')]
+
+
+def test_summary(tmpdir):
+    """ Test the summary kept for each worker, and its use by Config.read().
+    """
+    data = BinaryDataStore(str(tmpdir))
+    c = data.config().write(1000, {'workers': ['catlib', 'doglib']})
+    c.write_spectrum('catlib', 1066, [10, 20, -30])
+    with c.writer():
+        c.write_spectrum('catlib', 1080, [1, 2, 3])
+        c.write_rds_name('catlib', 1090, 1, 'Frodo')
+        c.write_error('catlib', 1095, 'Timeout')
+        c.write_temperature('catlib', 1100, '45.0')
+
+    def _check():
+        c = data.config('1000').read()
+        assert c.counts == {'catlib': 2, 'doglib': 0}
+        assert (c.first, c.latest) == (1066, 1090)
+        return c
+
+    _check()
+
+    # a missing summary is rebuilt by readers without storing it (the run may be read-only)
+    path = os.path.join(str(tmpdir), 'data', '1000', 'worker_catlib')
+    os.remove(os.path.join(path, 'summary'))
+    os.chmod(path, 0555)
+    try:
+        c = _check()
+        assert c.error_summary('catlib') == (1, 1095)
+        assert not os.path.exists(os.path.join(path, 'summary'))
+    finally:
+        os.chmod(path, 0755)
+
+    c.write_spectrum('catlib', 1200, [0, 0, 0])
+    assert os.path.exists(os.path.join(path, 'summary'))
+    c = data.config('1000').read()
+    assert c.counts['catlib'] == 3
+    assert c.latest == 1200
+
+    # error counts and paging
+    assert c.error_summary('catlib') == (1, 1095)
+    assert c.error_summary('doglib') == (0, None)
+    for t in xrange(1096, 1110):
+        c.write_error('catlib', t, 'Error {0}'.format(t))
+    assert c.error_summary('catlib') == (15, 1109)
+    assert list(c.iter_error('catlib', offset=13)) == [(1108, 'Error 1108'), (1109, 'Error 1109')]
+    assert list(c.iter_error('catlib', offset=1, limit=2)) == [(1096, 'Error 1096'), (1097, 'Error 1097')]
+    assert list(c.iter_error('catlib', start=1100, limit=1)) == [(1101, 'Error 1101')]
+    assert list(c.iter_error('catlib', end=1096)) == [(1095, 'Timeout'), (1096, 'Error 1096')]
+    assert list(c.iter_error('catlib', offset=20)) == []
+
+
+def test_levels(tmpdir):
+    """ Test downsampled spectrum levels.
+    """
+    data = BinaryDataStore(str(tmpdir), segment_secs=0)
+    c = data.config().write(1000, {'workers': ['catlib']})
+    with c.writer():
+        for t in xrange(40):
+            c.write_spectrum('catlib', 2000 + t, [t, -t, -128 if t % 2 else t])
+
+    timestamps, strengths = c.get_spectrum('catlib', max_sweeps=10)
+    assert timestamps.tolist() == range(2000, 2040, 4)
+    assert strengths.tolist() == [[t + 3, -t, t + 2] for t in xrange(0, 40, 4)]
+    timestamps, strengths = c.get_spectrum('catlib', max_sweeps=10, mode='mean')
+    assert strengths.tolist() == [[t + 2, -t - 2, t + 1] for t in xrange(0, 40, 4)]
+    timestamps, strengths = c.get_spectrum('catlib', max_sweeps=3)
+    assert timestamps.tolist() == [2000, 2016, 2032]
+    assert strengths.tolist() == [[15, 0, 14], [31, -16, 30], [39, -32, 38]]
+    assert len(c.get_spectrum('catlib', 2035, max_sweeps=10)[0]) == 4
+
+    # levels written before the stored spectrum are rebuilt when writing resumes
+    shutil.rmtree(os.path.join(str(tmpdir), 'data', '1000', 'worker_catlib', 'spectrum', 'max_4'))
+    c = data.config('1000').read()
+    timestamps, strengths = c.get_spectrum('catlib', max_sweeps=10)
+    assert strengths.tolist() == [[t + 3, -t, t + 2] for t in xrange(0, 40, 4)]
+    with c.writer():
+        c.write_spectrum('catlib', 2040, [0, 0, 0])
+    _, timestamps, strengths = c._map_spectrum('catlib', *c._level_files(c.SPECTRUM_TIMES, 'max', 4), start=None, end=None) # pylint: disable=protected-access
+    assert strengths.tolist() == [[t + 3, -t, t + 2] for t in xrange(0, 40, 4)]
+
+    # levels with fewer than max_sweeps are not used
+    assert len(c.get_spectrum('catlib', end=2022, max_sweeps=5)[0]) == 3
+
+    # levels are rebuilt a chunk of sweeps at a time
+    c = data.config().write(1001, {'workers': ['catlib']})
+    with c.writer():
+        for t in xrange(700):
+            c.write_spectrum('catlib', 2000 + t, [t % 100, -t % 50, t % 7])
+    path = os.path.join(str(tmpdir), 'data', '1001', 'worker_catlib', 'spectrum')
+    levels = dict((name, open(os.path.join(path, name, 'data')).read()) for name in os.listdir(path) if '_' in name)
+    for name in levels:
+        shutil.rmtree(os.path.join(path, name))
+    c = data.config('1001').read()
+    c.ITER_SWEEPS = 256
+    map_sweeps, spans = c._map_sweeps, [] # pylint: disable=protected-access
+    def _map_sweeps(worker, times_file, data_file, i0, i1):
+        spans.append(i1 - i0)
+        return map_sweeps(worker, times_file, data_file, i0, i1)
+    c._map_sweeps = _map_sweeps # pylint: disable=protected-access
+    with c.writer():
+        c.write_spectrum('catlib', 2700, [0, 0, 0])
+    assert max(spans) == 256
+    for name in levels:
+        assert open(os.path.join(path, name, 'data')).read() == levels[name]
+
+
+def test_blocks(tmpdir):
+    """ Test the block (delta encoded and compressed) spectrum format.
+    """
+    data = BinaryDataStore(str(tmpdir), spectrum_format='block', block_sweeps=4, segment_secs=0)
+    c = data.config().write(1000, {'workers': ['catlib']})
+    sweeps = [(2000 + t, (t, 127 - t * 20 % 256, -128 if t % 3 else t)) for t in xrange(10)]
+    c.write_spectrum('catlib', *sweeps[0])
+    with c.writer():
+        for sweep in sweeps[1:6]:
+            c.write_spectrum('catlib', *sweep)
+    with c.writer(flush_size=1024, flush_secs=3600):
+        for sweep in sweeps[6:]:
+            c.write_spectrum('catlib', *sweep)
+        assert list(c.iter_spectrum('catlib')) == sweeps[:8]
+    path = os.path.join(str(tmpdir), 'data', '1000', 'worker_catlib', 'spectrum')
+    assert os.path.getsize(os.path.join(path, 'index')) == 4 + 2 * 20
+    assert os.path.getsize(os.path.join(path, 'data')) == 8 + 2 * 3
+
+    assert list(c.iter_spectrum('catlib')) == sweeps
+    assert list(c.iter_spectrum('catlib', 2002, 2008)) == sweeps[3:9]
+    assert list(c.iter_spectrum('catlib', 2007)) == sweeps[8:]
+    assert list(c.iter_spectrum('catlib', 2009)) == []
+    timestamps, strengths = c.get_spectrum('catlib', 2003, 2005)
+    assert timestamps.tolist() == [2004, 2005]
+    assert strengths.tolist() == [list(s) for _, s in sweeps[4:6]]
+    timestamps, strengths = c.get_spectrum('catlib', max_sweeps=3)
+    assert timestamps.tolist() == [2000, 2004, 2008]
+
+    # downsampling uses the stored levels, and reads only sweeps not yet in them (so no
+    # sealed blocks are decoded)
+    with open(os.path.join(path, 'blocks'), 'r+') as f:
+        blocks = f.read()
+        f.seek(0)
+        f.write('x' * len(blocks))
+    timestamps, strengths = c.get_spectrum('catlib', max_sweeps=3)
+    assert timestamps.tolist() == [2000, 2004, 2008]
+    assert strengths.tolist()[2] == [9, -33, 9]
+    with open(os.path.join(path, 'blocks'), 'w') as f:
+        f.write(blocks)
+
+    # resuming counts sweeps flushed when the first sweep written completes a block once only
+    c = data.config().write(1002, {'workers': ['catlib']})
+    with c.writer():
+        for t in xrange(23):
+            c.write_spectrum('catlib', 3000 + t, [t, 0, 0])
+    c = data.config('1002').read()
+    with c.writer():
+        for t in xrange(23, 30):
+            c.write_spectrum('catlib', 3000 + t, [t, 0, 0])
+    assert data.config('1002').read().counts['catlib'] == 30
+
+    # existing spectrum data stays in the format it was written in
+    raw = BinaryDataStore(str(tmpdir), spectrum_format='raw', segment_secs=0).config('1000').read()
+    raw.write_spectrum('catlib', 2010, [1, 2, 3])
+    assert list(raw.iter_spectrum('catlib', 2008)) == sweeps[9:] + [(2010, (1, 2, 3))]
+    c = BinaryDataStore(str(tmpdir), spectrum_format='raw', segment_secs=0).config().write(1001, {'workers': ['catlib']})
+    c.write_spectrum('catlib', 2000, [1, 2, 3])
+    assert not os.path.exists(os.path.join(str(tmpdir), 'data', '1001', 'worker_catlib', 'spectrum', 'index'))
+    assert list(c.iter_spectrum('catlib')) == [(2000, (1, 2, 3))]
+
+
+def test_segments(tmpdir):
+    """ Test streams split into time segments.
+    """
+    data = BinaryDataStore(str(tmpdir), spectrum_format='block', block_sweeps=2, segment_secs=1)
+    c = data.config().write(1000, {'workers': ['catlib']})
+    sweeps = [(1000 + 300 * t, (t, -t, 2 * t)) for t in xrange(12)]
+    c.write_spectrum('catlib', *sweeps[0])
+    with c.writer():
+        for sweep in sweeps[1:8]:
+            c.write_spectrum('catlib', *sweep)
+            c.write_error('catlib', sweep[0] + 1, 'Error {0}'.format(sweep[0]))
+    with c.writer():
+        for sweep in sweeps[8:]:
+            c.write_spectrum('catlib', *sweep)
+
+    path = os.path.join(str(tmpdir), 'data', '1000', 'worker_catlib', 'spectrum')
+    assert sorted(os.listdir(path)) == ['1000', '2000', '3000', '4000', 'segments']
+    assert [f for f, _ in c._iter_segments('catlib', c.SPECTRUM_TIMES, c.SPECTRUM_DATA, 2100, 3000)] == [ # pylint: disable=protected-access
+        'spectrum/2000/timestamps', 'spectrum/3000/timestamps']
+    # sealed segments have all sweeps in blocks, and all level groups written
+    assert os.path.getsize(os.path.join(path, '2000', 'data')) == 8
+    assert os.path.getsize(os.path.join(path, '2000', 'max_4', 'timestamps')) == 4 + 8
+
+    assert list(c.iter_spectrum('catlib')) == sweeps
+    assert list(c.iter_spectrum('catlib', 1900, 3400)) == sweeps[4:9]
+    assert list(c.iter_spectrum('catlib', 4300)) == []
+
+    # binary data is read a segment and chunk at a time
+    c.ITER_SWEEPS = 2
+    for start, end in ((None, None), (1900, 3400)):
+        timestamps, strengths = c.get_spectrum('catlib', start, end)
+        expected = BINARY_HEADER.pack(6, len(timestamps), 3) + 'catlib' + timestamps.astype('<u8').tostring() + strengths.tostring()
+        assert ''.join(c.iter_binary(start, end, chunk_size=3)) == expected
+    timestamps, strengths = c.get_spectrum('catlib', 1000, 2800)
+    assert timestamps.tolist() == [1300, 1600, 1900, 2200, 2500, 2800]
+    assert strengths.tolist() == [list(s) for _, s in sweeps[1:7]]
+    timestamps, strengths = c.get_spectrum('catlib', max_sweeps=3)
+    assert timestamps.tolist() == [1000, 3100]
+    assert strengths.tolist() == [[6, 0, 12], [11, -7, 22]]
+    # levels with fewer than max_sweeps are not used (each segment has one group per level)
+    timestamps, strengths = c.get_spectrum('catlib', max_sweeps=6)
+    assert timestamps.tolist() == range(1000, 4001, 600)
+    assert strengths.tolist() == [[t + 1, -t, 2 * t + 2] for t in xrange(0, 12, 2)]
+
+    assert list(c.iter_error('catlib', offset=2, limit=3)) == [(1901, 'Error 1900'), (2201, 'Error 2200'),
+                                                              (2501, 'Error 2500')]
+    assert list(c.iter_error('catlib', start=2000, offset=2)) == [(2801, 'Error 2800'), (3101, 'Error 3100')]
+
+    os.remove(os.path.join(str(tmpdir), 'data', '1000', 'worker_catlib', 'summary'))
+    c = data.config('1000').read()
+    assert c.counts == {'catlib': 12}
+    assert (c.first, c.latest) == (1000, 4300)
+    assert c.error_summary('catlib') == (7, 3101)
+
+
+def test_freq_index(tmpdir):
+    """ Test RDS name and text queries by time range and freq_n.
+    """
+    data = BinaryDataStore(str(tmpdir), segment_secs=1)
+    c = data.config().write(1000, {'workers': ['catlib']})
+    texts = [(1000 + 100 * t, t % 3, 'Text {0}'.format(t)) for t in xrange(30)]
+    with c.writer():
+        for text in texts:
+            c.write_rds_text('catlib', *text)
+    c.write_rds_name('catlib', 1050, 1, 'Radio 1')
+
+    def _check():
+        assert list(c.iter_rds_text('catlib', 1500, 2200)) == texts[6:13]
+        assert list(c.iter_rds_text('catlib', freq_n=1)) == texts[1::3]
+        assert list(c.iter_rds_text('catlib', 1500, 2200, freq_n=2)) == [texts[8], texts[11]]
+        assert list(c._iter_freq_data('catlib', c.RDS_TEXT_TIMES, c.RDS_TEXT_DATA, 1500, offset=3, limit=2, # pylint: disable=protected-access
+                                      freq_n=0)) == [texts[15], texts[18]]
+        assert list(c.iter_rds_text('catlib', freq_n=3)) == []
+        assert list(c.iter_rds_name('catlib', freq_n=1)) == [(1050, 1, 'Radio 1')]
+
+    _check()
+
+    # streams written without posting lists are scanned
+    path = os.path.join(str(tmpdir), 'data', '1000', 'worker_catlib', 'rds', 'text')
+    for segment in ('1000', '2000', '3000'):
+        shutil.rmtree(os.path.join(path, segment, 'freqs'))
+    _check()
+
+
+def test_json(tmpdir):
+    """ Test streaming JSON encoding of config data.
+    """
+    data = BinaryDataStore(str(tmpdir))
+    c = data.config().write(1000, {'workers': ['catlib', 'doglib']})
+    c.ITER_SWEEPS = 4
+    for t in xrange(10):
+        c.write_spectrum('catlib', 2000 + t, [t, -t, 0])
+    c.write_rds_name('catlib', 2003, 1, 'Radio "1"')
+    c.write_error('doglib', 2005, 'Timeout')
+
+    for kwargs in ({}, {'start': 2003, 'end': 2008}, {'max_sweeps': 3, 'mode': 'mean'}):
+        expected = c.get_json(**kwargs)
+        assert json.loads(''.join(iter_json(c.iter_data(**kwargs), chunk_size=16, batch=3))) == json.loads(json.dumps(expected))
+    assert c.get_json(2003, 2005)['catlib']['spectrum'] == [(2004, (4, -4, 0)), (2005, (5, -5, 0))]
+    assert c.get_json()['doglib']['errors'] == [(2005, 'Timeout')]
+
+
+def test_binary(tmpdir):
+    """ Test binary encoding of spectrum data.
+    """
+    data = BinaryDataStore(str(tmpdir))
+    c = data.config().write(1000, {'workers': ['catlib', 'doglib']})
+    for t in xrange(10):
+        c.write_spectrum('catlib', 2000 + t, [t, -t, 0])
+
+    raw = ''.join(c.iter_binary(start=2003, chunk_size=4))
+    n_name, n_sweeps, n_freq = BINARY_HEADER.unpack_from(raw)
+    assert (n_name, n_sweeps, n_freq) == (6, 6, 3)
+    i = BINARY_HEADER.size
+    assert raw[i:i + n_name] == 'catlib'
+    i += n_name
+    assert numpy.frombuffer(raw[i:i + 8 * n_sweeps], dtype='<u8').tolist() == range(2004, 2010)
+    i += 8 * n_sweeps
+    strengths = numpy.frombuffer(raw[i:i + n_sweeps * n_freq], dtype=numpy.int8).reshape(n_sweeps, n_freq)
+    assert strengths.tolist() == [[t, -t, 0] for t in xrange(4, 10)]
+    i += n_sweeps * n_freq
+    assert raw[i:] == BINARY_HEADER.pack(6, 0, 0) + 'doglib'
+
+    # sweeps with timestamps but no data yet are not counted
+    _, data_file, _, _ = c._find_segments('catlib', None, None)[-1] # pylint: disable=protected-access
+    with open(os.path.join(str(tmpdir), 'data', '1000', 'worker_catlib', data_file), 'r+') as f:
+        f.truncate(os.path.getsize(f.name) - 1)
+    raw = ''.join(c.iter_binary(start=2003))
+    assert BINARY_HEADER.unpack_from(raw)[1] == 5
+    assert len(raw) == BINARY_HEADER.size + 6 + 5 * (8 + 3) + BINARY_HEADER.size + 6
+
+
+def test_version(tmpdir):
+    """ Test the config version changes with the stored data.
+    """
+    data = BinaryDataStore(str(tmpdir))
+    c = data.config().write(1000, {'workers': ['catlib']})
+    versions = [data.config(c.id).read().version()]
+    c.write_spectrum('catlib', 2000, [1, 2, 3])
+    versions.append(data.config(c.id).read().version())
+    assert versions[1] == data.config(c.id).read().version()
+    c.write_error('catlib', 2001, 'Timeout')
+    versions.append(data.config(c.id).read().version())
+    os.makedirs(os.path.join(data.samples_path, c.id))
+    versions.append(data.config(c.id).read().version())
+    assert len(set(versions)) == 4
+
+
+def test_config_cache(tmpdir):
+    """ Test configs read are cached until their files change.
+    """
+    data = BinaryDataStore(str(tmpdir))
+    c = data.config().write(1000, {'workers': ['catlib'], 'description': '', 'ident': {'name': '007'},
+                                   'catlib': {'freqs': [{'freq': '100', 'exp': 6, 'enabled': True}]}})
+    c1 = data.config(c.id).read()
+    c2 = data.config(c.id).read()
+    assert c2.values is c1.values
+    assert c2.scan_plan('catlib') is c1.scan_plan('catlib')
+    # the shared values are not converted by parsing the scan plan
+    assert data.config(c.id).read().values['ident'] == {'name': '007'}
+    assert c1.values['description'] == '' and c1.values['catlib']['freqs'][0]['freq'] == '100'
+    assert c2.counts == {'catlib': 0}
+
+    with c.writer():
+        c.write_spectrum('catlib', 2000, [1])
+    c3 = data.config(c.id).read()
+    assert c3.values is c1.values
+    assert (c3.counts, c3.first, c3.latest) == ({'catlib': 1}, 2000, 2000)
+
+    c.write(1000, {'workers': ['catlib'], 'catlib': {'freqs': [{'freq': 101, 'exp': 6, 'enabled': True}]}})
+    c4 = data.config(c.id).read()
+    assert c4.values is not c1.values
+    assert list(c4.scan_plan('catlib')) == [(0, 101000000)]
+
+    # a summary overwritten in place, within the file system's timestamp granularity
+    path = os.path.join(str(tmpdir), 'data', c.id, 'worker_catlib', 'summary')
+    os.utime(path, (1, 1))
+    data.config(c.id).read()
+    with c.writer():
+        c.write_spectrum('catlib', 2001, [1])
+    os.utime(path, (1, 1))
+    c5 = data.config(c.id).read()
+    assert (c5.counts, c5.latest) == ({'catlib': 2}, 2001)
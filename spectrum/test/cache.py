@@ -0,0 +1,34 @@
+""" Unit tests for the cache module.
+"""
+from spectrum.cache import LRUCache
+
+def test_lru():
+    """ Test values are discarded least recently used first.
+    """
+    cache = LRUCache(3)
+    for key in 'abc':
+        cache.put(key, key.upper())
+    assert cache.get('a') == 'A'
+    cache.put('d', 'D')
+    assert cache.get('b') is None
+    assert [cache.get(key) for key in 'acd'] == ['A', 'C', 'D']
+    cache.pop('c')
+    assert len(cache) == 2 and cache.get('c', 'X') == 'X'
+
+def test_size():
+    """ Test values are discarded by total size, and streamed values stored once consumed.
+    """
+    cache = LRUCache(10, len)
+    cache.put('a', 'aaaa')
+    cache.put('b', 'bbbb')
+    cache.put('c', 'cccc')
+    assert cache.get('a') is None and cache.size == 8
+    cache.put('d', 'd' * 11)
+    assert cache.get('d') is None and cache.size == 8
+
+    chunks = cache.iter_put('e', iter(['ee', 'eee']))
+    assert next(chunks) == 'ee' and cache.get('e') is None
+    assert list(chunks) == ['eee']
+    assert cache.get('e') == 'eeeee' and cache.get('b') is None
+    assert list(cache.iter_put('f', ['ff', 'fff'], 4)) == ['ff', 'fff']
+    assert cache.get('f') is None
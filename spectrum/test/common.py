@@ -0,0 +1,41 @@
+from spectrum.common import parse_config, scan, freq, ScanPlan
+
+
+def _values():
+    return {'hamlib': {'freqs': [
+        {'range': [88, 108, 0.5], 'exp': 6, 'enabled': True},
+        {'freq': 70.1, 'exp': 6, 'enabled': True},
+        {'range': [1, 2, 1], 'exp': 3, 'enabled': False},
+        {'freq': 100, 'exp': 6, 'enabled': True}
+    ]}}
+
+
+def test_scan_plan():
+    scan_config = parse_config(_values(), 'hamlib')
+    plan = ScanPlan.get(scan_config)
+    assert ScanPlan.get(parse_config(_values(), 'hamlib')) is plan
+
+    expected = range(88000000, 108000001, 500000) + [70100000, 100000000]
+    assert len(plan) == len(expected)
+    assert list(plan) == list(enumerate(expected))
+    assert list(scan(scan_config)) == list(enumerate(expected))
+    assert plan[0] == 88000000 and isinstance(plan[0], int)
+    assert plan[-1] == 100000000
+    assert freq(41, scan_config) == 70100000
+    assert plan[1:3].tolist() == [88500000, 89000000]
+
+    assert plan.index(88000000) == 0
+    assert plan.index(70100000) == 41
+    assert plan.index(100000000) == 24 # first occurrence
+    for f in (0, 88000001, 200000000):
+        try:
+            plan.index(f)
+            assert False
+        except ValueError:
+            pass
+
+
+def test_empty_plan():
+    plan = ScanPlan([])
+    assert len(plan) == 0
+    assert list(plan) == []
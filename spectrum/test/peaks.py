@@ -0,0 +1,83 @@
+import numpy
+from spectrum.peaks import find_peaks, sweep_peaks, peak_status, MISSING
+from spectrum.config import PEAKS_LIMIT
+
+
+def _prominence(s, p):
+    """ Straightforward prominence of the peak at p (for comparison).
+    """
+    bases = []
+    for side in (s[p - 1::-1] if p > 0 else [], s[p + 1:]):
+        if len(side) == 0:
+            continue
+        base = s[p]
+        for v in side:
+            if v > s[p]:
+                break
+            base = min(base, v)
+        bases.append(base)
+    return s[p] - max(bases) if len(bases) > 0 else numpy.inf
+
+
+def test_peaks():
+    s = [-60, -40, -50, -50, -20, -20, -70, -30, -31, -128, -128, -10]
+    assert find_peaks(s, prominence=None, separation=None).tolist() == [1, 4, 7, 11]
+    assert find_peaks(s, threshold=-30, prominence=None, separation=None).tolist() == [4, 7, 11]
+    # the MISSING samples are skipped, so 7 is only 1 above its right base (-31)
+    assert find_peaks(s, prominence=15, separation=None).tolist() == [4, 11]
+    assert find_peaks(s, prominence=1, separation=None).tolist() == [1, 4, 7, 11]
+    assert find_peaks(s, prominence=None, separation=4).tolist() == [4, 11]
+    assert find_peaks(s, prominence=None, separation=None, limit=2).tolist() == [4, 11]
+    assert find_peaks(s, prominence=None, separation=None, floor=15).tolist() == [4, 11]
+    assert find_peaks([], prominence=5).tolist() == []
+    assert find_peaks([-128] * 5, prominence=None).tolist() == []
+    assert peak_status(s, find_peaks(s, threshold=-20)) == [{'freq_n': 4, 'strength': -20},
+                                                            {'freq_n': 11, 'strength': -10}]
+
+
+def test_prominence():
+    numpy.random.seed(0)
+    for _ in xrange(50):
+        s = numpy.random.randint(-80, 0, 100)
+        peaks = find_peaks(s, prominence=None, separation=None)
+        for prominence in (1, 5, 20):
+            expected = [p for p in peaks if _prominence(s, p) >= prominence]
+            assert find_peaks(s, prominence=prominence, separation=None).tolist() == expected
+
+
+def test_separation():
+    numpy.random.seed(1)
+    for _ in xrange(50):
+        s = numpy.random.randint(-80, 0, 100)
+        peaks = find_peaks(s, prominence=None, separation=5)
+        assert numpy.all(numpy.diff(peaks) >= 5)
+        # every dropped peak is near a higher (or equal) one kept
+        for p in find_peaks(s, prominence=None, separation=None):
+            near = peaks[abs(peaks - p) < 5]
+            assert p in peaks or numpy.any(s[near] >= s[p])
+
+
+def _local_maxima(s, threshold):
+    """ Peaks as chosen for audio recording before peak detection was shared (for comparison).
+    """
+    return [i for i in xrange(len(s)) if (i == 0 or s[i - 1] < s[i]) and s[i] >= threshold and
+            (i + 1 == len(s) or s[i] >= s[i + 1])]
+
+
+def test_sweep_peaks():
+    numpy.random.seed(2)
+    s = numpy.random.randint(-80, -70, 200)
+    carriers = numpy.arange(5, 200, 20)[:PEAKS_LIMIT]
+    s[carriers] = -30 + 2 * numpy.random.permutation(len(carriers))
+    # clear carriers are chosen for recording as they were
+    assert sweep_peaks(s, -40).tolist() == _local_maxima(s, -40) == carriers.tolist()
+
+    # but not a second peak next to one, or a sample beyond unmeasured channels lower than
+    # the one before them, and only the highest PEAKS_LIMIT
+    s[carriers[0] + 2] = s[carriers[0]] - 1
+    s[carriers[1] + 1:carriers[1] + 3] = MISSING
+    s[carriers[1] + 3] = s[carriers[1]] - 5
+    s[carriers[2] + 10] = -5
+    expected = carriers.tolist() + [carriers[2] + 10]
+    expected.remove(min(expected, key=lambda i: s[i]))
+    assert sweep_peaks(s, -40).tolist() == sorted(expected)
@@ -2,14 +2,19 @@
 """
 import multiprocessing
 import os
+import sys
+import threading
 import time
-from spectrum.process import Process
+import pytest
+from spectrum.process import Process, StatusWatcher, StatusRegion, ProcessError
 from spectrum.datastore import ConfigBase
 
 
 class MockConfig(ConfigBase):
     """ Minimal mock Config implementation.
     """
+    counts = {}
+
     def read(self):
         """ Does nothing.
         """
@@ -77,3 +82,249 @@ def test(tmpdir):
 
     assert counter.value == 10
     assert config_id.value == CONFIG_ID
+
+
+def test_watcher(tmpdir):
+    """ Test status changes are notified to subscribers.
+    """
+    client = PytestProcess(tmpdir, None).client()
+    watcher = StatusWatcher([client], watch_secs=0.05, check_secs=60)
+    with watcher.subscribe() as queue:
+        status = queue.get(timeout=1)
+        assert status.keys() == [client.prefix] and 'error' in status[client.prefix]
+
+        with open(client.process.config_file, 'w') as f:
+            f.write('1234')
+        with open(client.process.status_file, 'w') as f:
+            f.write('{"sweep": 1}')
+        changes = queue.get(timeout=1)
+        assert changes['config_id'] == '1234' and changes[client.prefix]['sweep'] == 1
+        assert queue.empty()
+
+        os.remove(client.process.config_file)
+        assert queue.get(timeout=1) == {'config_id': None}
+    time.sleep(0.2)
+    assert watcher._thread is None # pylint: disable=protected-access
+
+
+def test_watcher_errors(tmpdir, monkeypatch):
+    """ Test the watcher thread survives errors reading a status, and a status region
+        removed while it is being mapped.
+    """
+    client = PytestProcess(tmpdir, None).client()
+    watcher = StatusWatcher([client], watch_secs=0.05, check_secs=60)
+    status = client.status
+    errors = [IOError("Vanished")]
+    def _status():
+        if len(errors) > 0:
+            raise errors.pop()
+        return status()
+    with watcher.subscribe() as queue:
+        queue.get(timeout=1)
+        monkeypatch.setattr(client, 'status', _status)
+        with open(client.process.config_file, 'w') as f:
+            f.write('1234')
+        time.sleep(0.2)
+        assert len(errors) == 0
+        with open(client.process.status_file, 'w') as f:
+            f.write('{"sweep": 1}')
+        assert queue.get(timeout=1)[client.prefix]['sweep'] == 1
+    time.sleep(0.2)
+    assert watcher._thread is None # pylint: disable=protected-access
+
+    path = str(tmpdir.join('region'))
+    StatusRegion(path, size=64).write('{"a": 1}', 1000)
+    reader = StatusRegion(path)
+    stat = os.stat
+    def _stat(stat_path):
+        result = stat(stat_path)
+        if stat_path == path:
+            os.remove(path)
+        return result
+    monkeypatch.setattr(os, 'stat', _stat)
+    assert reader.read() is None
+
+
+def test_region(tmpdir):
+    """ Test writing and reading status through a status region.
+    """
+    path = str(tmpdir.join('region'))
+    writer, reader = StatusRegion(path, size=64), StatusRegion(path)
+    assert reader.read() is None and reader.seq() is None
+    writer.write('{"a": 1}', 1000)
+    assert reader.read() == (2, 1000, '{"a": 1}')
+    writer.write('{"b": "' + 'x' * 100 + '"}', 2000) # grows the region
+    assert reader.read()[1:] == (2000, '{"b": "' + 'x' * 100 + '"}')
+    writer.close()
+    writer.write('', 3000) # continues the sequence
+    assert reader.read() == (6, 3000, '')
+    writer.remove()
+    assert reader.read() is None
+
+    process = PytestProcess(tmpdir, None)
+    process.status = {'sweep': 3}
+    process._write_status() # pylint: disable=protected-access
+    client = process.client()
+    version = client.status_version()
+    status = client.status()
+    assert status['sweep'] == 3 and status['timestamp'] > 0
+    process._clear_status() # pylint: disable=protected-access
+    assert client.status_version() != version
+    assert client.status().keys() == ['error']
+
+
+def test_publish(tmpdir):
+    """ Test status changes are coalesced unless significant.
+    """
+    process = PytestProcess(tmpdir, None)
+    process.publish_ms = 60000
+    client = process.client()
+    for significant in (False, False, True, False):
+        process.status['n'] = process.status.get('n', 0) + 1
+        process._publish_status(significant) # pylint: disable=protected-access
+    assert client.status()['n'] == 3
+    assert process.status_counts == {'published': 2, 'coalesced': 2}
+
+
+class ControlProcess(PytestProcess):
+    """ Test process implementation that counts sweeps in its status.
+    """
+    def iterator(self, config, _):
+        self.status['config_id'] = config.id
+        self.status['n'] = 0
+        while True:
+            self.status['n'] += 1
+            time.sleep(0.01)
+            yield True
+
+def test_shared_client(tmpdir):
+    """ Test a client can be used by several threads while its status region is grown and
+        replaced.
+    """
+    process = PytestProcess(tmpdir, None)
+    process.status = {'sweep': 0}
+    process._write_status() # pylint: disable=protected-access
+    client = process.client()
+    errors = []
+    def _read():
+        try:
+            for _ in xrange(5000):
+                client.status()
+                client.status_version()
+        except Exception as e: # pylint: disable=broad-except
+            errors.append(e)
+    threads = [threading.Thread(target=_read) for _ in xrange(4)]
+    interval = sys.getcheckinterval()
+    sys.setcheckinterval(1) # switch threads as often as possible
+    try:
+        for thread in threads:
+            thread.start()
+        i = 0
+        while any(thread.is_alive() for thread in threads):
+            process.status = {'sweep': i, 'peaks': 'x' * (i % 300) * 100}
+            process._write_status() # pylint: disable=protected-access
+            if i % 50 == 49:
+                process.status_region.remove()
+            i += 1
+    finally:
+        sys.setcheckinterval(interval)
+    assert errors == []
+
+
+def control_fn(tmpdir):
+    """ We run this in a child process.
+    """
+    process = ControlProcess(tmpdir, MockDataStore(None, None))
+    process.init(None)
+    process.start()
+
+
+def test_control(tmpdir):
+    """ Test controlling a process through its control socket.
+    """
+    child = multiprocessing.Process(target=control_fn, args=(tmpdir,))
+    child.start()
+    client = ControlProcess(tmpdir, None).client()
+    try:
+        for _ in xrange(100):
+            if client.ping():
+                break
+            time.sleep(0.01)
+        assert client.ping()
+
+        assert client.start('my id') is True
+        time.sleep(0.1)
+        status = client.status()
+        assert status['config_id'] == 'my id' and status['n'] > 1
+        with pytest.raises(ProcessError):
+            client.start('other id')
+
+        assert client.stop() is True
+        assert client.config_id() is None
+        assert 'n' not in client.status()
+        assert client.start('another id') is True
+        time.sleep(0.1)
+        assert client.status()['config_id'] == 'another id'
+    finally:
+        child.terminate()
+        child.join()
+    assert not client.ping()
+    assert not os.path.exists(client.process.control_file)
+
+
+def test_liveness(tmpdir):
+    """ Test process liveness is checked without pid_kill, and cached by clients.
+    """
+    process = PytestProcess(tmpdir, None)
+    client = process.client()
+    assert client.read_pid() is None and client.error == "No pytestprocess process"
+
+    with open(process.pid_file, 'w') as f:
+        f.write(str(os.getpid()))
+    assert client.read_pid() is None # cached
+    assert client.read_pid(0) == os.getpid() and client.error is None
+
+    child = multiprocessing.Process(target=time.sleep, args=(0,))
+    child.start()
+    child.join()
+    with open(process.pid_file, 'w') as f:
+        f.write(str(child.pid))
+    assert client.read_pid() == os.getpid() # cached
+    assert client.read_pid(0) is None and client.error == "Bad PID ({0}): ESRCH".format(child.pid)
+
+
+def test_caps(tmpdir):
+    """ Test caps written are cached by clients until the caps file changes.
+    """
+    process = PytestProcess(tmpdir, None)
+    client = process.client()
+    assert client.get_capabilities() is None
+
+    process.write_caps()
+    caps = client.get_capabilities()
+    assert caps == {}
+    assert client.get_capabilities() is caps
+
+    process.get_capabilities = lambda: {'modes': [1, 2]}
+    process.write_caps()
+    assert client.get_capabilities() == {'modes': [1, 2]}
+
+
+def test_torn_status(tmpdir, monkeypatch):
+    """ Test a torn status read from a status region is read again, or if it cannot be
+        read, the last good status is used.
+    """
+    process = PytestProcess(tmpdir, None)
+    process.status = {'sweep': 3}
+    process._write_status() # pylint: disable=protected-access
+    client = process.client()
+    region = client._region # pylint: disable=protected-access
+    read = region.read
+    torn = [(2, 1000, '{"sweep": 3, "peaks": [{"fr')]
+    monkeypatch.setattr(region, 'read', lambda: torn.pop() if len(torn) > 0 else read())
+    assert client.status()['sweep'] == 3
+    assert len(torn) == 0
+
+    monkeypatch.setattr(region, 'read', lambda: (4, 2000, '{"swe'))
+    status = client.status()
+    assert status['sweep'] == 3 and status['timestamp'] > 0
@@ -0,0 +1,63 @@
+from time import sleep, time
+from spectrum.rig_reader import RigReader
+
+
+def test_reader():
+    reader = RigReader(lambda freq: freq // 10)
+    reader.start()
+    try:
+        for _ in xrange(2):
+            results = list(reader.sweep([(0, 100), (2, 120), (3, 130)]))
+            assert [(idx, freq, strength) for idx, freq, strength, _ in results] == [(0, 100, 10), (2, 120, 12), (3, 130, 13)]
+        assert list(reader.sweep([])) == []
+    finally:
+        reader.close()
+    assert not reader.is_alive()
+
+
+def test_error():
+    def _read(freq):
+        if freq == 120:
+            raise ValueError("Bad frequency")
+        return 0
+    reader = RigReader(_read)
+    reader.start()
+    try:
+        results = reader.sweep([(0, 100), (1, 120), (2, 130)])
+        assert next(results)[0] == 0
+        try:
+            next(results)
+            assert False
+        except ValueError:
+            pass
+        # the reader continues with the next sweep
+        assert len(list(reader.sweep([(0, 100)]))) == 1
+    finally:
+        reader.close()
+
+
+def test_pipeline():
+    def _read(_):
+        sleep(0.005)
+        return 0
+    reader = RigReader(_read)
+    reader.start()
+    try:
+        time_0 = time()
+        for _ in reader.sweep([(i, i) for i in xrange(20)]):
+            sleep(0.005) # bookkeeping overlaps with the next read
+        assert time() - time_0 < 20 * 0.01 * 0.75
+        assert reader.rig_secs >= 20 * 0.005
+    finally:
+        reader.close()
+
+
+def test_close():
+    reader = RigReader(lambda _: sleep(0.01))
+    reader.start()
+    results = reader.sweep([(i, i) for i in xrange(100)])
+    next(results)
+    time_0 = time()
+    reader.close()
+    assert time() - time_0 < 0.1
+    assert not reader.is_alive()
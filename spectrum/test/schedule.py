@@ -0,0 +1,54 @@
+import numpy
+from spectrum.schedule import AdaptiveSchedule
+
+
+def _sweep(schedule, levels):
+    due = schedule.due()
+    strengths = numpy.where(due, levels, -128)
+    return due, schedule.update(due, strengths)
+
+
+def test_schedule():
+    n = 100
+    levels = numpy.full(n, -80)
+    levels[50] = -20
+    schedule = AdaptiveSchedule(n, quiet_sweeps=2, max_interval=4, threshold=-30)
+
+    counts = numpy.zeros(n, dtype=int)
+    last = numpy.zeros(n, dtype=int)
+    for sweep_n in xrange(20):
+        due, (latest, peaks) = _sweep(schedule, levels)
+        if sweep_n == 0:
+            assert due.all()
+        # quiet channels are never left longer than max_interval sweeps
+        assert (sweep_n - last[due]).max() <= 4
+        last[due] = sweep_n
+        counts += due
+        assert latest.tolist() == levels.tolist()
+        assert peaks.tolist() == [50]
+    # the active channel (and its neighbours) are measured every sweep, others less often
+    assert counts[49:52].tolist() == [20, 20, 20]
+    assert counts[:40].max() <= 2 + 2 + 4
+    assert (20 - last[:40]).max() <= 4
+
+    # a channel becoming active is measured every sweep once it has been seen
+    levels[10] = -10
+    seen = None
+    for sweep_n in xrange(8):
+        due, (latest, peaks) = _sweep(schedule, levels)
+        if seen is not None:
+            assert due[10]
+        elif due[10]:
+            seen = sweep_n
+    assert seen is not None and seen < 4
+
+
+def test_long_run():
+    # quiet channels stay at max_interval however long the run
+    levels = numpy.full(200, -80)
+    schedule = AdaptiveSchedule(200, quiet_sweeps=4, max_interval=8, threshold=-30)
+    with numpy.errstate(all='raise'):
+        for sweep_n in xrange(3000):
+            due, _ = _sweep(schedule, levels)
+            if sweep_n >= 100:
+                assert due.sum() == 25
@@ -0,0 +1,33 @@
+""" Unit tests for the secure module.
+"""
+import zlib
+from flask import Response
+from spectrum.secure import SecureStaticFlask
+from spectrum.config import COMPRESS_MIN_SIZE
+
+def test_compress():
+    """ Test responses are compressed as negotiated, whether streamed or not.
+    """
+    app = SecureStaticFlask(__name__, 'static')
+    data = 'x' * COMPRESS_MIN_SIZE
+
+    with app.test_request_context('/', headers={'Accept-Encoding': 'gzip, deflate'}):
+        rsp = app.compress_response(Response(data, mimetype='application/json'))
+        assert rsp.headers['Content-Encoding'] == 'gzip'
+        assert zlib.decompress(rsp.get_data(), 16 + zlib.MAX_WBITS) == data
+        rsp = app.compress_response(Response('x', mimetype='application/json'))
+        assert 'Content-Encoding' not in rsp.headers
+        rsp = app.compress_response(Response(data, mimetype='audio/mpeg'))
+        assert 'Content-Encoding' not in rsp.headers
+
+    with app.test_request_context('/', headers={'Accept-Encoding': 'deflate'}):
+        rsp = Response((c for c in ['a', 'b' * 100]), mimetype='text/csv')
+        rsp.set_etag('1234')
+        rsp = app.compress_response(rsp)
+        assert rsp.headers['Content-Encoding'] == 'deflate'
+        assert rsp.get_etag() == ('1234', True)
+        assert zlib.decompress(''.join(rsp.response)) == 'a' + 'b' * 100
+
+    with app.test_request_context('/'):
+        rsp = app.compress_response(Response(data, mimetype='application/json'))
+        assert 'Content-Encoding' not in rsp.headers
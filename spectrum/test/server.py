@@ -4,8 +4,11 @@ import time
 import httplib
 import json
 import os
+from threading import BoundedSemaphore
 import pytest
 from spectrum.datastore import ConfigBase, Settings
+from spectrum.binary_datastore import BinaryDataStore
+from spectrum.cache import LRUCache
 from spectrum.users import IncorrectPasswordError, InvalidUsername
 import spectrum.server as server
 
@@ -73,9 +76,17 @@ class MockUsers(object):
 class MockClient(object): # pylint: disable=too-few-public-methods
     """ Minimal mock WorkerClient and MonkeyClient.
     """
+    def __init__(self, config_id=None):
+        self._config_id = config_id
+
     def get_capabilities(self):
         return {'models': []}
 
+    def config_id(self):
+        """ Return the config id the mock worker is running.
+        """
+        return self._config_id
+
 class MockQueue(object):
     """ In-memory queue implementation.
     """
@@ -106,6 +117,22 @@ def api(tmpdir):
     return server.application.test_client()
 
 
+@pytest.fixture()
+def data_api(tmpdir, monkeypatch):
+    """ Pytest fixture returning a test web API, using a binary data store, with LOGIN
+        logged in.
+    """
+    version_file = os.path.join(str(tmpdir), 'version')
+    with open(version_file, 'w') as f:
+        f.write(TEST_VERSION)
+    monkeypatch.setattr('spectrum.webapp.VERSION_FILE', version_file)
+
+    server.application.initialise(BinaryDataStore(str(tmpdir)), MockUsers(), [], MockQueue())
+    client = server.application.test_client()
+    client.post('/login', data=LOGIN)
+    return client
+
+
 def test_favicon(api):
     """ Test favicon endpoint.
     """
@@ -155,3 +182,60 @@ def test_login(api):
     rv = api.post('/login', data=LOGIN, follow_redirects=True)
     assert rv.status_code == httplib.OK
     assert '<title>' in rv.data
+
+def test_errors(data_api):
+    """ Test paging through errors, and the checks on the parameters.
+    """
+    c = server.application.data_store.config().write(1000, {'workers': ['catlib']})
+    for n in xrange(5):
+        c.write_error('catlib', 2000 + n, 'error {0}'.format(n))
+
+    rv = data_api.get('/errors/{0}?offset=1&limit=2'.format(c.id))
+    assert rv.status_code == httplib.OK
+    data = json.loads(rv.data)['data']
+    assert data['catlib']['count'] == 5
+    assert data['catlib']['errors'] == [[2001, 'error 1'], [2002, 'error 2']]
+
+    for query in ('offset=-5', 'limit=-1', 'offset=x', 'worker=catlib/../../..', 'worker=doglib'):
+        rv = data_api.get('/errors/{0}?{1}'.format(c.id, query))
+        assert rv.status_code == httplib.BAD_REQUEST
+
+def test_etags(data_api, monkeypatch):
+    """ Test that only completed configs have ETags, and are cached.
+    """
+    monkeypatch.setattr(server, 'response_cache', LRUCache(1000000, len))
+    c = server.application.data_store.config().write(1000, {'workers': ['catlib']})
+    c.write_spectrum('catlib', 2000, [1, 2, 3])
+
+    monkeypatch.setattr(server.application, 'clients', [MockClient(), MockClient(c.id)])
+    rv = data_api.get('/data/{0}'.format(c.id))
+    assert rv.status_code == httplib.OK
+    assert 'ETag' not in rv.headers
+    assert len(server.response_cache) == 0
+
+    monkeypatch.setattr(server.application, 'clients', [MockClient()])
+    rv = data_api.get('/data/{0}'.format(c.id))
+    assert 'ETag' in rv.headers
+    assert len(server.response_cache) == 1
+    rv = data_api.get('/data/{0}'.format(c.id), headers={'If-None-Match': rv.headers['ETag']})
+    assert rv.status_code == httplib.NOT_MODIFIED
+
+    # there is no Last-Modified time to validate against (data such as errors may change
+    # without changing the latest timestamp)
+    assert 'Last-Modified' not in rv.headers
+    c.write_error('catlib', 1500, 'Timeout')
+    rv = data_api.get('/data/{0}'.format(c.id), headers={'If-Modified-Since': 'Thu, 01 Jan 2099 00:00:00 GMT'})
+    assert rv.status_code == httplib.OK
+
+
+def test_events(data_api, monkeypatch):
+    """ Test the limit on open status event streams.
+    """
+    monkeypatch.setattr(server, 'event_streams', BoundedSemaphore(1))
+    rv = data_api.get('/events')
+    assert rv.status_code == httplib.OK
+    assert data_api.get('/events').status_code == httplib.SERVICE_UNAVAILABLE
+    rv.close()
+    rv = data_api.get('/events')
+    assert rv.status_code == httplib.OK
+    rv.close()
@@ -0,0 +1,72 @@
+from spectrum.verify import VerifyPolicy
+
+
+class FakeRig(object):
+    """ Rig which fails to change frequency when told to (set by the test).
+    """
+    def __init__(self):
+        self.freq = None
+        self.fail = 0
+        self.calls = {'set': 0, 'get': 0}
+
+    def set_freq(self, freq):
+        self.calls['set'] += 1
+        if self.fail > 0:
+            self.fail -= 1
+        else:
+            self.freq = freq
+
+    def get_freq(self):
+        self.calls['get'] += 1
+        return self.freq
+
+
+def _set(policy, rig, freq, set_check=2):
+    return policy.set(freq, rig.set_freq, rig.get_freq, set_check)
+
+
+def test_always():
+    policy, rig = VerifyPolicy('always'), FakeRig()
+    for freq in (100, 200, 200):
+        assert _set(policy, rig, freq)
+    assert rig.calls == {'set': 3, 'get': 3}
+    rig.fail = 1
+    assert _set(policy, rig, 300) and rig.freq == 300
+    rig.fail = 2
+    assert not _set(policy, rig, 400)
+    assert policy.stats == {'sets': 7, 'skipped': 0, 'verified': 7, 'mismatches': 3, 'errors': 0}
+    assert policy.mismatch_rate() == 3.0 / 7
+    assert _set(policy, rig, 500, set_check=0) and rig.calls['get'] == 7
+
+
+def test_sampled():
+    policy, rig = VerifyPolicy('sampled', 4), FakeRig()
+    for freq in xrange(8):
+        assert _set(policy, rig, freq)
+    assert rig.calls == {'set': 8, 'get': 3} # the first set, the 4th and the 8th
+    rig.fail = 1
+    assert _set(policy, rig, 8) # not verified
+    assert rig.freq == 7
+    for freq in xrange(9, 12):
+        _set(policy, rig, freq)
+    assert rig.calls['get'] == 4 and rig.freq == 11 # 12th set verified
+    policy.error()
+    _set(policy, rig, 12)
+    assert rig.calls['get'] == 5 # verified after an error
+    _set(policy, rig, 13)
+    assert rig.calls['get'] == 5
+
+
+def test_tracked():
+    policy, rig = VerifyPolicy('tracked'), FakeRig()
+    for freq in (100, 100, 100, 200, 200):
+        assert _set(policy, rig, freq)
+    assert rig.calls == {'set': 2, 'get': 2}
+    assert policy.stats['skipped'] == 3
+    policy.error()
+    assert _set(policy, rig, 200)
+    assert rig.calls == {'set': 3, 'get': 3}
+    rig.fail = 2
+    assert not _set(policy, rig, 300)
+    assert _set(policy, rig, 300) # not skipped after a mismatch
+    assert rig.calls == {'set': 6, 'get': 6}
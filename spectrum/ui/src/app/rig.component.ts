@@ -66,6 +66,24 @@ import { WidgetBase } from './widget.base';
            <option value="3">Set and check up to three times</option>
          </select>
        </div>
+       <div class="form-group">
+         <div class="psm-input-group">
+           <label for="verify">Check frequency</label>
+           <select psmInput class="form-control" [(ngModel)]="values.verify" name="verify">
+             <option value="always">Every time</option>
+             <option value="sampled">Sampled, and after errors</option>
+             <option value="tracked">Only when changed</option>
+           </select>
+         </div>
+         <div class="psm-input-group">
+           <label for="verify_every">Sampled checks</label>
+           <select psmInput class="form-control" [disabled]="values.verify != 'sampled'" [(ngModel)]="values.verify_every" name="verify_every">
+             <option value="4">Every 4th</option>
+             <option value="8">Every 8th</option>
+             <option value="16">Every 16th</option>
+           </select>
+         </div>
+       </div>
        <div class="form-group">
          <label for="retries">Error handling</label>
          <select psmInput class="form-control" [(ngModel)]="values.retries" name="retries">
@@ -8,9 +8,36 @@ export class StatusService {
   // an observable for status updates
   private statusUpdates: Subject<any> = new Subject<any>();
 
+  // the latest status, to which changes pushed from the server are applied
+  private status: any = { };
+
   constructor (private dataService: DataService) {}
 
   public run(tick_interval: number) {
+    if (typeof EventSource == 'undefined') {
+      this.poll(tick_interval);
+      return;
+    }
+    let events = new EventSource('/events');
+    events.onmessage = (event: MessageEvent) => {
+      let changes = JSON.parse(event.data);
+      for (let key in changes) {
+        if (changes[key] == null) {
+          delete this.status[key];
+        } else {
+          this.status[key] = changes[key];
+        }
+      }
+      this.statusUpdates.next(Object.assign({ }, this.status));
+    };
+    events.onerror = () => {
+      // fall back to polling (which goes to the login page if the session has timed out)
+      events.close();
+      this.poll(tick_interval);
+    };
+  }
+
+  private poll(tick_interval: number) {
     setInterval(this.monitor.bind(this), tick_interval);
   }
 
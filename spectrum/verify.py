@@ -0,0 +1,70 @@
+""" Policies for verifying that the rig has been set to a frequency.
+"""
+
+# 'always' - read back the frequency after every set
+# 'sampled' - read back after every Nth set, and after errors or mismatches until one matches
+# 'tracked' - skip setting a frequency the rig is known to be on, read back after other sets
+VERIFY_MODES = ('always', 'sampled', 'tracked')
+
+
+class VerifyPolicy(object):
+    """ Set rig frequencies, reading them back as the mode requires, and keep statistics of
+        sets, verifications and mismatches (so the cheapest safe mode for a rig model can be
+        chosen).
+    """
+    def __init__(self, mode='always', every=8):
+        if mode not in VERIFY_MODES:
+            raise ValueError("Bad verify mode: {0}".format(mode))
+        self.mode = mode
+        self.every = max(1, int(every))
+        self.freq = None # frequency the rig is known to be on, if any
+        self._suspect = True # whether to verify the next set (until one is verified)
+        self._count = 0
+        self.stats = {'sets': 0, 'skipped': 0, 'verified': 0, 'mismatches': 0, 'errors': 0}
+
+    def set(self, freq, set_freq, get_freq, set_check=1, pause=None):
+        """ Set the given frequency using set_freq(freq), and if verifying, check it with
+            get_freq(), trying up to set_check times (calling pause(n) after the nth
+            mismatch). Return whether the frequency was set (or is assumed to be). Errors
+            raised by set_freq or get_freq should be reported with error().
+        """
+        if self.mode == 'tracked' and not self._suspect and freq == self.freq:
+            self.stats['skipped'] += 1
+            return True
+        self._count += 1
+        self.freq = None # until set
+        verify = set_check > 0 and (self.mode != 'sampled' or self._suspect or self._count % self.every == 0)
+        if not verify:
+            set_freq(freq)
+            self.stats['sets'] += 1
+            self.freq = freq
+            return True
+        for checks in xrange(set_check):
+            set_freq(freq)
+            self.stats['sets'] += 1
+            self.stats['verified'] += 1
+            if get_freq() == freq:
+                self.freq = freq
+                self._suspect = False
+                return True
+            self.stats['mismatches'] += 1
+            self._suspect = True
+            if pause is not None:
+                pause(checks)
+        return False
+
+    def error(self):
+        """ Record an error communicating with the rig, after which the rig frequency is
+            unknown (and the next set is verified).
+        """
+        self.stats['errors'] += 1
+        self.freq = None
+        self._suspect = True
+
+    def mismatch_rate(self):
+        """ Return the fraction of verifications that found a mismatch (None if none have
+            been made).
+        """
+        if self.stats['verified'] == 0:
+            return None
+        return float(self.stats['mismatches']) / self.stats['verified']
@@ -26,7 +26,9 @@ def convert(dir_path, wav_filename):
         os.remove(tmp_path)
 
 def walk_convert(root_dir):
-    """ Walk the file system starting at root_dir, converting wav files to mp3.
+    """ Walk the file system starting at root_dir, converting wav files to mp3. The
+        modification time of each top level directory in which files are converted is
+        updated (so that the server can tell that the samples of a config have changed).
     """
     log.info("Walking from path: %s", root_dir)
     for dir_path, _, filenames in os.walk(root_dir):
@@ -35,4 +37,7 @@ def walk_convert(root_dir):
                 wav_path, mp3_path = convert(dir_path, filename)
                 if wav_path is not None and os.path.exists(mp3_path):
                     os.remove(wav_path)
+                    top = os.path.relpath(dir_path, root_dir).split(os.sep)[0]
+                    if top != os.curdir:
+                        os.utime(os.path.join(root_dir, top), None)
     log.info("Done")
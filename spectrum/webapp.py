@@ -4,6 +4,7 @@ import os
 from spectrum.event import EVENT_INIT
 from spectrum.common import log, psm_name
 from spectrum.secure import SecureStaticFlask
+from spectrum.process import StatusWatcher
 from spectrum.config import VERSION_FILE, DEFAULT_AUDIO_SETTINGS, DEFAULT_AMS_SETTINGS, DEFAULT_RDS_SETTINGS, DEFAULT_SDR_SETTINGS, DEFAULT_HAMLIB_SETTINGS, DEFAULT_RIG_SETTINGS
 
 class WebApplication(SecureStaticFlask): # pylint: disable=too-many-instance-attributes
@@ -31,6 +32,7 @@ class WebApplication(SecureStaticFlask): # pylint: disable=too-many-instance-att
         self.rig = self.data_store.settings('rig').read(DEFAULT_RIG_SETTINGS)
         self.description = self.data_store.settings('description').read('')
         self.clients = clients
+        self.status_watcher = StatusWatcher(clients)
         self.event_client = event_client
         self._init_ident()
 